@@ -0,0 +1,4 @@
+"""
+Benchmarks are kept out of the app packages, so they are not run or measured as part of the unit tests. To run them:
+    ./manage.py test -p '*_benchmarks.py' benchmarks
+"""
@@ -0,0 +1,68 @@
+import mock
+import os
+import random
+import tempfile
+from django.test import TestCase
+from time import time
+
+from benchmarks.utils import logger, peak_memory_mb
+from seqr.models import Family, Individual, RnaSeqTpm
+from seqr.views.utils.dataset_utils import load_rna_seq_tpm, copy_rna_seq_sample_data
+
+NUM_SAMPLES = 1000
+# Production TPM files have ~60k genes per sample, the benchmark uses fewer to keep the run time reasonable
+NUM_GENES = 500
+
+
+@mock.patch('seqr.views.utils.dataset_utils.ANALYST_PROJECT_CATEGORY', 'analyst-projects')
+@mock.patch('seqr.views.utils.dataset_utils.tqdm', lambda rows, **kwargs: rows)
+class DatasetUtilsBenchmark(TestCase):
+    databases = '__all__'
+    fixtures = ['users', '1kg_project']
+
+    def test_load_rna_seq_tpm(self):
+        sample_ids = [f'RNA{i:05d}' for i in range(NUM_SAMPLES)]
+        family = Family.objects.create(project_id=1, family_id='RNA_BENCHMARK', guid='F000100_rna_benchmark')
+        Individual.objects.bulk_create([
+            Individual(family=family, individual_id=sample_id, guid=f'I{i:07d}_{sample_id.lower()}')
+            for i, sample_id in enumerate(sample_ids)
+        ])
+
+        rng = random.Random(0)
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        file_path = os.path.join(temp_dir.name, 'synthetic_tpms.tsv')
+        first_sample_tpms = {}
+        with open(file_path, 'w') as f:
+            f.write('sample_id\tgene_id\ttissue\tTPM\n')
+            # Rows are ordered by gene, so each sample's rows are spread across the whole file
+            for gene_index in range(NUM_GENES):
+                gene_id = f'ENSG{gene_index:011d}'
+                for sample_id in sample_ids:
+                    tpm = f'{rng.uniform(0.01, 1000):.3f}'
+                    if sample_id == sample_ids[0]:
+                        first_sample_tpms[gene_id] = float(tpm)
+                    f.write(f'{sample_id}\t{gene_id}\tmuscle\t{tpm}\n')
+
+        staging_dir = os.path.join(temp_dir.name, 'staged')
+        os.makedirs(staging_dir)
+        start = time()
+        samples_to_load, _, _ = load_rna_seq_tpm(file_path, staging_dir)
+        parse_time = time() - start
+        for sample, sample_file in samples_to_load.items():
+            copy_rna_seq_sample_data(RnaSeqTpm, sample, sample_file)
+        copy_time = time() - start - parse_time
+
+        self.assertEqual(len(samples_to_load), NUM_SAMPLES)
+        self.assertEqual(RnaSeqTpm.objects.filter(sample__in=samples_to_load).count(), NUM_SAMPLES * NUM_GENES)
+        self.assertDictEqual({
+            tpm.gene_id: tpm.tpm for tpm in RnaSeqTpm.objects.filter(sample__sample_id=sample_ids[0])
+        }, first_sample_tpms)
+
+        staged_dir = os.path.join(temp_dir.name, 'staged_memory')
+        os.makedirs(staged_dir)
+        # All samples are now loaded, so this measures parsing and staging
+        staged_peak = peak_memory_mb(lambda: load_rna_seq_tpm(file_path, staged_dir))
+
+        logger.info('Loaded {} rows for {} samples: {:.1f}s parse + {:.1f}s COPY, {:.0f}MB peak parse memory'.format(
+            NUM_SAMPLES * NUM_GENES, NUM_SAMPLES, parse_time, copy_time, staged_peak))
@@ -0,0 +1,122 @@
+import mock
+import random
+from django.test import TestCase
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.response import Response
+
+from benchmarks.utils import logger, mean_time
+from seqr.models import Family
+from seqr.utils.elasticsearch.es_search import EsSearch
+from seqr.utils.elasticsearch.es_utils_tests import MOCK_REDIS, ES_VARIANTS, INDEX_NAME, PARSED_NO_SORT_VARIANTS, \
+    setup_responses, mock_hits
+from seqr.views.utils.test_utils import urllib3_responses
+
+NUM_HITS = 10000
+NUM_RUNS = 3
+
+GENE_ID = 'ENSG00000135953'
+VARIANTS_PER_FAMILY = 80
+NUM_FAMILIES = 20
+FAMILY_SIZE = 4
+ALLOWED_CONSEQUENCES = ['frameshift_variant', 'stop_gained']
+ALLOWED_CONSEQUENCES_SECONDARY = ['missense_variant']
+CONSEQUENCES = ALLOWED_CONSEQUENCES + ALLOWED_CONSEQUENCES_SECONDARY + ['synonymous_variant']
+
+# A small gene bucket with its recorded valid pairs, with and without a paired index. Variant 3 is hom alt and overlapped
+# by the deletion in variant 4, and the unaffected individual carries variants 0 and 1
+COMPOUND_HET_VARIANTS = [
+    {'variantId': 'V0', 'pos': 100, 'genotypes': {'I1': {'numAlt': 1}, 'I2': {'numAlt': 1}},
+     'gene_consequences': {GENE_ID: ['frameshift_variant']}},
+    {'variantId': 'V1', 'pos': 200, 'genotypes': {'I1': {'numAlt': 1}, 'I2': {'numAlt': 1}},
+     'gene_consequences': {GENE_ID: ['missense_variant']}},
+    {'variantId': 'V2', 'pos': 300, 'genotypes': {'I1': {'numAlt': 1}, 'I2': {'numAlt': 0}},
+     'gene_consequences': {GENE_ID: ['missense_variant']}},
+    {'variantId': 'V3', 'pos': 1000, 'genotypes': {'I1': {'numAlt': 2}, 'I2': {'numAlt': 0}},
+     'gene_consequences': {GENE_ID: ['frameshift_variant']}},
+    {'variantId': 'V4', 'pos': 500, 'end': 2000, 'svType': 'DEL', 'genotypes': {'I1': {'numAlt': 1}, 'I2': {'numAlt': 0}},
+     'gene_consequences': {GENE_ID: ['missense_variant']}},
+]
+COMPOUND_HET_PAIR_INDICES = {
+    False: [[0, 2], [0, 4], [1, 3], [2, 3], [3, 4]],
+    True: [[0, 2], [0, 4], [3, 4]],
+}
+
+
+def _synthetic_gene_bucket(rng):
+    """Builds a gene with many candidate variants across many families, including SV deletions and hom alt calls"""
+    family_individuals = {
+        'F{}'.format(family): ['I{}_{}'.format(family, individual) for individual in range(FAMILY_SIZE)]
+        for family in range(NUM_FAMILIES)
+    }
+    family_unaffected_individual_guids = {
+        family_guid: set(individuals[1:3]) for family_guid, individuals in family_individuals.items()
+    }
+
+    family_compound_het_pairs = {}
+    for family_guid, individuals in family_individuals.items():
+        variants = []
+        for i in range(VARIANTS_PER_FAMILY):
+            pos = rng.randint(1, 100000)
+            variant = {
+                'variantId': '{}-{}'.format(family_guid, i),
+                'pos': pos,
+                'genotypes': {
+                    individual_guid: {'numAlt': rng.choice([0, 0, 1, 1, 2]) if individual_guid != individuals[0] else 1}
+                    for individual_guid in individuals if rng.random() < 0.9
+                },
+                'gene_consequences': {GENE_ID: rng.sample(CONSEQUENCES, rng.randint(1, 2))},
+            }
+            if rng.random() < 0.1:
+                variant.update({'svType': 'DEL', 'end': pos + rng.randint(100, 20000)})
+            variants.append(variant)
+        family_compound_het_pairs[family_guid] = variants
+    return family_compound_het_pairs, family_unaffected_individual_guids
+
+
+@mock.patch('seqr.utils.redis_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
+class EsSearchBenchmark(TestCase):
+    databases = '__all__'
+    fixtures = ['users', '1kg_project', 'reference_data']
+
+    @urllib3_responses.activate
+    def test_parse_hits(self):
+        setup_responses()
+        es_search = EsSearch(Family.objects.filter(guid__in=['F000003_3', 'F000002_2', 'F000005_5']))
+
+        response = Response(Search(), {'took': 1, 'hits': {'total': {'value': 2}, 'hits': mock_hits(ES_VARIANTS, index=INDEX_NAME)}})
+        self.assertListEqual(es_search._parse_hits(response), PARSED_NO_SORT_VARIANTS)
+
+        hits = mock_hits(ES_VARIANTS, index=INDEX_NAME) * (NUM_HITS // len(ES_VARIANTS))
+        response = Response(Search(), {'took': 1, 'hits': {'total': {'value': len(hits)}, 'hits': hits}})
+        parse_time = mean_time(lambda: es_search._parse_hits(response), NUM_RUNS)
+        logger.info('Parsed {} hits in {:.3f}s ({:.0f} hits/s)'.format(len(hits), parse_time, len(hits) / parse_time))
+
+    @urllib3_responses.activate
+    def test_filter_invalid_family_compound_hets(self):
+        setup_responses()
+        es_search = EsSearch(Family.objects.filter(guid__in=['F000003_3', 'F000002_2', 'F000005_5']))
+        es_search._allowed_consequences = ALLOWED_CONSEQUENCES
+        es_search._allowed_consequences_secondary = ALLOWED_CONSEQUENCES_SECONDARY
+        family_compound_het_pairs, family_unaffected_individual_guids = _synthetic_gene_bucket(random.Random(0))
+
+        for paired_index_comp_het in [False, True]:
+            es_search._paired_index_comp_het = paired_index_comp_het
+
+            family_pairs = {'F1': list(COMPOUND_HET_VARIANTS)}
+            es_search._filter_invalid_family_compound_hets(GENE_ID, family_pairs, {'F1': {'I2'}})
+            self.assertListEqual(family_pairs['F1'], [
+                [COMPOUND_HET_VARIANTS[i], COMPOUND_HET_VARIANTS[j]]
+                for i, j in COMPOUND_HET_PAIR_INDICES[paired_index_comp_het]
+            ])
+
+            def _filter():
+                family_pairs = {
+                    family_guid: list(variants) for family_guid, variants in family_compound_het_pairs.items()}
+                es_search._filter_invalid_family_compound_hets(GENE_ID, family_pairs, family_unaffected_individual_guids)
+                return family_pairs
+
+            num_pairs = sum(len(pairs) for pairs in _filter().values())
+            filter_time = mean_time(_filter, NUM_RUNS)
+            logger.info('Filtered {} compound het pairs from {} variants (paired index: {}) in {:.3f}s'.format(
+                num_pairs, sum(len(variants) for variants in family_compound_het_pairs.values()),
+                paired_index_comp_het, filter_time))
@@ -0,0 +1,50 @@
+import mock
+import random
+import string
+from django.test import TestCase
+from time import time
+
+from benchmarks.utils import logger, p95_ms
+from reference_data.models import GeneInfo
+from seqr.utils.gene_utils import get_queried_genes, REFERENCE_DATA_INDEX_CACHE
+
+NUM_GENES = 60000
+MAX_RESULTS = 8
+# Every prefix of each typed query is searched, as it would be for each keystroke in the awesomebar
+TYPED_QUERIES = [
+    'BRCA2', 'ENSG00000139618', 'OR4F5', 'ZNF717', 'KCNQ1OT1', 'XYZ123', 'TTN', 'C9orf72', 'HLA-DRB1', 'MT-ND1',
+    'Metazoa_SRP', 'c9ORF', 'a.2',
+]
+# Symbols include lower case letters and punctuation, so matching is not only on upper case symbols
+SYMBOL_CHARACTERS = string.ascii_uppercase * 3 + string.digits + string.ascii_lowercase + '-._'
+
+
+@mock.patch('seqr.utils.gene_utils.safe_redis_get_json', lambda *args: None)
+class GeneUtilsBenchmark(TestCase):
+    databases = '__all__'
+
+    def test_get_queried_genes(self):
+        rng = random.Random(0)
+        symbols = {query for query in TYPED_QUERIES if not query.startswith('ENSG')}
+        while len(symbols) < NUM_GENES:
+            symbols.add(''.join(rng.choice(SYMBOL_CHARACTERS) for _ in range(rng.randint(3, 9))))
+        GeneInfo.objects.bulk_create([
+            GeneInfo(gene_id='ENSG{:011d}'.format(139618 + i * 7), gene_symbol=symbol)
+            for i, symbol in enumerate(sorted(symbols))
+        ], batch_size=10000)
+
+        queries = [query[:i] for query in TYPED_QUERIES for i in range(1, len(query) + 1)]
+        REFERENCE_DATA_INDEX_CACHE.clear()
+        start = time()
+        get_queried_genes('A', MAX_RESULTS)
+        build_time = time() - start
+
+        # The shortest matching symbol is ranked first, so an exact symbol match is always the top result
+        for query in TYPED_QUERIES:
+            if not query.startswith('ENSG'):
+                self.assertEqual(get_queried_genes(query, MAX_RESULTS)[0]['gene_symbol'].upper(), query.upper())
+        self.assertEqual(get_queried_genes('ENSG00000139618', MAX_RESULTS)[0]['gene_id'], 'ENSG00000139618')
+
+        index_p95 = p95_ms(get_queried_genes, [(query, MAX_RESULTS) for query in queries])
+        logger.info('Searched {} genes for {} keystrokes: {:.2f}ms p95. Built the index in {:.2f}s'.format(
+            NUM_GENES, len(queries), index_p95, build_time))
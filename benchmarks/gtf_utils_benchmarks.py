@@ -0,0 +1,80 @@
+import gzip
+import os
+import random
+import tempfile
+from django.test import SimpleTestCase
+from time import time
+
+from benchmarks.utils import logger
+from reference_data.management.commands.utils.gtf_utils import parse_gencode_annotations, read_annotations_cache, \
+    write_annotations_cache, iter_annotation_rows, GENE_FEATURE_TYPE, TRANSCRIPT_FEATURE_TYPE
+
+# Gencode has ~60k genes and ~3M lines, the benchmark uses fewer to keep the run time reasonable
+NUM_GENES = 10000
+TRANSCRIPTS_PER_GENE = 3
+EXONS_PER_TRANSCRIPT = 8
+INFO_TEMPLATE = 'gene_id "{gene_id}.5"; transcript_id "{transcript_id}.2"; gene_type "protein_coding"; ' \
+                'gene_name "GENE{index}"; transcript_type "protein_coding"; transcript_name "GENE{index}-20{t}"; ' \
+                'level 2; protein_id "ENSP{index:011d}.1"; transcript_support_level "1"; hgnc_id "HGNC:{index}"; ' \
+                'tag "basic"; tag "CCDS"; havana_gene "OTTHUMG{index:011d}.2"; havana_transcript "OTTHUMT{index:011d}.1";'
+
+
+def _write_synthetic_gtf(file_path):
+    rng = random.Random(0)
+    with gzip.open(file_path, 'wt') as f:
+        f.write('##description: synthetic gencode annotation\n')
+        for index in range(NUM_GENES):
+            chrom = 'chr{}'.format(rng.randint(1, 22))
+            gene_start = rng.randint(1, 200000000)
+            gene_id = 'ENSG{:011d}'.format(index)
+            gene_info = 'gene_id "{}.5"; gene_type "protein_coding"; gene_name "GENE{}"; level 2;'.format(gene_id, index)
+            f.write('\t'.join([chrom, 'HAVANA', 'gene', str(gene_start), str(gene_start + 40000), '.', '+', '.', gene_info]) + '\n')
+            for t in range(TRANSCRIPTS_PER_GENE):
+                info = INFO_TEMPLATE.format(gene_id=gene_id, transcript_id='ENST{:011d}'.format(index * 10 + t), index=index, t=t)
+                lines = [('transcript', gene_start, gene_start + 40000)]
+                for exon in range(EXONS_PER_TRANSCRIPT):
+                    exon_start = gene_start + exon * 5000
+                    lines.append(('exon', exon_start, exon_start + 200))
+                    if 0 < exon < EXONS_PER_TRANSCRIPT - 1:
+                        lines.append(('CDS', exon_start, exon_start + 200))
+                lines += [('UTR', gene_start, gene_start + 100), ('start_codon', gene_start + 5000, gene_start + 5002)]
+                for feature_type, start, end in lines:
+                    f.write('\t'.join([chrom, 'HAVANA', feature_type, str(start), str(end), '.', '+', '.', info]) + '\n')
+
+
+class GtfUtilsBenchmark(SimpleTestCase):
+
+    def test_parse_gencode_annotations(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        file_path = os.path.join(temp_dir.name, 'gencode.synthetic.annotation.gtf.gz')
+        _write_synthetic_gtf(file_path)
+        with gzip.open(file_path, 'rt') as f:
+            num_lines = sum(1 for _ in f)
+
+        start = time()
+        with gzip.open(file_path, 'rt') as f:
+            annotations = parse_gencode_annotations(f)
+        stream_parse_time = time() - start
+        self.assertEqual(len(annotations['genes']['gene_id']), NUM_GENES)
+        self.assertEqual(len(annotations['transcripts']['transcript_id']), NUM_GENES * TRANSCRIPTS_PER_GENE)
+        self.assertSetEqual(set(annotations['transcripts']['coding_region_size']), {201 * (EXONS_PER_TRANSCRIPT - 2)})
+        self.assertTupleEqual(
+            next(iter_annotation_rows(annotations, GENE_FEATURE_TYPE)),
+            ('ENSG00000000000', 'GENE0', 'protein_coding', '13', 112896326, 112936326, '+'))
+        self.assertTupleEqual(
+            next(iter_annotation_rows(annotations, TRANSCRIPT_FEATURE_TYPE)),
+            ('ENST00000000000', 'ENSG00000000000', '13', 112896326, 112936326, '+', 1206))
+
+        cache_path = os.path.join(temp_dir.name, 'gencode.synthetic.annotations.json.gz')
+        with open(cache_path, 'wb') as f:
+            write_annotations_cache(annotations, f)
+        start = time()
+        with open(cache_path, 'rb') as f:
+            self.assertDictEqual(read_annotations_cache(f), annotations)
+        cache_load_time = time() - start
+
+        logger.info('Parsed {} GTF lines ({:.0f}MB gzipped) in {:.1f}s ({:.0f} lines/s). Loaded the cached columns '
+                    '({:.1f}MB) in {:.2f}s'.format(
+                        num_lines, os.path.getsize(file_path) / 1024 / 1024, stream_parse_time,
+                        num_lines / stream_parse_time, os.path.getsize(cache_path) / 1024 / 1024, cache_load_time))
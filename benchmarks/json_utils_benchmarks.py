@@ -0,0 +1,42 @@
+from copy import deepcopy
+import json
+import mock
+from django.test import TestCase
+
+from benchmarks.utils import logger, mean_time
+from seqr.views.utils.json_utils import create_json_response
+from seqr.views.utils.test_utils import VARIANTS, PARSED_VARIANTS, PARSED_SV_VARIANT
+
+NUM_VARIANTS = 10000
+NUM_RUNS = 5
+
+
+class JsonUtilsBenchmark(TestCase):
+
+    def test_create_json_response(self):
+        # A search response sized like a large search results or saved variants page
+        variants = []
+        for i in range(NUM_VARIANTS):
+            variant = deepcopy((VARIANTS + PARSED_VARIANTS + [PARSED_SV_VARIANT])[i % 6])
+            variant['variantId'] = '{}-{}'.format(variant['variantId'], i)
+            variant['familyGuids'] = set(variant['familyGuids'])
+            variants.append(variant)
+        response_json = {
+            'searchedVariants': variants,
+            'savedVariantsByGuid': {
+                'SV{}'.format(i): {'variantGuid': 'SV{}'.format(i), 'tagGuids': {'VT1', 'VT2'}}
+                for i in range(NUM_VARIANTS)
+            },
+        }
+
+        compact_response = create_json_response(response_json)
+        with mock.patch('seqr.views.utils.json_utils.PRETTY_PRINT_JSON_RESPONSES', True):
+            pretty_response = create_json_response(response_json)
+        self.assertEqual(json.loads(compact_response.content), json.loads(pretty_response.content))
+
+        compact_time = mean_time(lambda: create_json_response(response_json), NUM_RUNS)
+        with mock.patch('seqr.views.utils.json_utils.PRETTY_PRINT_JSON_RESPONSES', True):
+            pretty_time = mean_time(lambda: create_json_response(response_json), NUM_RUNS)
+        logger.info('Encoded {} variants: {:.3f}s and {:.1f}MB pretty printed, {:.3f}s and {:.1f}MB compact ({:.1f}x)'.format(
+            NUM_VARIANTS, pretty_time, len(pretty_response.content) / 10 ** 6, compact_time,
+            len(compact_response.content) / 10 ** 6, pretty_time / compact_time))
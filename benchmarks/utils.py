@@ -0,0 +1,31 @@
+import logging
+import tracemalloc
+from time import time
+from timeit import timeit
+
+logger = logging.getLogger('benchmarks')
+# The default log level is warning, and results are logged as info
+logger.setLevel(logging.INFO)
+
+
+def mean_time(func, number):
+    return timeit(func, number=number) / number
+
+
+def p95_ms(func, args_list):
+    times = []
+    for args in args_list:
+        start = time()
+        func(*args)
+        times.append((time() - start) * 1000)
+    return sorted(times)[int(len(times) * 0.95)]
+
+
+def peak_memory_mb(func):
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
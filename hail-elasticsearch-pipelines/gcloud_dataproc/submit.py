@@ -5,6 +5,9 @@ import os
 import subprocess
 import tempfile
 
+# The gencode GTF reader is shared with seqr's reference data commands, and is added to the root of the scripts zip
+SEQR_GTF_UTILS_PATH = '../reference_data/management/commands/utils/gtf_utils.py'
+
 
 def submit(script, script_args_list, cluster='no-vep', wait_for_job=True, use_existing_scripts_zip=False, region=None, spark_env=None, job_id=None):
     script_args = " ".join(['"%s"' % arg for arg in script_args_list])
@@ -17,6 +20,7 @@ def submit(script, script_args_list, cluster='no-vep', wait_for_job=True, use_ex
     else:
         os.system(
             "zip -r %(hail_scripts_zip)s hail_scripts kubernetes sv_pipeline download_and_create_reference_datasets/v02/hail_scripts" % locals())
+        os.system("zip -j %(hail_scripts_zip)s %(SEQR_GTF_UTILS_PATH)s" % dict(locals(), SEQR_GTF_UTILS_PATH=SEQR_GTF_UTILS_PATH))
 
     command = f"""gcloud dataproc jobs submit pyspark \
       --cluster={cluster} \
@@ -1,12 +1,26 @@
 import gzip
+import importlib.util
+import io
 import logging
 import os
-import pickle
+import sys
 from tqdm import tqdm
 
 from sv_pipeline.genome.utils.download_utils import download_file, path_exists, is_gs_path, file_writer
 from sv_pipeline.utils.common import stream_gs_file
 
+# The gencode GTF reader is shared with seqr. On dataproc it is added to the root of the scripts zip by
+# gcloud_dataproc/submit.py, otherwise it is loaded from the seqr checkout
+SEQR_GTF_UTILS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '../../../../reference_data/management/commands/utils/gtf_utils.py')
+if importlib.util.find_spec('gtf_utils') is None:
+    _gtf_utils_spec = importlib.util.spec_from_file_location('gtf_utils', SEQR_GTF_UTILS_PATH)
+    sys.modules['gtf_utils'] = importlib.util.module_from_spec(_gtf_utils_spec)
+    _gtf_utils_spec.loader.exec_module(sys.modules['gtf_utils'])
+
+from gtf_utils import parse_gencode_annotations, iter_annotation_rows, get_annotations_cache_file_name, \
+    read_annotations_cache, write_annotations_cache, GENE_FEATURE_TYPE  # noqa: E402
+
 GENOME_VERSION_GRCh37 = "37"
 GENOME_VERSION_GRCh38 = "38"
 
@@ -14,30 +28,32 @@ logger = logging.getLogger(__name__)
 
 GENCODE_GTF_URL = "http://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_{gencode_release}/gencode.v{gencode_release}.annotation.gtf.gz"
 
-# expected GTF file header
-GENCODE_FILE_HEADER = [
-    'chrom', 'source', 'feature_type', 'start', 'end', 'score', 'strand', 'phase', 'info'
-]
 
+def _get_cache_file(gencode_gtf_path, gencode_release):
+    return os.path.join(
+        os.path.dirname(gencode_gtf_path), get_annotations_cache_file_name(gencode_release, GENOME_VERSION_GRCh38))
 
-def _get_pickle_file(path):
-    root, ext = os.path.splitext(path)
-    return root + '.pickle'
+
+def _get_gene_id_mapping(annotations):
+    return {gene_symbol: gene_id for gene_id, gene_symbol, *_ in iter_annotation_rows(annotations, GENE_FEATURE_TYPE)}
 
 
 def _load_parsed_data_or_download(gencode_release, download_path):
     gene_id_mapping = {}
     url = GENCODE_GTF_URL.format(gencode_release=gencode_release)
     gencode_gtf_path = os.path.join(download_path, os.path.basename(url))
-    pickle_file = _get_pickle_file(gencode_gtf_path)
-    if path_exists(pickle_file):
-        logger.info('Use the existing pickle file {}.\nIf you want to reload the data, please delete it and re-run the data loading.'.format(pickle_file))
-        if is_gs_path(pickle_file):
-            p = pickle.loads(stream_gs_file(pickle_file))
+    cache_file = _get_cache_file(gencode_gtf_path, gencode_release)
+    annotations = None
+    if path_exists(cache_file):
+        if is_gs_path(cache_file):
+            annotations = read_annotations_cache(io.BytesIO(stream_gs_file(cache_file, raw_download=True)))
         else:
-            with open(pickle_file, 'rb') as handle:
-                p = pickle.load(handle)
-        gene_id_mapping.update(p)
+            with open(cache_file, 'rb') as handle:
+                annotations = read_annotations_cache(handle)
+
+    if annotations is not None:
+        logger.info('Use the existing cache file {}.\nIf you want to reload the data, please delete it and re-run the data loading.'.format(cache_file))
+        gene_id_mapping.update(_get_gene_id_mapping(annotations))
     elif not path_exists(gencode_gtf_path):
         gencode_gtf_path = download_file(url, to_dir=download_path)
         logger.info('Downloaded to {}'.format(gencode_gtf_path))
@@ -47,42 +63,22 @@ def _load_parsed_data_or_download(gencode_release, download_path):
     return gene_id_mapping, gencode_gtf_path
 
 
-def _parse_gtf_data(gencode_gtf_path):
-    gene_id_mapping = {}
+def _parse_gtf_data(gencode_gtf_path, gencode_release):
     logger.info("Loading {}".format(gencode_gtf_path))
-    is_gs = is_gs_path(gencode_gtf_path)
-    gencode_file = gzip.decompress(stream_gs_file(gencode_gtf_path, raw_download=True)).decode().split('\n') \
-        if is_gs else gzip.open(gencode_gtf_path, 'rt')
-    for i, line in enumerate(tqdm(gencode_file, unit=' gencode records')):
-        line = line.rstrip('\r\n')
-        if not line or line.startswith('#'):
-            continue
-        fields = line.split('\t')
-
-        if len(fields) != len(GENCODE_FILE_HEADER):
-            raise ValueError("Unexpected number of fields on line #%s: %s" % (i, fields))
-
-        record = dict(zip(GENCODE_FILE_HEADER, fields))
-
-        if record['feature_type'] != 'gene':
-            continue
-
-        # parse info field
-        info_fields = [x.strip().split() for x in record['info'].split(';') if x != '']
-        info_fields = {k: v.strip('"') for k, v in info_fields}
-
-        gene_id_mapping[info_fields['gene_name']] = info_fields['gene_id'].split('.')[0]
-
-    if not is_gs:
-        gencode_file.close()
+    if is_gs_path(gencode_gtf_path):
+        gencode_file = gzip.decompress(stream_gs_file(gencode_gtf_path, raw_download=True)).decode().split('\n')
+        annotations = parse_gencode_annotations(tqdm(gencode_file, unit=' gencode records'))
+    else:
+        with gzip.open(gencode_gtf_path, 'rt') as gencode_file:
+            annotations = parse_gencode_annotations(tqdm(gencode_file, unit=' gencode records'))
 
-    pickle_file = _get_pickle_file(gencode_gtf_path)
-    logger.info(f'Saving to pickle {pickle_file}')
-    with file_writer(pickle_file) as fw:
+    cache_file = _get_cache_file(gencode_gtf_path, gencode_release)
+    logger.info(f'Saving to cache {cache_file}')
+    with file_writer(cache_file) as fw:
         f, _ = fw
-        pickle.dump(gene_id_mapping, f, protocol=pickle.HIGHEST_PROTOCOL)
+        write_annotations_cache(annotations, f)
 
-    return gene_id_mapping
+    return _get_gene_id_mapping(annotations)
 
 
 def load_gencode(gencode_release, download_path=None):
@@ -95,7 +91,7 @@ def load_gencode(gencode_release, download_path=None):
     gene_id_mapping, gencode_gtf_path = _load_parsed_data_or_download(gencode_release, download_path)
 
     if not gene_id_mapping:
-        gene_id_mapping = _parse_gtf_data(gencode_gtf_path)
+        gene_id_mapping = _parse_gtf_data(gencode_gtf_path, gencode_release)
 
     logger.info('Got {} gene id mapping records'.format(len(gene_id_mapping)))
     return gene_id_mapping
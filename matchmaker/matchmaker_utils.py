@@ -2,11 +2,12 @@ import logging
 from collections import defaultdict
 from copy import deepcopy
 from datetime import datetime
+from threading import Lock
 from django.db.models import prefetch_related_objects, Q
 
-from reference_data.models import HumanPhenotypeOntology
 from matchmaker.models import MatchmakerSubmission, MatchmakerIncomingQuery, MatchmakerResult
 from seqr.utils.gene_utils import get_genes, get_gene_ids_for_gene_symbols, get_filtered_gene_ids
+from seqr.utils.hpo_utils import get_hpo_ontology
 from seqr.views.utils.json_to_orm_utils import create_model_from_json
 from settings import MME_DEFAULT_CONTACT_INSTITUTION
 
@@ -72,7 +73,7 @@ def _get_mme_genes_phenotypes(results, get_features, get_genomic_features, inclu
 
     genes_by_id = get_genes(gene_ids)
 
-    hpo_terms_by_id = {hpo.hpo_id: hpo.name for hpo in HumanPhenotypeOntology.objects.filter(hpo_id__in=hpo_ids)}
+    hpo_terms_by_id = get_hpo_ontology().get_names(hpo_ids)
 
     return hpo_terms_by_id, genes_by_id, gene_symbols_to_ids
 
@@ -181,25 +182,9 @@ def get_mme_matches(patient_data, origin_request_host=None, user=None, originati
     if genomic_features:
         for feature in genomic_features:
             feature['gene_ids'] = get_gene_ids_for_feature(feature, gene_symbols_to_ids)
-        get_submission_kwargs = {
-            'query_ids': list(genes_by_id.keys()),
-            'filter_key': 'genomic_features',
-            'id_filter_func': lambda gene_id: {'gene': {'id': gene_id}},
-        }
-    else:
-        get_submission_kwargs = {
-            'query_ids': feature_ids,
-            'filter_key': 'features',
-            'id_filter_func': lambda feature_id: {'id': feature_id, 'observed': 'yes'},
-        }
 
     query_patient_id = patient_data['patient']['id']
-    scored_matches = _get_matched_submissions(
-        query_patient_id,
-        get_match_genotype_score=lambda match: _get_genotype_score(genomic_features, match) if genomic_features else 0,
-        get_match_phenotype_score=lambda match: _get_phenotype_score(feature_ids, match) if feature_ids else 0,
-        **get_submission_kwargs
-    )
+    scored_matches = _get_matched_submissions(query_patient_id, genomic_features, feature_ids, list(genes_by_id.keys()))
 
     incoming_query = create_model_from_json(MatchmakerIncomingQuery, {
         'institution': patient_data['patient']['contact'].get('institution') or origin_request_host,
@@ -223,53 +208,37 @@ def get_mme_matches(patient_data, origin_request_host=None, user=None, originati
             for match_submission, score in scored_matches.items()], incoming_query
 
 
-def _get_matched_submissions(patient_id, get_match_genotype_score, get_match_phenotype_score, query_ids, filter_key, id_filter_func):
-    if not query_ids:
+def _get_matched_submissions(patient_id, genomic_features, hpo_ids, gene_ids):
+    MME_SUBMISSION_INDEX.refresh()
+    if genomic_features:
+        matches = MME_SUBMISSION_INDEX.get_submissions_for_genes(gene_ids)
+    else:
+        matches = MME_SUBMISSION_INDEX.get_submissions_for_phenotypes(hpo_ids)
+    if not matches:
         # no valid entities found for provided features
         return {}
 
-    matches = []
-    for item_id in query_ids:
-        matches += MatchmakerSubmission.objects.filter(deleted_date__isnull=True, **{
-            '{}__contains'.format(filter_key): [id_filter_func(item_id)]
-        }).exclude(submission_id=patient_id)
-
-    scored_matches = {}
+    scores_by_id = {}
     for match in matches:
-        genotype_score = get_match_genotype_score(match)
-        phenotype_score = get_match_phenotype_score(match)
+        if match.submission_id == patient_id:
+            continue
+        genotype_score = match.get_genotype_score(genomic_features) if genomic_features else 0
+        phenotype_score = match.get_phenotype_score(hpo_ids) if hpo_ids else 0
 
         if genotype_score > 0 or phenotype_score > 0.65:
-            scored_matches[match] = {
+            scores_by_id[match.id] = {
                 '_genotypeScore': genotype_score,
                 '_phenotypeScore': phenotype_score,
                 'patient': 1 if genotype_score == 1 else round(genotype_score * (phenotype_score or 1), 4)
             }
-    return scored_matches
-
-
-def _get_genotype_score(genomic_features, match):
-    match_features_by_gene_id = defaultdict(list)
-    for feature in match.genomic_features:
-        match_features_by_gene_id[feature['gene']['id']].append(feature)
-
-    score = 0
-    for feature in genomic_features:
-        feature_gene_matches = []
-        for gene_id in feature['gene_ids']:
-            feature_gene_matches += match_features_by_gene_id[gene_id]
-        if feature_gene_matches:
-            score += 0.7
-            if feature.get('zygosity') and any(
-                    match_feature.get('zygosity') == feature['zygosity'] for match_feature in feature_gene_matches
-            ):
-                score += 0.15
-            if feature.get('variant') and any(
-                    _is_same_variant(feature['variant'], match_feature['variant'])
-                    for match_feature in feature_gene_matches if match_feature.get('variant')
-            ):
-                score += 0.15
-    return float(score) / len(genomic_features)
+
+    submissions_by_id = {
+        submission.id: submission for submission in MatchmakerSubmission.objects.filter(id__in=scores_by_id.keys())
+    }
+    return {
+        submissions_by_id[submission_id]: score for submission_id, score in scores_by_id.items()
+        if submission_id in submissions_by_id
+    }
 
 
 def _is_same_variant(var1, var2):
@@ -279,14 +248,131 @@ def _is_same_variant(var1, var2):
     return True
 
 
-def _get_phenotype_score(hpo_ids, match):
-    if not match.features:
-        return 0.5
-    matched_hpo_ids = [
-        hpo_id for hpo_id in hpo_ids
-        if any(feature['id'] == hpo_id and feature.get('observed', 'yes') == 'yes' for feature in match.features)
-    ]
-    return float(len(matched_hpo_ids)) / len(hpo_ids) or 0.1
+class _IndexedSubmission(object):
+    """The fields of an active submission used for matching, with its genomic features bucketed by gene"""
+    __slots__ = (
+        'id', 'submission_id', 'last_modified_date', 'features_by_gene_id', 'matchable_hpo_ids', 'observed_hpo_ids',
+        'has_features',
+    )
+
+    def __init__(self, submission):
+        self.id = submission['id']
+        self.submission_id = submission['submission_id']
+        self.last_modified_date = submission['last_modified_date']
+
+        features_by_gene_id = defaultdict(list)
+        for feature in submission['genomic_features'] or []:
+            features_by_gene_id[feature['gene']['id']].append(feature)
+        self.features_by_gene_id = dict(features_by_gene_id)
+
+        features = submission['features'] or []
+        self.has_features = bool(features)
+        # Submissions are only matched on explicitly observed features, but features with no observed status are scored
+        # as observed
+        self.matchable_hpo_ids = {feature['id'] for feature in features if feature.get('observed') == 'yes'}
+        self.observed_hpo_ids = {feature['id'] for feature in features if feature.get('observed', 'yes') == 'yes'}
+
+    def get_genotype_score(self, genomic_features):
+        score = 0
+        for feature in genomic_features:
+            feature_gene_matches = []
+            for gene_id in feature['gene_ids']:
+                feature_gene_matches += self.features_by_gene_id.get(gene_id, [])
+            if feature_gene_matches:
+                score += 0.7
+                if feature.get('zygosity') and any(
+                        match_feature.get('zygosity') == feature['zygosity'] for match_feature in feature_gene_matches
+                ):
+                    score += 0.15
+                if feature.get('variant') and any(
+                        _is_same_variant(feature['variant'], match_feature['variant'])
+                        for match_feature in feature_gene_matches if match_feature.get('variant')
+                ):
+                    score += 0.15
+        return float(score) / len(genomic_features)
+
+    def get_phenotype_score(self, hpo_ids):
+        if not self.has_features:
+            return 0.5
+        matched_hpo_ids = [hpo_id for hpo_id in hpo_ids if hpo_id in self.observed_hpo_ids]
+        return float(len(matched_hpo_ids)) / len(hpo_ids) or 0.1
+
+
+class MatchmakerSubmissionIndex(object):
+    """
+    In-memory inverted index from gene ids and HPO ids to the active submissions with them.
+
+    Before each use, the index is refreshed by comparing it with the last modified date of every active submission, so
+    only new, changed and removed submissions are re-indexed, including those changed by other server processes
+    """
+
+    def __init__(self):
+        self._submissions = {}
+        self._submission_ids_by_gene_id = defaultdict(set)
+        self._submission_ids_by_hpo_id = defaultdict(set)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._submissions)
+
+    def refresh(self):
+        last_modified_by_id = dict(
+            MatchmakerSubmission.objects.filter(deleted_date__isnull=True).values_list('id', 'last_modified_date'))
+        with self._lock:
+            removed_ids = [submission_id for submission_id in self._submissions if submission_id not in last_modified_by_id]
+            changed_ids = [
+                submission_id for submission_id, last_modified_date in last_modified_by_id.items()
+                if submission_id not in self._submissions or
+                self._submissions[submission_id].last_modified_date != last_modified_date
+            ]
+            for submission_id in removed_ids + changed_ids:
+                self._remove(submission_id)
+            if changed_ids:
+                for submission in MatchmakerSubmission.objects.filter(id__in=changed_ids).values(
+                        'id', 'submission_id', 'last_modified_date', 'features', 'genomic_features'):
+                    self._add(_IndexedSubmission(submission))
+
+    def _add(self, submission):
+        self._submissions[submission.id] = submission
+        for gene_id in submission.features_by_gene_id:
+            self._submission_ids_by_gene_id[gene_id].add(submission.id)
+        for hpo_id in submission.matchable_hpo_ids:
+            self._submission_ids_by_hpo_id[hpo_id].add(submission.id)
+
+    def _remove(self, submission_id):
+        submission = self._submissions.pop(submission_id, None)
+        if not submission:
+            return
+        for gene_id in submission.features_by_gene_id:
+            _discard_indexed_id(self._submission_ids_by_gene_id, gene_id, submission_id)
+        for hpo_id in submission.matchable_hpo_ids:
+            _discard_indexed_id(self._submission_ids_by_hpo_id, hpo_id, submission_id)
+
+    def _get_submissions(self, submission_ids_by_key, keys):
+        # Matches are returned in the order of the keys they were found for
+        with self._lock:
+            submissions = {}
+            for key in keys:
+                for submission_id in sorted(submission_ids_by_key.get(key, [])):
+                    submissions.setdefault(submission_id, self._submissions[submission_id])
+            return list(submissions.values())
+
+    def get_submissions_for_genes(self, gene_ids):
+        return self._get_submissions(self._submission_ids_by_gene_id, gene_ids)
+
+    def get_submissions_for_phenotypes(self, hpo_ids):
+        return self._get_submissions(self._submission_ids_by_hpo_id, hpo_ids)
+
+
+def _discard_indexed_id(submission_ids_by_key, key, submission_id):
+    submission_ids = submission_ids_by_key.get(key)
+    if submission_ids is not None:
+        submission_ids.discard(submission_id)
+        if not submission_ids:
+            del submission_ids_by_key[key]
+
+
+MME_SUBMISSION_INDEX = MatchmakerSubmissionIndex()
 
 
 def get_mme_metrics():
@@ -0,0 +1,64 @@
+from datetime import datetime
+from django.test import TestCase
+
+from matchmaker.models import MatchmakerSubmission
+from matchmaker.matchmaker_utils import MatchmakerSubmissionIndex
+
+GENE_ID = 'ENSG00000186092'
+
+
+class MatchmakerUtilsTest(TestCase):
+    databases = '__all__'
+    fixtures = ['users', '1kg_project']
+
+    def _submission_ids(self, submissions):
+        return [submission.submission_id for submission in submissions]
+
+    def test_matchmaker_submission_index(self):
+        index = MatchmakerSubmissionIndex()
+        with self.assertNumQueries(2):
+            index.refresh()
+        self.assertEqual(len(index), 4)
+
+        self.assertListEqual(
+            self._submission_ids(index.get_submissions_for_genes([GENE_ID])), ['NA19675_1_01', 'P0004515', 'P0004517'])
+        self.assertListEqual(
+            self._submission_ids(index.get_submissions_for_genes(['ENSG00000227232', GENE_ID, 'ENSG00000000000'])),
+            ['NA20885', 'NA19675_1_01', 'P0004515', 'P0004517'])
+        self.assertListEqual(
+            self._submission_ids(index.get_submissions_for_phenotypes(['HP:0002017', 'HP:0001252'])),
+            ['NA20885', 'NA19675_1_01'])
+        # Only observed features are matched
+        self.assertListEqual(index.get_submissions_for_phenotypes(['HP:0001263']), [])
+
+        # Scores use the bucketed features
+        submission = index.get_submissions_for_genes([GENE_ID])[0]
+        self.assertEqual(submission.get_genotype_score([
+            {'gene_ids': [GENE_ID], 'zygosity': 1}, {'gene_ids': ['ENSG00000227232']},
+        ]), 0.425)
+        self.assertEqual(submission.get_phenotype_score(['HP:0001252', 'HP:0001263']), 0.5)
+        self.assertEqual(submission.get_phenotype_score(['HP:0001263']), 0.1)
+        self.assertEqual(index.get_submissions_for_genes(['ENSG00000227232'])[0].get_phenotype_score(['HP:0001263']), 0.1)
+        self.assertEqual(index.get_submissions_for_genes([GENE_ID])[1].get_phenotype_score(['HP:0001263']), 0.5)
+
+        # Unchanged submissions are not re-indexed
+        with self.assertNumQueries(1):
+            index.refresh()
+
+        # Only changed submissions are re-indexed
+        changed_submission = MatchmakerSubmission.objects.get(submission_id='NA20885')
+        changed_submission.features = [{'id': 'HP:0001263', 'observed': 'yes'}]
+        changed_submission.genomic_features = [{'gene': {'id': GENE_ID}}]
+        changed_submission.save()
+        deleted_submission = MatchmakerSubmission.objects.get(submission_id='P0004515')
+        deleted_submission.deleted_date = datetime.now()
+        deleted_submission.save()
+        with self.assertNumQueries(2):
+            index.refresh()
+        self.assertEqual(len(index), 3)
+
+        self.assertListEqual(index.get_submissions_for_genes(['ENSG00000227232']), [])
+        self.assertListEqual(
+            self._submission_ids(index.get_submissions_for_genes([GENE_ID])), ['NA19675_1_01', 'NA20885', 'P0004517'])
+        self.assertListEqual(self._submission_ids(index.get_submissions_for_phenotypes(['HP:0002017'])), [])
+        self.assertListEqual(self._submission_ids(index.get_submissions_for_phenotypes(['HP:0001263'])), ['NA20885'])
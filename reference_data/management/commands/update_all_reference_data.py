@@ -1,8 +1,12 @@
 import logging
+import multiprocessing
+import time
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from django.core.management.base import BaseCommand
+from django.db import connections
 
-from reference_data.management.commands.utils.update_utils import update_records
+from reference_data.management.commands.utils.update_utils import update_records, get_gene_reference
 from reference_data.management.commands.update_human_phenotype_ontology import update_hpo
 from reference_data.management.commands.update_dbnsfp_gene import DbNSFPReferenceDataHandler
 from reference_data.management.commands.update_gencode import update_gencode
@@ -29,6 +33,31 @@ REFERENCE_DATA_SOURCES = OrderedDict([
 ])
 
 
+# Sources which read data loaded by other sources, and are only updated once those sources are done
+REFERENCE_DATA_SOURCE_DEPENDENCIES = {
+    'mgi': ['dbnsfp_gene'],
+}
+
+# Gene lookup shared by all the handlers. Forked worker processes inherit it from the parent process
+_GENE_REFERENCE = {}
+
+
+def _set_gene_reference(gene_reference):
+    _GENE_REFERENCE.update(gene_reference)
+
+
+def _update_source(source, data_handler, handler_kwargs):
+    """Updates a single source, and returns the time it took in seconds. Each source writes to its own table"""
+    start_time = time.time()
+    if data_handler:
+        # update_records logs the error for a failed update, so it only needs to be reported as failed here
+        if not update_records(data_handler(gene_reference=_GENE_REFERENCE, **handler_kwargs)):
+            raise ValueError('error loading records')
+    elif source == "hpo":
+        update_hpo()
+    return time.time() - start_time
+
+
 class Command(BaseCommand):
     help = "Loads all reference data"
 
@@ -45,6 +74,11 @@ class Command(BaseCommand):
                 '--skip-{}'.format(source.replace('_', '-')), help="Don't reload {}".format(source), action="store_true"
             )
 
+        parser.add_argument(
+            '--parallel', type=int, nargs='?', const=4, default=None, metavar='PROCESSES',
+            help="Download, parse and load independent sources in parallel, using the given number of processes",
+        )
+
     def handle(self, *args, **options):
         updated = []
         update_failed = []
@@ -59,30 +93,72 @@ class Command(BaseCommand):
             update_gencode(19)
             updated.append('gencode')
 
+        sources = OrderedDict()
         if not options["skip_omim"]:
-            try:
-                omim_handler = CachedOmimReferenceDataHandler() if options['use_cached_omim'] else \
-                    OmimReferenceDataHandler(options["omim_key"])
-                update_records(omim_handler)
-                updated.append('omim')
-            except Exception as e:
-                logger.error("unable to update omim: {}".format(e))
-                update_failed.append('omim')
-
+            sources['omim'] = (CachedOmimReferenceDataHandler, {}) if options['use_cached_omim'] else \
+                (OmimReferenceDataHandler, {'omim_key': options["omim_key"]})
         for source, data_handler in REFERENCE_DATA_SOURCES.items():
             if not options["skip_{}".format(source)]:
-                try:
-                    if data_handler:
-                        update_records(data_handler())
-                    elif source == "hpo":
-                        update_hpo()
-                    updated.append(source)
-                except Exception as e:
-                    logger.error("unable to update {}: {}".format(source, e))
-                    update_failed.append(source)
+                sources[source] = (data_handler, {})
+
+        if any(data_handler for data_handler, _ in sources.values()):
+            _set_gene_reference(get_gene_reference())
+
+        if options['parallel']:
+            results = self._update_parallel(sources, options['parallel'])
+        else:
+            results = self._update_sequential(sources)
+
+        for source in sources.keys():
+            duration, error = results[source]
+            if error:
+                logger.error("unable to update {}: {}".format(source, error))
+                update_failed.append(source)
+            else:
+                logger.info("Updated {} in {:.1f}s".format(source, duration))
+                updated.append(source)
 
         logger.info("Done")
         if updated:
             logger.info("Updated: {}".format(', '.join(updated)))
         if update_failed:
             logger.info("Failed to Update: {}".format(', '.join(update_failed)))
+
+    @staticmethod
+    def _update_sequential(sources):
+        results = {}
+        for source, (data_handler, handler_kwargs) in sources.items():
+            try:
+                results[source] = (_update_source(source, data_handler, handler_kwargs), None)
+            except Exception as e:
+                results[source] = (None, e)
+        return results
+
+    @staticmethod
+    def _update_parallel(sources, processes):
+        results = {}
+        pending = OrderedDict(sources)
+
+        # Forked worker processes open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = {}
+            while pending or futures:
+                for source in list(pending.keys()):
+                    dependencies = [
+                        dependency for dependency in REFERENCE_DATA_SOURCE_DEPENDENCIES.get(source, [])
+                        if dependency in sources
+                    ]
+                    if all(dependency in results for dependency in dependencies):
+                        data_handler, handler_kwargs = pending.pop(source)
+                        futures[executor.submit(_update_source, source, data_handler, handler_kwargs)] = source
+
+                done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    source = futures.pop(future)
+                    try:
+                        results[source] = (future.result(), None)
+                    except Exception as e:
+                        results[source] = (None, e)
+
+        return results
@@ -5,29 +5,37 @@ import os
 from tqdm import tqdm
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
 
 from reference_data.management.commands.utils.download_utils import download_file
+from reference_data.management.commands.utils.gtf_utils import parse_gencode_annotations, iter_annotation_rows, \
+    get_annotations_cache_file_name, read_annotations_cache, write_annotations_cache, GENE_FEATURE_TYPE, \
+    TRANSCRIPT_FEATURE_TYPE
 from reference_data.models import GeneInfo, TranscriptInfo, GENOME_VERSION_GRCh37, GENOME_VERSION_GRCh38
+from seqr.utils.gene_utils import invalidate_reference_data_cache
 
 logger = logging.getLogger(__name__)
 
 GENCODE_GTF_URL = "http://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_{gencode_release}/gencode.v{gencode_release}.annotation.gtf.gz"
 GENCODE_LIFT37_GTF_URL = "http://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_{gencode_release}/GRCh37_mapping/gencode.v{gencode_release}lift37.annotation.gtf.gz"
 
-# expected GTF file header
-GENCODE_FILE_HEADER = [
-    'chrom', 'source', 'feature_type', 'start', 'end', 'score', 'strand', 'phase', 'info'
-]
+# GeneInfo and TranscriptInfo fields with a separate column for each genome version
+GENOME_VERSION_FIELDS = ['chrom', 'start', 'end', 'strand', 'coding_region_size']
+DIFF_BATCH_SIZE = 5000
 
 
 class Command(BaseCommand):
     help = "Loads the GRCh37 and/or GRCh38 versions of the Gencode GTF from a particular Gencode release"
 
     def add_arguments(self, parser):
-        parser.add_argument('--reset', help="First drop any existing records from GeneInfo and TranscriptInfo", action="store_true")
+        update_mode = parser.add_mutually_exclusive_group()
+        update_mode.add_argument('--reset', help="First drop any existing records from GeneInfo and TranscriptInfo", action="store_true")
+        update_mode.add_argument('--diff', help="Compare the existing GeneInfo and TranscriptInfo records with the release, and only insert, update and delete the records that changed", action="store_true")
+        parser.add_argument('--retire-releases', help="(optional) with --diff, delete the genes last loaded from these gencode releases which are not in the new release. Other genes missing from the release are kept", nargs='+', type=int, default=[])
         parser.add_argument('--gencode-release', help="gencode release number (eg. 28)", type=int, required=True, choices=range(19, 32))
         parser.add_argument('gencode_gtf_path', nargs="?", help="(optional) gencode GTF file path. If not specified, it will be downloaded.")
         parser.add_argument('genome_version', nargs="?", help="gencode GTF file genome version", choices=[GENOME_VERSION_GRCh37, GENOME_VERSION_GRCh38])
+        parser.add_argument('--cache-dir', help="(optional) directory to cache the parsed gencode annotations in. Cached annotations for the same release and genome version are used instead of re-parsing the GTF file")
 
     def handle(self, *args, **options):
 
@@ -35,7 +43,10 @@ class Command(BaseCommand):
             gencode_release=options['gencode_release'],
             gencode_gtf_path=options.get('gencode_gtf_path'),
             genome_version=options.get('genome_version'),
-            reset=options['reset'])
+            reset=options['reset'],
+            cache_dir=options.get('cache_dir'),
+            diff=options['diff'],
+            retire_releases=options['retire_releases'])
 
 
 def _get_valid_gencode_gtf_paths(gencode_release, gencode_gtf_path, genome_version):
@@ -67,7 +78,8 @@ def _get_valid_gencode_gtf_paths(gencode_release, gencode_gtf_path, genome_versi
     return gencode_gtf_paths
 
 
-def update_gencode(gencode_release, gencode_gtf_path=None, genome_version=None, reset=False):
+def update_gencode(gencode_release, gencode_gtf_path=None, genome_version=None, reset=False, cache_dir=None, diff=False,
+                   retire_releases=None):
     """Update GeneInfo and TranscriptInfo tables.
 
     Args:
@@ -77,7 +89,18 @@ def update_gencode(gencode_release, gencode_gtf_path=None, genome_version=None,
         reset (bool): If True, all records will be deleted from GeneInfo and TranscriptInfo before loading the new data.
             Setting this to False can be useful to sequentially load more than one gencode release so that data in the
             tables represents the union of multiple gencode releases.
+        cache_dir (str): optional directory to cache the parsed annotations in, keyed by release and genome version.
+        diff (bool): If True, existing records are compared with the release, and only the records that were added or
+            changed in it are inserted or updated. Genes missing from the release are kept, as the tables represent the
+            union of multiple gencode releases. Transcripts of genes in the release which are missing from it are deleted.
+        retire_releases (list): optional gencode releases to retire when using diff. Genes last loaded from these
+            releases which are missing from the new release are deleted, along with their annotations.
     """
+    if reset and diff:
+        raise CommandError('Only one of reset and diff can be used')
+    if retire_releases and not diff:
+        raise CommandError('Releases can only be retired when using diff')
+
     gencode_gtf_paths = _get_valid_gencode_gtf_paths(gencode_release, gencode_gtf_path, genome_version)
 
     if reset:
@@ -86,10 +109,15 @@ def update_gencode(gencode_release, gencode_gtf_path=None, genome_version=None,
         logger.info("Dropping the {} existing GeneInfo entries".format(GeneInfo.objects.count()))
         GeneInfo.objects.all().delete()
 
-    existing_gene_ids = {gene.gene_id for gene in GeneInfo.objects.all().only('gene_id')}
-    existing_transcript_ids = {
-        transcript.transcript_id for transcript in TranscriptInfo.objects.all().only('transcript_id')
-    }
+    if diff:
+        # All records in the release are parsed, so they can be compared with the existing ones
+        existing_gene_ids = set()
+        existing_transcript_ids = set()
+    else:
+        existing_gene_ids = {gene.gene_id for gene in GeneInfo.objects.all().only('gene_id')}
+        existing_transcript_ids = {
+            transcript.transcript_id for transcript in TranscriptInfo.objects.all().only('transcript_id')
+        }
 
     counters = collections.defaultdict(int)
     new_genes = collections.defaultdict(dict)
@@ -97,12 +125,25 @@ def update_gencode(gencode_release, gencode_gtf_path=None, genome_version=None,
 
     for genome_version, gencode_gtf_path in gencode_gtf_paths.items():
         logger.info("Loading {} (genome version: {})".format(gencode_gtf_path, genome_version))
-        with gzip.open(gencode_gtf_path, 'rt') as gencode_file:
-            for i, line in enumerate(tqdm(gencode_file, unit=' gencode records')):
-                _parse_line(
-                    line, i, new_genes, new_transcripts, existing_gene_ids, existing_transcript_ids, counters,
-                    genome_version, gencode_release)
+        annotations = _load_gencode_annotations(gencode_gtf_path, gencode_release, genome_version, cache_dir)
+        _add_new_records(
+            annotations, new_genes, new_transcripts, existing_gene_ids, existing_transcript_ids, counters,
+            genome_version, gencode_release)
+
+    if diff:
+        with transaction.atomic(using=router.db_for_write(GeneInfo)):
+            _apply_gencode_diff(new_genes, new_transcripts, gencode_gtf_paths.keys(), retire_releases or [], counters)
+    else:
+        _create_records(new_genes, new_transcripts, counters)
+    invalidate_reference_data_cache()
 
+    logger.info("Done")
+    logger.info("Stats: ")
+    for k, v in counters.items():
+        logger.info("  %s: %s" % (k, v))
+
+
+def _create_records(new_genes, new_transcripts, counters):
     logger.info('Creating {} GeneInfo records'.format(len(new_genes)))
     counters["genes_created"] = len(new_genes)
     GeneInfo.objects.bulk_create([GeneInfo(**record) for record in new_genes.values()])
@@ -114,82 +155,158 @@ def update_gencode(gencode_release, gencode_gtf_path=None, genome_version=None,
         TranscriptInfo(gene=gene_id_to_gene_info[record.pop('gene_id')], **record) for record in new_transcripts.values()
     ], batch_size=50000)
 
-    logger.info("Done")
-    logger.info("Stats: ")
-    for k, v in counters.items():
-        logger.info("  %s: %s" % (k, v))
-
-def _parse_line(line, i, new_genes, new_transcripts,  existing_gene_ids, existing_transcript_ids, counters, genome_version, gencode_release):
-    line = line.rstrip('\r\n')
-    if not line or line.startswith('#'):
-        return
-    fields = line.split('\t')
 
-    if len(fields) != len(GENCODE_FILE_HEADER):
-        raise ValueError("Unexpected number of fields on line #%s: %s" % (i, fields))
-
-    record = dict(zip(GENCODE_FILE_HEADER, fields))
-
-    if record['feature_type'] not in ('gene', 'transcript', 'CDS'):
-        return
+def _diff_fields(genome_versions, shared_fields):
+    return shared_fields + [
+        '{}_grch{}'.format(field, genome_version) for genome_version in sorted(genome_versions)
+        for field in GENOME_VERSION_FIELDS
+    ]
+
+
+def _diff_records(model_cls, id_field, release_records, fields, is_retired, counters, model_name, retire_fields=()):
+    """Compares the release records with the existing ones, and returns the ids of the changed and retired records"""
+    changed_ids = {}
+    retired_ids = []
+    # Records missing from one genome version's GTF have the model defaults for its fields, which are null for positions
+    defaults = {field: model_cls._meta.get_field(field).get_default() for field in fields if '__' not in field}
+    for existing in model_cls.objects.values('id', *fields, *retire_fields).iterator(chunk_size=DIFF_BATCH_SIZE):
+        record = release_records.get(existing[id_field])
+        if record is None:
+            if is_retired(existing):
+                retired_ids.append(existing['id'])
+            continue
+        changed_fields = [field for field in fields if record.get(field, defaults.get(field)) != existing[field]]
+        if changed_fields:
+            changed_ids[existing[id_field]] = existing['id']
+            for field in changed_fields:
+                counters['{}.{} changed'.format(model_name, field)] += 1
+    return changed_ids, retired_ids
+
+
+def _apply_gencode_diff(release_genes, release_transcripts, genome_versions, retire_releases, counters):
+    # The gencode release is not compared, so genes which are otherwise unchanged keep the release they were loaded from
+    gene_fields = _diff_fields(genome_versions, ['gene_id', 'gene_symbol', 'gencode_gene_type'])
+    transcript_fields = _diff_fields(genome_versions, ['transcript_id', 'gene__gene_id'])
+    for record in release_transcripts.values():
+        record['gene__gene_id'] = record.pop('gene_id')
+
+    existing_gene_ids = set(GeneInfo.objects.values_list('gene_id', flat=True))
+    # Genes from older releases are kept unless their release is retired, as other reference data still references them
+    changed_gene_ids, retired_gene_ids = _diff_records(
+        GeneInfo, 'gene_id', release_genes, gene_fields, lambda gene: gene['gencode_release'] in retire_releases,
+        counters, 'GeneInfo', retire_fields=['gencode_release'])
+    existing_transcript_ids = set(TranscriptInfo.objects.values_list('transcript_id', flat=True))
+    changed_transcript_ids, retired_transcript_ids = _diff_records(
+        TranscriptInfo, 'transcript_id', release_transcripts, transcript_fields,
+        lambda transcript: transcript['gene__gene_id'] in release_genes, counters, 'TranscriptInfo')
+
+    new_genes = [record for gene_id, record in release_genes.items() if gene_id not in existing_gene_ids]
+    logger.info('Creating {} GeneInfo records'.format(len(new_genes)))
+    counters['genes_created'] = len(new_genes)
+    GeneInfo.objects.bulk_create([GeneInfo(**record) for record in new_genes], batch_size=DIFF_BATCH_SIZE)
 
-    # parse info field
-    info_fields = [x.strip().split() for x in record['info'].split(';') if x != '']
-    info_fields = {k: v.strip('"') for k, v in info_fields}
-    record.update(info_fields)
+    logger.info('Updating {} GeneInfo records'.format(len(changed_gene_ids)))
+    counters['genes_updated'] = len(changed_gene_ids)
+    GeneInfo.objects.bulk_update([
+        GeneInfo(id=db_id, **release_genes[gene_id]) for gene_id, db_id in changed_gene_ids.items()
+    ], gene_fields[1:] + ['gencode_release'], batch_size=DIFF_BATCH_SIZE)
 
-    record['gene_id'] = record['gene_id'].split('.')[0]
-    if 'transcript_id' in record:
-        record['transcript_id'] = record['transcript_id'].split('.')[0]
-    record['chrom'] = record['chrom'].replace("chr", "").upper()
-    record['start'] = int(record['start'])
-    record['end'] = int(record['end'])
+    gene_id_to_gene_info = {g.gene_id: g for g in GeneInfo.objects.all().only('gene_id')}
 
-    if len(record["chrom"]) > 2:
-        return  # skip super-contigs
+    def _transcript(record, **kwargs):
+        record = dict(record)
+        return TranscriptInfo(gene=gene_id_to_gene_info[record.pop('gene__gene_id')], **record, **kwargs)
 
-    if record['feature_type'] == 'gene':
-        if record["gene_id"] in existing_gene_ids:
+    new_transcripts = [
+        record for transcript_id, record in release_transcripts.items() if transcript_id not in existing_transcript_ids
+    ]
+    logger.info('Creating {} TranscriptInfo records'.format(len(new_transcripts)))
+    counters['transcripts_created'] = len(new_transcripts)
+    TranscriptInfo.objects.bulk_create(
+        [_transcript(record) for record in new_transcripts], batch_size=DIFF_BATCH_SIZE)
+
+    logger.info('Updating {} TranscriptInfo records'.format(len(changed_transcript_ids)))
+    counters['transcripts_updated'] = len(changed_transcript_ids)
+    TranscriptInfo.objects.bulk_update([
+        _transcript(release_transcripts[transcript_id], id=db_id)
+        for transcript_id, db_id in changed_transcript_ids.items()
+    ], ['gene'] + transcript_fields[2:], batch_size=DIFF_BATCH_SIZE)
+
+    # Transcripts are retired before genes, as deleting a gene also deletes its transcripts
+    logger.info('Retiring {} TranscriptInfo records'.format(len(retired_transcript_ids)))
+    counters['transcripts_retired'] = len(retired_transcript_ids)
+    for i in range(0, len(retired_transcript_ids), DIFF_BATCH_SIZE):
+        TranscriptInfo.objects.filter(id__in=retired_transcript_ids[i:i + DIFF_BATCH_SIZE]).delete()
+
+    logger.info('Retiring {} GeneInfo records'.format(len(retired_gene_ids)))
+    counters['genes_retired'] = len(retired_gene_ids)
+    for i in range(0, len(retired_gene_ids), DIFF_BATCH_SIZE):
+        GeneInfo.objects.filter(id__in=retired_gene_ids[i:i + DIFF_BATCH_SIZE]).delete()
+
+
+def _load_gencode_annotations(gencode_gtf_path, gencode_release, genome_version, cache_dir):
+    cache_path = cache_dir and os.path.join(cache_dir, get_annotations_cache_file_name(gencode_release, genome_version))
+    if cache_path and os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as f:
+            annotations = read_annotations_cache(f)
+        if annotations is not None:
+            logger.info('Using the cached annotations in {}'.format(cache_path))
+            return annotations
+
+    with gzip.open(gencode_gtf_path, 'rt') as gencode_file:
+        annotations = parse_gencode_annotations(tqdm(gencode_file, unit=' gencode records'))
+
+    if cache_path:
+        with open(cache_path, 'wb') as f:
+            write_annotations_cache(annotations, f)
+        logger.info('Cached the parsed annotations to {}'.format(cache_path))
+    return annotations
+
+
+def _add_new_records(annotations, new_genes, new_transcripts, existing_gene_ids, existing_transcript_ids, counters,
+                     genome_version, gencode_release):
+    coding_region_size_field_name = "coding_region_size_grch{}".format(genome_version)
+
+    for gene_id, gene_symbol, gene_type, chrom, start, end, strand in iter_annotation_rows(annotations, GENE_FEATURE_TYPE):
+        if len(chrom) > 2:
+            continue  # skip super-contigs
+
+        if gene_id in existing_gene_ids:
             counters["genes_skipped"] += 1
-            return
+            continue
 
-        new_genes[record['gene_id']].update({
-            "gene_id": record["gene_id"],
-            "gene_symbol": record["gene_name"],
+        new_genes[gene_id].update({
+            "gene_id": gene_id,
+            "gene_symbol": gene_symbol,
 
-            "chrom_grch{}".format(genome_version): record["chrom"],
-            "start_grch{}".format(genome_version): record["start"],
-            "end_grch{}".format(genome_version): record["end"],
-            "strand_grch{}".format(genome_version): record["strand"],
+            "chrom_grch{}".format(genome_version): chrom,
+            "start_grch{}".format(genome_version): start,
+            "end_grch{}".format(genome_version): end,
+            "strand_grch{}".format(genome_version): strand,
 
-            "gencode_gene_type": record["gene_type"],
+            "gencode_gene_type": gene_type,
             "gencode_release": int(gencode_release),
         })
 
-    elif record['feature_type'] == 'transcript':
-        if record["transcript_id"] in existing_transcript_ids:
+    for transcript_id, gene_id, chrom, start, end, strand, coding_region_size in iter_annotation_rows(
+            annotations, TRANSCRIPT_FEATURE_TYPE):
+        if len(chrom) > 2:
+            continue  # skip super-contigs
+
+        if transcript_id in existing_transcript_ids:
             counters["transcripts_skipped"] += 1
-            return
-
-        new_transcripts[record['transcript_id']].update({
-            "gene_id": record["gene_id"],
-            "transcript_id": record["transcript_id"],
-            "chrom_grch{}".format(genome_version): record["chrom"],
-            "start_grch{}".format(genome_version): record["start"],
-            "end_grch{}".format(genome_version): record["end"],
-            "strand_grch{}".format(genome_version): record["strand"],
+            continue
+
+        new_transcripts[transcript_id].update({
+            "gene_id": gene_id,
+            "transcript_id": transcript_id,
+            "chrom_grch{}".format(genome_version): chrom,
+            "start_grch{}".format(genome_version): start,
+            "end_grch{}".format(genome_version): end,
+            "strand_grch{}".format(genome_version): strand,
+            coding_region_size_field_name: coding_region_size,
         })
 
-    elif record['feature_type'] == 'CDS':
-        if record["transcript_id"] in existing_transcript_ids:
-            return
-
-        coding_region_size_field_name = "coding_region_size_grch{}".format(genome_version)
-        # add + 1 because GTF has 1-based coords. (https://useast.ensembl.org/info/website/upload/gff.html)
-        transcript_size = record["end"] - record["start"] + 1
-        transcript_size += new_transcripts[record['transcript_id']].get(coding_region_size_field_name, 0)
-        new_transcripts[record['transcript_id']][coding_region_size_field_name] = transcript_size
-
-        if record['gene_id'] not in existing_gene_ids and \
-                transcript_size > new_genes[record['gene_id']].get(coding_region_size_field_name, 0):
-            new_genes[record['gene_id']][coding_region_size_field_name] = transcript_size
\ No newline at end of file
+        # a gene's coding region size is the size of its largest new transcript
+        if gene_id in new_genes and coding_region_size > new_genes[gene_id].get(coding_region_size_field_name, 0):
+            new_genes[gene_id][coding_region_size_field_name] = coding_region_size
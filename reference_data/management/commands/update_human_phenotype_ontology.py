@@ -7,6 +7,7 @@ from django.core.management.base import BaseCommand
 
 from reference_data.management.commands.utils.download_utils import download_file
 from reference_data.models import HumanPhenotypeOntology
+from seqr.utils.gene_utils import invalidate_reference_data_cache
 
 logger = logging.getLogger(__name__)
 
@@ -40,8 +41,9 @@ def update_hpo(hpo_file_path=None):
         hpo_id_to_record = parse_obo_file(f)
 
     # for each hpo id, find its top level category
+    category_ids = {}
     for hpo_id in hpo_id_to_record.keys():
-        hpo_id_to_record[hpo_id]['category_id'] = get_category_id(hpo_id_to_record, hpo_id)
+        hpo_id_to_record[hpo_id]['category_id'] = get_category_id(hpo_id_to_record, hpo_id, category_ids)
 
     # save to database
 
@@ -54,6 +56,7 @@ def update_hpo(hpo_file_path=None):
 
         HumanPhenotypeOntology.objects.bulk_create(
             HumanPhenotypeOntology(**record) for record in tqdm(hpo_id_to_record.values(), unit=" records"))
+    invalidate_reference_data_cache()
 
     logger.info("Done")
 
@@ -93,24 +96,38 @@ def parse_obo_file(file_iterator):
     return hpo_id_to_record
 
 
-def get_category_id(hpo_id_to_record, hpo_id):
+def get_category_id(hpo_id_to_record, hpo_id, category_ids=None):
     """For a given hpo_id, get the hpo id of it's top-level category (eg. 'cardiovascular') and
     return it. If the hpo_id belongs to multiple top-level categories, return one of them.
-    """
-
-    if hpo_id == "HP:0000001":
-        return None
-
-    if 'parent_id' not in hpo_id_to_record[hpo_id]:
-        return None
 
-    while hpo_id_to_record[hpo_id]['parent_id'] != "HP:0000118":
-
-        hpo_id = hpo_id_to_record[hpo_id]['parent_id']
+    If a category_ids dictionary is passed in, the categories of every term on the path to the top-level category are
+    stored in it, so they are not looked up again for other terms.
+    """
+    if category_ids is None:
+        category_ids = {}
+
+    path = []
+    category_id = None
+    while True:
+        if hpo_id in category_ids:
+            category_id = category_ids[hpo_id]
+            break
+
+        if hpo_id == "HP:0000001" or 'parent_id' not in hpo_id_to_record[hpo_id]:
+            break
+
+        path.append(hpo_id)
+        parent_id = hpo_id_to_record[hpo_id]['parent_id']
+        if parent_id == "HP:0000118":
+            category_id = hpo_id
+            break
+
+        hpo_id = parent_id
         if hpo_id == "HP:0000001":
-            return None
+            break
         if hpo_id not in hpo_id_to_record:
             raise ValueError("Strange id: %s" % hpo_id)
 
-    return hpo_id
-
+    for path_hpo_id in path:
+        category_ids[path_hpo_id] = category_id
+    return category_id
@@ -99,7 +99,7 @@ class OmimReferenceDataHandler(ReferenceDataHandler):
         self.url = self.url.format(omim_key=omim_key)
         self.omim_key = omim_key
         self.cache_parsed_records = not skip_cache_parsed_records
-        super(OmimReferenceDataHandler, self).__init__()
+        super(OmimReferenceDataHandler, self).__init__(**kwargs)
 
     @staticmethod
     def get_file_header(f):
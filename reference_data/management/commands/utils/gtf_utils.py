@@ -0,0 +1,179 @@
+"""
+Streaming reader for gencode GTF files, and a compact columnar cache of the gene and transcript annotations in them.
+
+This module only depends on the standard library, so it is also used by the SV loading pipeline. It is added to the
+pipeline's scripts zip when the pipeline is submitted (see hail-elasticsearch-pipelines/gcloud_dataproc/submit.py).
+"""
+import collections
+import gzip
+import json
+import sys
+from array import array
+
+# expected GTF file header
+GENCODE_FILE_HEADER = [
+    'chrom', 'source', 'feature_type', 'start', 'end', 'score', 'strand', 'phase', 'info'
+]
+NUM_GTF_FIELDS = len(GENCODE_FILE_HEADER)
+
+GENE_FEATURE_TYPE = 'gene'
+TRANSCRIPT_FEATURE_TYPE = 'transcript'
+CDS_FEATURE_TYPE = 'CDS'
+
+GENE_FIELDS = ['gene_id', 'gene_symbol', 'gene_type', 'chrom', 'start', 'end', 'strand']
+TRANSCRIPT_FIELDS = ['transcript_id', 'gene_id', 'chrom', 'start', 'end', 'strand', 'coding_region_size']
+INT_FIELDS = {'start', 'end', 'coding_region_size'}
+# Fields with few distinct values, which are interned so each value is only stored once in memory
+INTERNED_FIELDS = {'gene_type', 'chrom', 'strand'}
+
+# Increment when the format of the cached annotations changes, so stale caches are re-parsed
+ANNOTATIONS_CACHE_VERSION = 2
+ANNOTATIONS_CACHE_FILE_TEMPLATE = 'gencode.v{gencode_release}.GRCh{genome_version}.annotations.json.gz'
+
+
+class GtfRecord(object):
+    """A single GTF line. Attributes in the info column are only parsed when they are looked up"""
+    __slots__ = ('chrom', 'feature_type', 'start', 'end', 'strand', '_info')
+
+    def __init__(self, chrom, feature_type, start, end, strand, info):
+        self.chrom = chrom.replace('chr', '').upper()
+        self.feature_type = feature_type
+        self.start = int(start)
+        self.end = int(end)
+        self.strand = strand
+        self._info = info
+
+    def get(self, key, default=None):
+        info = self._info
+        prefix = key + ' '
+        if info.startswith(prefix):
+            value_start = len(prefix)
+        else:
+            value_start = info.find('; ' + prefix)
+            if value_start < 0:
+                return default
+            value_start += len(prefix) + 2
+        value_end = info.find(';', value_start)
+        return info[value_start:value_end if value_end >= 0 else None].strip().strip('"')
+
+    def get_stable_id(self, key):
+        """Returns the given id attribute without its version suffix"""
+        return self.get(key).split('.')[0]
+
+
+def iter_gtf_records(gtf_lines, feature_types=None):
+    """Iterates over the GTF records for the given feature types.
+
+    Lines for other feature types are skipped before any of their fields are parsed.
+
+    Args:
+        gtf_lines (iterable): the lines of the GTF file
+        feature_types (iterable): optional feature types to return records for. If not provided, all records are returned
+    Yields:
+        GtfRecord
+    """
+    feature_types = set(feature_types) if feature_types else None
+    for i, line in enumerate(gtf_lines):
+        if line.startswith('#'):
+            continue
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        fields = line.split('\t')
+
+        if len(fields) != NUM_GTF_FIELDS:
+            raise ValueError("Unexpected number of fields on line #%s: %s" % (i, fields))
+
+        chrom, _, feature_type, start, end, _, strand, _, info = fields
+        if feature_types is not None and feature_type not in feature_types:
+            continue
+
+        yield GtfRecord(chrom, feature_type, start, end, strand, info)
+
+
+def _empty_columns(fields):
+    return {field: array('i') if field in INT_FIELDS else [] for field in fields}
+
+
+def parse_gencode_annotations(gtf_lines):
+    """Parses the gene and transcript annotations from a gencode GTF.
+
+    Args:
+        gtf_lines (iterable): the lines of the GTF file
+    Returns:
+        dict: {'genes': {field: column}, 'transcripts': {field: column}} with one column for each of GENE_FIELDS and
+            TRANSCRIPT_FIELDS. Integer columns are stored as arrays. The coding region size of a transcript is the total
+            size of its CDS records
+    """
+    genes = _empty_columns(GENE_FIELDS)
+    transcripts = _empty_columns(TRANSCRIPT_FIELDS[:-1])
+    coding_region_sizes = collections.defaultdict(int)
+
+    for record in iter_gtf_records(gtf_lines, feature_types={GENE_FEATURE_TYPE, TRANSCRIPT_FEATURE_TYPE, CDS_FEATURE_TYPE}):
+        if record.feature_type == CDS_FEATURE_TYPE:
+            # add + 1 because GTF has 1-based coords. (https://useast.ensembl.org/info/website/upload/gff.html)
+            coding_region_sizes[record.get_stable_id('transcript_id')] += record.end - record.start + 1
+            continue
+
+        if record.feature_type == GENE_FEATURE_TYPE:
+            columns = genes
+            columns['gene_symbol'].append(record.get('gene_name'))
+            columns['gene_type'].append(sys.intern(record.get('gene_type')))
+        else:
+            columns = transcripts
+            columns['transcript_id'].append(record.get_stable_id('transcript_id'))
+        columns['gene_id'].append(record.get_stable_id('gene_id'))
+        columns['chrom'].append(sys.intern(record.chrom))
+        columns['start'].append(record.start)
+        columns['end'].append(record.end)
+        columns['strand'].append(sys.intern(record.strand))
+
+    transcripts['coding_region_size'] = array(
+        'i', (coding_region_sizes.get(transcript_id, 0) for transcript_id in transcripts['transcript_id']))
+
+    return {'genes': genes, 'transcripts': transcripts}
+
+
+def iter_annotation_rows(annotations, feature_type):
+    """Iterates over the gene or transcript annotations as tuples, ordered as GENE_FIELDS or TRANSCRIPT_FIELDS"""
+    if feature_type == GENE_FEATURE_TYPE:
+        columns, fields = annotations['genes'], GENE_FIELDS
+    else:
+        columns, fields = annotations['transcripts'], TRANSCRIPT_FIELDS
+    return zip(*[columns[field] for field in fields])
+
+
+def get_annotations_cache_file_name(gencode_release, genome_version):
+    return ANNOTATIONS_CACHE_FILE_TEMPLATE.format(gencode_release=gencode_release, genome_version=genome_version)
+
+
+def write_annotations_cache(annotations, file_obj):
+    """Writes the parsed annotations to the given binary file object, as gzipped json"""
+    with gzip.GzipFile(fileobj=file_obj, mode='wb') as f:
+        f.write(json.dumps({
+            'version': ANNOTATIONS_CACHE_VERSION,
+            'annotations': {
+                feature: {field: list(column) for field, column in columns.items()}
+                for feature, columns in annotations.items()
+            },
+        }).encode('utf-8'))
+
+
+def _parse_cached_column(field, column):
+    if field in INT_FIELDS:
+        return array('i', column)
+    if field in INTERNED_FIELDS:
+        return [sys.intern(value) for value in column]
+    return column
+
+
+def read_annotations_cache(file_obj):
+    """Reads parsed annotations from the given binary file object. Returns None if the cache is from an older version"""
+    with gzip.GzipFile(fileobj=file_obj, mode='rb') as f:
+        cached = json.loads(f.read().decode('utf-8'))
+    if cached.get('version') != ANNOTATIONS_CACHE_VERSION:
+        return None
+    return {
+        feature: {field: _parse_cached_column(field, column) for field, column in columns.items()}
+        for feature, columns in cached['annotations'].items()
+    }
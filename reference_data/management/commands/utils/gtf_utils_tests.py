@@ -0,0 +1,60 @@
+import io
+
+from django.test import TestCase
+
+from reference_data.management.commands.utils.gtf_utils import iter_gtf_records, parse_gencode_annotations, \
+    iter_annotation_rows, read_annotations_cache, write_annotations_cache, get_annotations_cache_file_name, \
+    GENE_FEATURE_TYPE, TRANSCRIPT_FEATURE_TYPE
+from reference_data.management.tests.update_gencode_tests import GTF_DATA
+
+CDS_GTF_LINE = 'chr1	HAVANA	CDS	622040	622050	.	-	0	gene_id "ENSG00000284662.1_2"; transcript_id "ENST00000332831.4_2"; gene_type "protein_coding"; gene_name "OR4F16"; exon_number 2;\n'
+
+
+class GtfUtilsTest(TestCase):
+
+    def test_iter_gtf_records(self):
+        records = list(iter_gtf_records(GTF_DATA + ['\n']))
+        self.assertEqual(len(records), 7)
+        self.assertListEqual([record.feature_type for record in records], [
+            'gene', 'transcript', 'exon', 'gene', 'transcript', 'CDS', 'gene'])
+
+        record = records[1]
+        self.assertEqual(record.chrom, '1')
+        self.assertEqual(record.start, 11869)
+        self.assertEqual(record.end, 14409)
+        self.assertEqual(record.strand, '+')
+        self.assertEqual(record.get('gene_id'), 'ENSG00000223972.5_2')
+        self.assertEqual(record.get_stable_id('transcript_id'), 'ENST00000456328')
+        self.assertEqual(record.get('level'), '2')
+        self.assertEqual(record.get('havana_gene'), 'OTTHUMG00000000961.2_2')
+        self.assertEqual(record.get('remap_target_status'), 'overlap')
+        self.assertIsNone(record.get('gene'))
+        self.assertIsNone(record.get('exon_id'))
+        self.assertEqual(records[6].chrom, 'GL000193.1')
+
+        records = list(iter_gtf_records(GTF_DATA, feature_types=['gene']))
+        self.assertListEqual([record.get('gene_name') for record in records], ['DDX11L1', 'OR4F16', 'AC018692.2'])
+
+        with self.assertRaises(ValueError) as ve:
+            list(iter_gtf_records(['bad data'], feature_types=['gene']))
+        self.assertEqual(str(ve.exception), "Unexpected number of fields on line #0: ['bad data']")
+
+    def test_parse_gencode_annotations(self):
+        annotations = parse_gencode_annotations(GTF_DATA + [CDS_GTF_LINE])
+        self.assertListEqual(list(iter_annotation_rows(annotations, GENE_FEATURE_TYPE)), [
+            ('ENSG00000223972', 'DDX11L1', 'transcribed_unprocessed_pseudogene', '1', 11869, 14409, '+'),
+            ('ENSG00000284662', 'OR4F16', 'protein_coding', '1', 621059, 622053, '-'),
+            ('ENSG00000279783', 'AC018692.2', 'processed_pseudogene', 'GL000193.1', 77815, 78162, '+'),
+        ])
+        self.assertListEqual(list(iter_annotation_rows(annotations, TRANSCRIPT_FEATURE_TYPE)), [
+            ('ENST00000456328', 'ENSG00000223972', '1', 11869, 14409, '+', 0),
+            ('ENST00000332831', 'ENSG00000284662', '1', 621059, 622053, '-', 947),
+        ])
+
+        f = io.BytesIO()
+        write_annotations_cache(annotations, f)
+        f.seek(0)
+        self.assertDictEqual(read_annotations_cache(f), annotations)
+
+        self.assertEqual(get_annotations_cache_file_name(31, '37'), 'gencode.v31.GRCh37.annotations.json.gz')
+
@@ -1,15 +1,33 @@
 import logging
 import os
 import gzip
+import resource
+import time
+from itertools import islice
 from tqdm import tqdm
 import traceback
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
 from reference_data.management.commands.utils.download_utils import download_file
 from reference_data.management.commands.utils.gene_utils import get_genes_by_symbol_and_id
 from reference_data.models import GeneInfo
+from seqr.utils.gene_utils import invalidate_reference_data_cache
 
 logger = logging.getLogger(__name__)
 
+UPDATE_RECORDS_BATCH_SIZE = 5000
+
+
+def get_gene_reference():
+    if GeneInfo.objects.count() == 0:
+        raise CommandError("GeneInfo table is empty. Run './manage.py update_gencode' before running this command.")
+
+    gene_symbols_to_gene, gene_ids_to_gene = get_genes_by_symbol_and_id()
+    return {
+        'gene_symbols_to_gene': gene_symbols_to_gene,
+        'gene_ids_to_gene': gene_ids_to_gene,
+    }
+
 
 class ReferenceDataHandler(object):
 
@@ -20,15 +38,12 @@ class ReferenceDataHandler(object):
     batch_size = None
     keep_existing_records = False
 
-    def __init__(self, **kwargs):
-        if GeneInfo.objects.count() == 0:
-            raise CommandError("GeneInfo table is empty. Run './manage.py update_gencode' before running this command.")
-
-        gene_symbols_to_gene, gene_ids_to_gene = get_genes_by_symbol_and_id()
-        self.gene_reference = {
-            'gene_symbols_to_gene': gene_symbols_to_gene,
-            'gene_ids_to_gene': gene_ids_to_gene,
-        }
+    def __init__(self, gene_reference=None, **kwargs):
+        """
+        Args:
+            gene_reference (dict): optional gene lookup from get_gene_reference, to share a single lookup across handlers
+        """
+        self.gene_reference = gene_reference or get_gene_reference()
 
     @staticmethod
     def parse_record(record):
@@ -66,10 +81,69 @@ class GeneCommand(BaseCommand):
         update_records(self.reference_data_handler(**options), file_path=options.get('file_path'), )
 
 
+def _iter_models(reference_data_handler, file_path, skip_counter):
+    model_cls = reference_data_handler.model_cls
+    open_file = gzip.open if file_path.endswith('.gz') else open
+    open_mode = 'rt' if file_path.endswith('.gz') else 'r'
+    with open_file(file_path, open_mode) as f:
+        header_fields = reference_data_handler.get_file_header(f)
+
+        for line in reference_data_handler.get_file_iterator(f):
+            record = dict(zip(header_fields, line if isinstance(line, list) else line.rstrip('\r\n').split('\t')))
+            for record in reference_data_handler.parse_record(record):
+                if record is None:
+                    continue
+
+                try:
+                    record['gene'] = reference_data_handler.get_gene_for_record(record)
+                except ValueError as e:
+                    skip_counter['skipped'] += 1
+                    logger.debug(e)
+                    continue
+
+                yield model_cls(**record)
+
+
+def _shadow_table_name(model_cls):
+    return '{}__shadow'.format(model_cls._meta.db_table)
+
+
+def _load_shadow_table(model_cls, models, batch_size, cursor, connection):
+    """
+    Inserts the models into a temporary table with the same columns as the model's table, in fixed size batches so
+    only a single batch of models needs to be held in memory. Returns the shadow table name and the number of records
+    """
+    table = model_cls._meta.db_table
+    shadow_table = _shadow_table_name(model_cls)
+    fields = [field for field in model_cls._meta.concrete_fields if not field.primary_key]
+    columns = ', '.join([connection.ops.quote_name(field.column) for field in fields])
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(shadow_table))
+    cursor.execute('CREATE TEMPORARY TABLE {} AS SELECT {} FROM {} WITH NO DATA'.format(shadow_table, columns, table))
+
+    row_placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+    num_records = 0
+    models = iter(models)
+    batch = list(islice(models, batch_size))
+    while batch:
+        cursor.execute(
+            'INSERT INTO {} ({}) VALUES {}'.format(shadow_table, columns, ', '.join([row_placeholder] * len(batch))),
+            [field.get_db_prep_save(field.pre_save(model, True), connection) for model in batch for field in fields],
+        )
+        num_records += len(batch)
+        batch = list(islice(models, batch_size))
+
+    return shadow_table, columns, num_records
+
+
 def update_records(reference_data_handler, file_path=None):
     """
+    Records are streamed in batches into a shadow table, and then swapped into the model's table in a single
+    transaction, so the existing records stay available until the update is complete
+
     Args:
         file_path (str): optional local file path. If not specified, or the path doesn't exist, the table will be downloaded.
+    Returns:
+        bool: whether the records were updated. Errors are logged rather than raised
     """
     logger.info('Updating {}'.format(reference_data_handler))
 
@@ -79,45 +153,48 @@ def update_records(reference_data_handler, file_path=None):
     model_cls = reference_data_handler.model_cls
     model_name = model_cls.__name__
     model_objects = getattr(model_cls, 'objects')
+    db = router.db_for_write(model_cls)
+    connection = connections[db]
+    batch_size = reference_data_handler.batch_size or UPDATE_RECORDS_BATCH_SIZE
 
-    models = []
-    skip_counter = 0
+    skip_counter = {'skipped': 0}
+    start_time = time.time()
     logger.info('Parsing file')
-    open_file = gzip.open if file_path.endswith('.gz') else open
-    open_mode = 'rt' if file_path.endswith('.gz') else 'r'
     try:
-        with open_file(file_path, open_mode) as f:
-            header_fields = reference_data_handler.get_file_header(f)
-
-            for line in reference_data_handler.get_file_iterator(f):
-                record = dict(zip(header_fields, line if isinstance(line, list) else line.rstrip('\r\n').split('\t')))
-                for record in reference_data_handler.parse_record(record):
-                    if record is None:
-                        continue
-
-                    try:
-                        record['gene'] = reference_data_handler.get_gene_for_record(record)
-                    except ValueError as e:
-                        skip_counter += 1
-                        logger.debug(e)
-                        continue
-
-                    models.append(model_cls(**record))
-
+        models = _iter_models(reference_data_handler, file_path, skip_counter)
         if reference_data_handler.post_process_models:
+            # Post processing needs all the models, so they can not be streamed
+            models = list(models)
             reference_data_handler.post_process_models(models)
 
-        if not reference_data_handler.keep_existing_records:
-            logger.info("Deleting {} existing {} records".format(model_objects.count(), model_name))
-            model_objects.all().delete()
+        with connection.cursor() as cursor:
+            try:
+                shadow_table, columns, num_records = _load_shadow_table(
+                    model_cls, models, batch_size, cursor, connection)
+
+                with transaction.atomic(using=db):
+                    if not reference_data_handler.keep_existing_records:
+                        logger.info("Deleting {} existing {} records".format(model_objects.count(), model_name))
+                        model_objects.all().delete()
 
-        logger.info("Creating {} {} records".format(len(models), model_name))
-        model_objects.bulk_create(models)
+                    logger.info("Creating {} {} records".format(num_records, model_name))
+                    cursor.execute('INSERT INTO {table} ({columns}) SELECT {columns} FROM {shadow_table}'.format(
+                        table=model_cls._meta.db_table, columns=columns, shadow_table=shadow_table))
+            finally:
+                cursor.execute('DROP TABLE IF EXISTS {}'.format(_shadow_table_name(model_cls)))
+        invalidate_reference_data_cache()
 
         logger.info("Done")
         logger.info("Loaded {} {} records from {}. Skipped {} records with unrecognized genes.".format(
-            model_objects.count(), model_name, file_path, skip_counter))
-        if skip_counter > 0:
+            model_objects.count(), model_name, file_path, skip_counter['skipped']))
+        if skip_counter['skipped'] > 0:
             logger.info('Running ./manage.py update_gencode to update the gencode version might fix missing genes')
+
+        duration = time.time() - start_time
+        logger.info('Updated {} records in {:.1f}s ({:.0f} records/s), peak memory usage {:.0f} MB'.format(
+            num_records, duration, num_records / duration if duration else 0,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
     except Exception as e:
         logger.error(str(e), extra={'traceback': traceback.format_exc()})
+        return False
+    return True
@@ -17,6 +17,9 @@ class ReferenceDataCommandTestCase(TestCase):
         patcher = mock.patch('reference_data.management.commands.utils.update_utils.logger')
         self.mock_logger = patcher.start()
         self.addCleanup(patcher.stop)
+        patcher = mock.patch('reference_data.management.commands.utils.update_utils.invalidate_reference_data_cache')
+        self.mock_invalidate_reference_data_cache = patcher.start()
+        self.addCleanup(patcher.stop)
 
         tmp_dir = tempfile.gettempdir()
         self.tmp_file = '{}/{}'.format(tmp_dir, self.URL.split('/')[-1])
@@ -37,6 +40,7 @@ class ReferenceDataCommandTestCase(TestCase):
         call_command(command_name)
 
         self.mock_logger.error.assert_not_called()
+        self.mock_invalidate_reference_data_cache.assert_called_once()
         log_calls = [
             mock.call('Parsing file'),
             mock.call('Deleting {} existing {} records'.format(existing_records, model_name)),
@@ -49,9 +53,15 @@ class ReferenceDataCommandTestCase(TestCase):
         ]
         self.mock_logger.info.assert_has_calls(log_calls)
 
-        # test with a file_path parameter
+        self.mock_logger.info.assert_called_with(mock.ANY)
+        self.assertRegex(
+            self.mock_logger.info.call_args.args[0],
+            r'Updated {} records in [\d.]+s \(\d+ records/s\), peak memory usage \d+ MB'.format(created_records))
+
+        # test with a file_path parameter, loading records one at a time
         self.mock_logger.reset_mock()
         responses.remove(responses.GET, self.URL)
-        call_command(command_name, self.tmp_file)
+        with mock.patch('reference_data.management.commands.utils.update_utils.UPDATE_RECORDS_BATCH_SIZE', 1):
+            call_command(command_name, self.tmp_file)
         log_calls[1] = mock.call('Deleting {} existing {} records'.format(created_records, model_name))
         self.mock_logger.info.assert_has_calls(log_calls)
@@ -1,19 +1,20 @@
 import mock
+from concurrent.futures import ThreadPoolExecutor
 
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.test import TestCase
 
 
-def omim_exception(omim_key):
+def omim_exception(omim_key, **kwargs):
     raise Exception('Omim exception, key: '+omim_key)
 
 
-def primate_ai_exception():
+def primate_ai_exception(**kwargs):
     raise Exception('Primate_AI failed')
 
 
-def mgi_exception():
+def mgi_exception(**kwargs):
     raise Exception('MGI failed')
 
 SKIP_ARGS = [
@@ -26,19 +27,19 @@ class UpdateAllReferenceDataTest(TestCase):
     fixtures = ['users', 'reference_data']
 
     def setUp(self):
-        patcher = mock.patch('reference_data.management.commands.update_dbnsfp_gene.DbNSFPReferenceDataHandler', lambda: 'dbnsfp_gene')
+        patcher = mock.patch('reference_data.management.commands.update_dbnsfp_gene.DbNSFPReferenceDataHandler', lambda **kwargs: 'dbnsfp_gene')
         patcher.start()
         self.addCleanup(patcher.stop)
-        patcher = mock.patch('reference_data.management.commands.update_gene_cn_sensitivity.CNSensitivityReferenceDataHandler', lambda: 'gene_cn_sensitivity')
+        patcher = mock.patch('reference_data.management.commands.update_gene_cn_sensitivity.CNSensitivityReferenceDataHandler', lambda **kwargs: 'gene_cn_sensitivity')
         patcher.start()
         self.addCleanup(patcher.stop)
-        patcher = mock.patch('reference_data.management.commands.update_gene_constraint.GeneConstraintReferenceDataHandler', lambda: 'gene_constraint')
+        patcher = mock.patch('reference_data.management.commands.update_gene_constraint.GeneConstraintReferenceDataHandler', lambda **kwargs: 'gene_constraint')
         patcher.start()
         self.addCleanup(patcher.stop)
-        patcher = mock.patch('reference_data.management.commands.update_gencc.GenCCReferenceDataHandler', lambda: 'gencc')
+        patcher = mock.patch('reference_data.management.commands.update_gencc.GenCCReferenceDataHandler', lambda **kwargs: 'gencc')
         patcher.start()
         self.addCleanup(patcher.stop)
-        patcher = mock.patch('reference_data.management.commands.update_clingen.ClinGenReferenceDataHandler', lambda: 'clingen')
+        patcher = mock.patch('reference_data.management.commands.update_clingen.ClinGenReferenceDataHandler', lambda **kwargs: 'clingen')
         patcher.start()
         self.addCleanup(patcher.stop)
 
@@ -88,7 +89,7 @@ class UpdateAllReferenceDataTest(TestCase):
         ]
         self.mock_update_gencode.assert_has_calls(calls)
 
-        self.mock_omim.assert_called_with('test_key')
+        self.mock_omim.assert_called_with(omim_key='test_key', gene_reference=mock.ANY)
         self.mock_cached_omim.assert_not_called()
 
         self.assertEqual(self.mock_update_records.call_count, 6)
@@ -117,6 +118,20 @@ class UpdateAllReferenceDataTest(TestCase):
         ]
         self.mock_logger.error.assert_has_calls(calls)
 
+    def test_failed_update_records(self):
+        # Errors loading records are logged by update_records, which reports that the update failed
+        self.mock_update_records.side_effect = lambda data_handler: data_handler != 'gencc'
+        call_command('update_all_reference_data', '--skip-omim', *[
+            arg for arg in SKIP_ARGS if arg not in {'--skip-gencc', '--skip-clingen'}])
+
+        self.assertEqual(self.mock_update_records.call_count, 2)
+        self.mock_logger.info.assert_has_calls([
+            mock.call('Done'),
+            mock.call('Updated: clingen'),
+            mock.call('Failed to Update: gencc'),
+        ])
+        self.mock_logger.error.assert_called_with('unable to update gencc: error loading records')
+
     def test_skip_all_update_reference_data_command(self):
         call_command(
             'update_all_reference_data', '--skip-omim', *SKIP_ARGS)
@@ -134,7 +149,7 @@ class UpdateAllReferenceDataTest(TestCase):
         call_command(
             'update_all_reference_data', '--use-cached-omim', *SKIP_ARGS)
 
-        self.mock_cached_omim.assert_called_with()
+        self.mock_cached_omim.assert_called_with(gene_reference=mock.ANY)
         self.mock_update_records.assert_called_with('cached_omim')
 
         self.mock_omim.assert_not_called()
@@ -152,7 +167,7 @@ class UpdateAllReferenceDataTest(TestCase):
         call_command('update_all_reference_data', '--omim=test_key', *SKIP_ARGS)
 
         self.mock_update_gencode.assert_not_called()
-        self.mock_omim.assert_called_with('test_key')
+        self.mock_omim.assert_called_with(omim_key='test_key', gene_reference=mock.ANY)
         self.mock_update_records.assert_not_called()
         self.mock_update_hpo.assert_not_called()
 
@@ -164,3 +179,48 @@ class UpdateAllReferenceDataTest(TestCase):
 
         self.mock_logger.error.assert_called_with("unable to update omim: Omim exception, key: test_key")
 
+
+    @mock.patch('reference_data.management.commands.update_all_reference_data.connections')
+    @mock.patch('reference_data.management.commands.update_all_reference_data.ProcessPoolExecutor')
+    @mock.patch('reference_data.management.commands.update_all_reference_data.get_gene_reference')
+    def test_parallel_update_reference_data_command(self, mock_get_gene_reference, mock_executor, mock_connections):
+        gene_reference = {'gene_symbols_to_gene': {}, 'gene_ids_to_gene': {}}
+        mock_get_gene_reference.return_value = gene_reference
+        mock_executor.side_effect = lambda max_workers, mp_context: ThreadPoolExecutor(max_workers=max_workers)
+        self.mock_omim.return_value = 'omim'
+
+        def _mgi_handler(**kwargs):
+            # MGI is only updated once dbNSFP is loaded
+            self.assertIn(mock.call('dbnsfp_gene'), self.mock_update_records.call_args_list)
+            self.assertDictEqual(kwargs, {'gene_reference': gene_reference})
+            raise Exception('MGI failed')
+
+        with mock.patch.dict(
+                'reference_data.management.commands.update_all_reference_data.REFERENCE_DATA_SOURCES',
+                {'mgi': _mgi_handler}):
+            call_command('update_all_reference_data', '--omim-key=test_key', '--skip-gencode', '--parallel', '2')
+
+        mock_get_gene_reference.assert_called_once_with()
+        mock_connections.close_all.assert_called_once_with()
+        mock_executor.assert_called_once_with(max_workers=2, mp_context=mock.ANY)
+        self.mock_update_gencode.assert_not_called()
+        self.mock_omim.assert_called_with(omim_key='test_key', gene_reference=gene_reference)
+        self.mock_update_records.assert_has_calls([
+            mock.call('omim'), mock.call('dbnsfp_gene'), mock.call('gene_constraint'),
+            mock.call('gene_cn_sensitivity'), mock.call('gencc'), mock.call('clingen'),
+        ], any_order=True)
+        self.assertEqual(self.mock_update_records.call_count, 6)
+        self.mock_update_hpo.assert_called_with()
+
+        info_logs = [call.args[0] for call in self.mock_logger.info.call_args_list]
+        for i, source in enumerate(['omim', 'dbnsfp_gene', 'gene_constraint', 'gene_cn_sensitivity', 'gencc', 'clingen', 'hpo']):
+            self.assertRegex(info_logs[i], r'Updated {} in \d+\.\ds'.format(source))
+        self.assertListEqual(info_logs[7:], [
+            'Done',
+            'Updated: omim, dbnsfp_gene, gene_constraint, gene_cn_sensitivity, gencc, clingen, hpo',
+            'Failed to Update: primate_ai, mgi',
+        ])
+        self.mock_logger.error.assert_has_calls([
+            mock.call('unable to update primate_ai: Primate_AI failed'),
+            mock.call('unable to update mgi: MGI failed'),
+        ])
@@ -148,10 +148,12 @@ class UpdateGencodeTest(TestCase):
         self.assertEqual(responses.calls[0].request.url, url_23_lift)
         self.assertEqual(responses.calls[2].request.url, url_23)
 
+    @mock.patch('reference_data.management.commands.update_gencode.invalidate_reference_data_cache')
     @mock.patch('reference_data.management.commands.update_gencode.logger')
-    def test_update_gencode_command(self, mock_logger):
+    def test_update_gencode_command(self, mock_logger, mock_invalidate_reference_data_cache):
         # Test normal command function
         call_command('update_gencode', '--gencode-release=31', self.temp_file_path, '37')
+        mock_invalidate_reference_data_cache.assert_called_once()
         calls = [
             mock.call(
                 'Loading {} (genome version: 37)'.format(self.temp_file_path)),
@@ -215,3 +217,158 @@ class UpdateGencodeTest(TestCase):
         self.assertEqual(gene_info.gene_symbol, 'OR4F16')
         self.assertEqual(gene_info.end_grch37, 622053)
         self.assertEqual(gene_info.strand_grch37, '-')
+
+    @mock.patch('reference_data.management.commands.update_gencode.logger')
+    def test_update_gencode_command_cache(self, mock_logger):
+        cache_dir = os.path.join(self.test_dir, 'cache')
+        os.mkdir(cache_dir)
+        cache_path = os.path.join(cache_dir, 'gencode.v31.GRCh37.annotations.json.gz')
+        call_command(
+            'update_gencode', '--reset', '--gencode-release=31', '--cache-dir={}'.format(cache_dir),
+            self.temp_file_path, '37')
+        self.assertTrue(os.path.isfile(cache_path))
+        mock_logger.info.assert_any_call('Cached the parsed annotations to {}'.format(cache_path))
+        self.assertEqual(GeneInfo.objects.get(gene_id='ENSG00000284662').coding_region_size_grch37, 936)
+
+        # Cached annotations are used instead of re-parsing the file
+        mock_logger.reset_mock()
+        with gzip.open(self.temp_file_path, 'wt') as f:
+            f.write(''.join(BAD_FIELDS_GTF_DATA))
+        call_command(
+            'update_gencode', '--reset', '--gencode-release=31', '--cache-dir={}'.format(cache_dir),
+            self.temp_file_path, '37')
+        mock_logger.info.assert_any_call('Using the cached annotations in {}'.format(cache_path))
+        self.assertEqual(GeneInfo.objects.count(), 2)
+        self.assertEqual(TranscriptInfo.objects.count(), 2)
+        self.assertEqual(GeneInfo.objects.get(gene_id='ENSG00000284662').coding_region_size_grch37, 936)
+
+        # Annotations are cached separately for each release
+        with self.assertRaises(ValueError):
+            call_command(
+                'update_gencode', '--gencode-release=30', '--cache-dir={}'.format(cache_dir), self.temp_file_path, '37')
+
+    @mock.patch('reference_data.management.commands.update_gencode.invalidate_reference_data_cache')
+    @mock.patch('reference_data.management.commands.update_gencode.logger')
+    def test_update_gencode_command_diff(self, mock_logger, mock_invalidate_reference_data_cache):
+        with self.assertRaises(CommandError) as ce:
+            call_command('update_gencode', '--reset', '--diff', '--gencode-release=31', self.temp_file_path, '37')
+        self.assertEqual(str(ce.exception), 'Error: argument --diff: not allowed with argument --reset')
+
+        call_command('update_gencode', '--diff', '--gencode-release=31', self.temp_file_path, '37')
+        mock_invalidate_reference_data_cache.assert_called_once()
+        mock_logger.info.assert_has_calls([
+            mock.call('Loading {} (genome version: 37)'.format(self.temp_file_path)),
+            mock.call('Creating 1 GeneInfo records'),
+            mock.call('Updating 0 GeneInfo records'),
+            mock.call('Creating 2 TranscriptInfo records'),
+            mock.call('Updating 0 TranscriptInfo records'),
+            mock.call('Retiring 0 TranscriptInfo records'),
+            mock.call('Retiring 0 GeneInfo records'),
+            mock.call('Done'),
+            mock.call('Stats: '),
+            mock.call('  genes_created: 1'),
+            mock.call('  genes_updated: 0'),
+            mock.call('  transcripts_created: 2'),
+            mock.call('  transcripts_updated: 0'),
+            mock.call('  transcripts_retired: 0'),
+            mock.call('  genes_retired: 0'),
+        ])
+
+        # Genes from older releases are kept, and unchanged genes keep the release they were loaded from
+        self.assertEqual(GeneInfo.objects.count(), 50)
+        gene_info = GeneInfo.objects.get(gene_id='ENSG00000223972')
+        self.assertEqual(gene_info.gencode_release, 27)
+        self.assertEqual(gene_info.start_grch38, 11869)
+        gene_info = GeneInfo.objects.get(gene_id='ENSG00000284662')
+        self.assertEqual(gene_info.coding_region_size_grch37, 936)
+        self.assertEqual(gene_info.gene_symbol, 'OR4F16')
+        self.assertEqual(TranscriptInfo.objects.get(transcript_id='ENST00000332831').coding_region_size_grch37, 936)
+
+        # Only changed records are updated
+        updated_gtf_data = [
+            line.replace('gene_name "OR4F16"', 'gene_name "OR4F16A"').replace('622034', '622030')
+            for line in GTF_DATA if 'ENST00000456328' not in line
+        ]
+        with gzip.open(self.temp_file_path, 'wt') as f:
+            f.write(''.join(updated_gtf_data))
+        mock_logger.reset_mock()
+        call_command('update_gencode', '--diff', '--gencode-release=31', self.temp_file_path, '37')
+        mock_logger.info.assert_has_calls([
+            mock.call('Creating 0 GeneInfo records'),
+            mock.call('Updating 1 GeneInfo records'),
+            mock.call('Creating 0 TranscriptInfo records'),
+            mock.call('Updating 1 TranscriptInfo records'),
+            mock.call('Retiring 1 TranscriptInfo records'),
+            mock.call('Retiring 0 GeneInfo records'),
+            mock.call('Done'),
+            mock.call('Stats: '),
+            mock.call('  GeneInfo.gene_symbol changed: 1'),
+            mock.call('  GeneInfo.coding_region_size_grch37 changed: 1'),
+            mock.call('  TranscriptInfo.coding_region_size_grch37 changed: 1'),
+        ])
+
+        gene_info = GeneInfo.objects.get(gene_id='ENSG00000284662')
+        self.assertEqual(gene_info.gene_symbol, 'OR4F16A')
+        self.assertEqual(gene_info.coding_region_size_grch37, 932)
+        self.assertEqual(gene_info.start_grch37, 621059)
+        self.assertListEqual(list(TranscriptInfo.objects.values_list('transcript_id', flat=True)), ['ENST00000332831'])
+        self.assertEqual(TranscriptInfo.objects.get(transcript_id='ENST00000332831').coding_region_size_grch37, 932)
+
+        # Genes are only retired from the given releases
+        with self.assertRaises(CommandError) as ce:
+            call_command('update_gencode', '--retire-releases', '31', '--gencode-release=31', self.temp_file_path, '37')
+        self.assertEqual(str(ce.exception), 'Releases can only be retired when using diff')
+
+        with gzip.open(self.temp_file_path, 'wt') as f:
+            f.write(''.join([line for line in updated_gtf_data if 'ENSG00000284662' not in line]))
+        mock_logger.reset_mock()
+        call_command(
+            'update_gencode', '--diff', '--retire-releases', '31', '--gencode-release=31', self.temp_file_path, '37')
+        mock_logger.info.assert_has_calls([
+            mock.call('Creating 0 GeneInfo records'),
+            mock.call('Updating 0 GeneInfo records'),
+            mock.call('Creating 0 TranscriptInfo records'),
+            mock.call('Updating 0 TranscriptInfo records'),
+            mock.call('Retiring 0 TranscriptInfo records'),
+            mock.call('Retiring 1 GeneInfo records'),
+        ])
+        self.assertEqual(GeneInfo.objects.count(), 49)
+        self.assertFalse(GeneInfo.objects.filter(gene_id='ENSG00000284662').exists())
+        self.assertEqual(TranscriptInfo.objects.count(), 0)
+
+    @mock.patch('reference_data.management.commands.update_gencode.download_file')
+    @mock.patch('reference_data.management.commands.update_gencode.invalidate_reference_data_cache')
+    @mock.patch('reference_data.management.commands.update_gencode.logger')
+    def test_update_gencode_command_diff_both_builds(self, mock_logger, mock_invalidate_reference_data_cache,
+                                                     mock_download_file):
+        # OR4F16 is only in the GRCh37 GTF, so its GRCh38 fields are null
+        grch38_file_path = os.path.join(self.test_dir, 'gencode.v31.annotation.gtf.gz')
+        with gzip.open(grch38_file_path, 'wt') as f:
+            f.write(''.join([line for line in GTF_DATA if 'ENSG00000284662' not in line]))
+        mock_download_file.side_effect = lambda url: self.temp_file_path if 'lift37' in url else grch38_file_path
+
+        call_command('update_gencode', '--diff', '--gencode-release=31')
+        gene_info = GeneInfo.objects.get(gene_id='ENSG00000284662')
+        self.assertEqual(gene_info.start_grch37, 621059)
+        self.assertIsNone(gene_info.start_grch38)
+        self.assertEqual(gene_info.coding_region_size_grch38, 0)
+
+        # Running the same diff again makes no changes
+        mock_logger.reset_mock()
+        call_command('update_gencode', '--diff', '--gencode-release=31')
+        mock_logger.info.assert_has_calls([
+            mock.call('Creating 0 GeneInfo records'),
+            mock.call('Updating 0 GeneInfo records'),
+            mock.call('Creating 0 TranscriptInfo records'),
+            mock.call('Updating 0 TranscriptInfo records'),
+            mock.call('Retiring 0 TranscriptInfo records'),
+            mock.call('Retiring 0 GeneInfo records'),
+            mock.call('Done'),
+            mock.call('Stats: '),
+            mock.call('  genes_created: 0'),
+            mock.call('  genes_updated: 0'),
+            mock.call('  transcripts_created: 0'),
+            mock.call('  transcripts_updated: 0'),
+            mock.call('  transcripts_retired: 0'),
+            mock.call('  genes_retired: 0'),
+        ])
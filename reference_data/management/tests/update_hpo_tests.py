@@ -131,9 +131,10 @@ class UpdateHpoTest(TestCase):
     fixtures = ['users', 'reference_data']
 
     @responses.activate
+    @mock.patch('reference_data.management.commands.update_human_phenotype_ontology.invalidate_reference_data_cache')
     @mock.patch('reference_data.management.commands.update_human_phenotype_ontology.logger')
     @mock.patch('reference_data.management.commands.utils.download_utils.tempfile')
-    def test_update_hpo_command(self, mock_tempfile, mock_logger):
+    def test_update_hpo_command(self, mock_tempfile, mock_logger, mock_invalidate_reference_data_cache):
         tmp_dir = tempfile.gettempdir()
         mock_tempfile.gettempdir.return_value = tmp_dir
         tmp_file = '{}/hp.obo'.format(tmp_dir)
@@ -148,8 +149,11 @@ class UpdateHpoTest(TestCase):
             call_command('update_human_phenotype_ontology')
         self.assertEqual(str(ve.exception), "Strange id: HP:0000003")
 
+        mock_invalidate_reference_data_cache.assert_not_called()
+
         # test without a file_path parameter
         call_command('update_human_phenotype_ontology')
+        mock_invalidate_reference_data_cache.assert_called_once()
 
         calls = [
             mock.call('Deleting HumanPhenotypeOntology table with 11 records and creating new table with 5 records'),
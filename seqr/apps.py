@@ -3,3 +3,7 @@ from django.apps import AppConfig
 class SeqrConfig(AppConfig):
     name = 'seqr'
 
+    def ready(self):
+        # Registers the signal receivers which keep cached project counts and search samples up to date
+        import seqr.utils.project_stats_utils  # noqa: F401
+        import seqr.utils.elasticsearch.search_samples  # noqa: F401
@@ -1,8 +1,9 @@
 from django.core.management.base import BaseCommand
 import logging
+import tempfile
 
 from seqr.models import RnaSeqOutlier
-from seqr.views.utils.dataset_utils import load_rna_seq_outlier
+from seqr.views.utils.dataset_utils import load_rna_seq_outlier, copy_rna_seq_sample_data
 from seqr.views.utils.file_utils import parse_file
 
 logger = logging.getLogger(__name__)
@@ -21,11 +22,13 @@ class Command(BaseCommand):
             with open(options['mapping_file']) as f:
                 mapping_file = parse_file(options['mapping_file'], f)
 
-        samples_to_load, _, _ = load_rna_seq_outlier(options['input_file'], mapping_file=mapping_file, ignore_extra_samples=options['ignore_extra_samples'])
+        with tempfile.TemporaryDirectory() as staging_dir:
+            samples_to_load, _, _ = load_rna_seq_outlier(
+                options['input_file'], staging_dir, mapping_file=mapping_file,
+                ignore_extra_samples=options['ignore_extra_samples'])
 
-        for sample, data_by_gene in samples_to_load.items():
-            models = RnaSeqOutlier.objects.bulk_create(
-                [RnaSeqOutlier(sample=sample, **data) for data in data_by_gene.values()])
-            logger.info(f'create {len(models)} RnaSeqOutliers for {sample.sample_id}')
+            for sample, sample_file in samples_to_load.items():
+                num_created = copy_rna_seq_sample_data(RnaSeqOutlier, sample, sample_file)
+                logger.info(f'create {num_created} RnaSeqOutliers for {sample.sample_id}')
 
 
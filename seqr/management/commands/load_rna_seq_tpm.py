@@ -1,9 +1,10 @@
 import logging
+import tempfile
 from django.core.management.base import BaseCommand
 
 from seqr.models import RnaSeqTpm
 from seqr.views.utils.file_utils import parse_file
-from seqr.views.utils.dataset_utils import load_rna_seq_tpm
+from seqr.views.utils.dataset_utils import load_rna_seq_tpm, copy_rna_seq_sample_data
 
 logger = logging.getLogger(__name__)
 
@@ -31,13 +32,14 @@ class Command(BaseCommand):
             with open(options['mapping_file']) as f:
                 mapping_file = parse_file(options['mapping_file'], f)
 
-        samples_to_load, _, _ = load_rna_seq_tpm(
-            options['input_file'], mapping_file=mapping_file, ignore_extra_samples=options['ignore_extra_samples'])
+        with tempfile.TemporaryDirectory() as staging_dir:
+            samples_to_load, _, _ = load_rna_seq_tpm(
+                options['input_file'], staging_dir, mapping_file=mapping_file,
+                ignore_extra_samples=options['ignore_extra_samples'])
 
-        for sample, data_by_gene in samples_to_load.items():
-            models = RnaSeqTpm.objects.bulk_create(
-                [RnaSeqTpm(sample=sample, **data) for data in data_by_gene.values()], batch_size=1000)
-            logger.info(f'create {len(models)} RnaSeqTpm for {sample.sample_id}')
+            for sample, sample_file in samples_to_load.items():
+                num_created = copy_rna_seq_sample_data(RnaSeqTpm, sample, sample_file)
+                logger.info(f'create {num_created} RnaSeqTpm for {sample.sample_id}')
 
         logger.info('DONE')
 
@@ -0,0 +1,21 @@
+import logging
+from django.core.management.base import BaseCommand
+from seqr.models import Project
+from seqr.utils.project_stats_utils import update_project_stats, PROJECT_STATS_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the cached summary counts used by the dashboard and seqr stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', help='optional project to rebuild counts for')
+
+    def handle(self, *args, **options):
+        project_name = options['project']
+        projects = Project.objects.filter(name=project_name) if project_name else Project.objects.all()
+        project_ids = list(projects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(project_ids), PROJECT_STATS_BATCH_SIZE):
+            update_project_stats(project_ids[i:i + PROJECT_STATS_BATCH_SIZE])
+        logger.info(u'Rebuilt project stats for {} projects'.format(len(project_ids)))
@@ -14,6 +14,7 @@ class LoadRnaSeqTest(TestCase):
     fixtures = ['users', '1kg_project', 'reference_data']
 
     @mock.patch('seqr.views.utils.dataset_utils.ANALYST_PROJECT_CATEGORY', 'analyst-projects')
+    @mock.patch('seqr.views.utils.dataset_utils.RNA_SEQ_STAGING_CHUNK_SIZE', 2)
     @mock.patch('seqr.management.commands.load_rna_seq_outlier.logger.info')
     @mock.patch('seqr.management.commands.load_rna_seq_outlier.open')
     @mock.patch('seqr.utils.file_utils.gzip.open')
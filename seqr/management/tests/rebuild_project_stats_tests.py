@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+PROJECT_NAME = '1kg project nåme with uniçøde'
+
+
+class RebuildProjectStatsTest(TestCase):
+    fixtures = ['users', '1kg_project']
+
+    @mock.patch('seqr.management.commands.rebuild_project_stats.PROJECT_STATS_BATCH_SIZE', 3)
+    @mock.patch('seqr.management.commands.rebuild_project_stats.update_project_stats')
+    @mock.patch('seqr.management.commands.rebuild_project_stats.logger')
+    def test_command(self, mock_logger, mock_update_project_stats):
+        call_command('rebuild_project_stats', '--project={}'.format(PROJECT_NAME))
+        mock_update_project_stats.assert_called_once_with([1])
+        mock_logger.info.assert_called_with('Rebuilt project stats for 1 projects')
+
+        mock_update_project_stats.reset_mock()
+        call_command('rebuild_project_stats')
+        self.assertListEqual(mock_update_project_stats.call_args_list, [mock.call([1, 2, 3]), mock.call([4])])
+        mock_logger.info.assert_called_with('Rebuilt project stats for 4 projects')
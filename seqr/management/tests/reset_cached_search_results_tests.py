@@ -19,10 +19,13 @@ class ResetCachedSearchResultsTest(TestCase):
         result.families.set(Family.objects.filter(pk=1))
         cls.result_guid = result.guid
 
-    @mock.patch('seqr.views.utils.variant_utils.redis.StrictRedis')
+    @mock.patch('seqr.views.utils.variant_utils.invalidate_search_samples')
+    @mock.patch('seqr.views.utils.variant_utils.invalidate_index_metadata')
+    @mock.patch('seqr.views.utils.variant_utils.get_redis_client')
     @mock.patch('seqr.views.utils.variant_utils.logger')
     @mock.patch('seqr.management.commands.reset_cached_search_results.logger')
-    def test_command(self, mock_command_logger, mock_utils_logger, mock_redis):
+    def test_command(self, mock_command_logger, mock_utils_logger, mock_redis, mock_invalidate_index_metadata,
+                     mock_invalidate_search_samples):
         mock_redis.return_value.keys.side_effect = lambda pattern: [pattern]
 
         # Test command with a --project argument
@@ -30,6 +33,7 @@ class ResetCachedSearchResultsTest(TestCase):
         mock_redis.return_value.delete.assert_called_with('search_results__{}*'.format(self.result_guid))
         mock_utils_logger.info.assert_called_with('Reset 1 cached results')
         mock_command_logger.info.assert_called_with('Reset cached search results for {}'.format(PROJECT_NAME))
+        mock_invalidate_search_samples.assert_called_once()
 
         # Test for empty project
         mock_redis.reset_mock()
@@ -44,12 +48,15 @@ class ResetCachedSearchResultsTest(TestCase):
         mock_redis.return_value.delete.assert_called_with('search_results__*')
         mock_utils_logger.info.assert_called_with('Reset 1 cached results')
         mock_command_logger.info.assert_called_with('Reset cached search results for all projects')
+        mock_invalidate_index_metadata.assert_not_called()
 
         # Test command for reset metadata
         mock_redis.reset_mock()
         call_command('reset_cached_search_results', '--reset-index-metadata')
-        mock_redis.return_value.delete.assert_called_with('search_results__*', 'index_metadata__*')
-        mock_utils_logger.info.assert_called_with('Reset 2 cached results')
+        mock_redis.return_value.delete.assert_called_with(
+            'search_results__*', 'index_metadata__*', 'index_metadata_aliases__*')
+        mock_utils_logger.info.assert_called_with('Reset 3 cached results')
+        mock_invalidate_index_metadata.assert_called_with()
         mock_command_logger.info.assert_called_with('Reset cached search results for all projects')
 
         # Test with connection error
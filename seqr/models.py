@@ -8,6 +8,7 @@ from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import PermissionDenied
 from django.db import models
 from django.db.models import base, options, ForeignKey, JSONField
+from django.dispatch import Signal
 from django.utils import timezone
 from django.utils.text import slugify as __slugify
 
@@ -28,6 +29,10 @@ options.DEFAULT_NAMES = options.DEFAULT_NAMES + ('json_fields', 'internal_json_f
 CAN_VIEW = 'can_view'
 CAN_EDIT = 'can_edit'
 
+# Queryset updates do not send save signals, so bulk updates send this with the queryset and the updated fields before
+# the update is run
+pre_bulk_update = Signal()
+
 
 def _slugify(text):
     # using _ instead of - makes ids easier to select, and use without quotes in a wider set of contexts
@@ -138,6 +143,7 @@ class ModelWithGUID(models.Model, metaclass=CustomModelBase):
             queryset = cls.objects.filter(**filter_kwargs)
 
         entity_ids = log_model_bulk_update(logger, queryset, user, 'update', update_fields=update_json.keys())
+        pre_bulk_update.send(sender=cls, queryset=queryset, update_fields=update_json.keys())
         queryset.update(**update_json)
         return entity_ids
 
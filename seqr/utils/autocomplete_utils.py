@@ -0,0 +1,70 @@
+from bisect import bisect_right
+from heapq import merge
+
+
+class AutocompleteIndex(object):
+
+    def __init__(self, records, fields):
+        """
+        In-memory index for case insensitive prefix and substring matching on a fixed set of records. Records are kept
+        in ranked order, and the values for each field are joined into a single upper cased string, so matches are
+        found with str.find instead of by checking every record, and the search can stop once enough results are found
+
+        Args:
+            records: list of dicts, in the order in which matching records are returned. Records loaded from the
+                database should be ordered by the query, so ranking follows the database collation
+            fields: the record keys which are searched
+        """
+        self._records = list(records)
+        self._field_values = {field: self._join_field_values(field) for field in fields}
+
+    def _join_field_values(self, field):
+        # Each value is preceded by a newline, so prefix matches are found by searching for a newline and the query
+        values = [
+            '' if record.get(field) is None else str(record[field]).upper().replace('\n', ' ') for record in self._records
+        ]
+        starts = []
+        position = 1
+        for value in values:
+            starts.append(position)
+            position += len(value) + 1
+        starts.append(position)
+        return '\n{}\n'.format('\n'.join(values)), starts
+
+    def _iter_matches(self, field, pattern):
+        """Yields the index of each record whose value for the field contains the pattern, in ranked order"""
+        joined_values, starts = self._field_values[field]
+        position = joined_values.find(pattern)
+        while position != -1:
+            # A pattern with no newlines always lies within a single value, and a prefix pattern starts with the
+            # newline directly before the value
+            record_index = bisect_right(starts, position + 1) - 1
+            if record_index >= len(self._records):
+                return
+            yield record_index
+            position = joined_values.find(pattern, starts[record_index + 1] - 1)
+
+    def search(self, query, max_results, prefix_fields=()):
+        """
+        Returns records where any field contains the query. Records where any of the prefix fields start with the query
+        are returned first, with matches for earlier prefix fields ranked higher
+        """
+        query = query.upper()
+        if not query or '\n' in query:
+            return []
+
+        match_groups = [self._iter_matches(field, '\n' + query) for field in prefix_fields]
+        match_groups.append(merge(*[self._iter_matches(field, query) for field in self._field_values.keys()]))
+
+        matched_indices = []
+        seen = set()
+        for matches in match_groups:
+            if len(matched_indices) >= max_results:
+                break
+            for record_index in matches:
+                if record_index not in seen:
+                    seen.add(record_index)
+                    matched_indices.append(record_index)
+                    if len(matched_indices) >= max_results:
+                        break
+        return [self._records[i] for i in matched_indices]
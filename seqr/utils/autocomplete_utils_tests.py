@@ -0,0 +1,66 @@
+from django.test import TestCase
+
+from seqr.utils.autocomplete_utils import AutocompleteIndex
+
+# Records are given in ranked order
+RECORDS = [
+    {'id': 'HP:0011675', 'name': 'Arrhythmia'},
+    {'id': 'HP:0001631', 'name': 'Defect in the atrial septum'},
+    {'id': 'HP:0001508', 'name': 'Failure to thrive\ninfancy'},
+    {'id': 'HP:0002011', 'name': 'Morphological abnormality of the central nervous system'},
+    {'id': 'HP:0001636', 'name': 'Tetralogy of Fallot'},
+    {'id': 'HP:0012639', 'name': None},
+]
+
+
+class AutocompleteUtilsTest(TestCase):
+
+    def test_autocomplete_index(self):
+        index = AutocompleteIndex(RECORDS, fields=['id', 'name'])
+
+        self.assertListEqual([r['id'] for r in index.search('t', 10)], [
+            'HP:0011675', 'HP:0001631', 'HP:0001508', 'HP:0002011', 'HP:0001636',
+        ])
+        self.assertListEqual([r['id'] for r in index.search('t', 3)], ['HP:0011675', 'HP:0001631', 'HP:0001508'])
+        self.assertListEqual([r['id'] for r in index.search('hp:00016', 10)], [
+            'HP:0001631', 'HP:0001636',
+        ])
+        self.assertListEqual(index.search('xyz', 10), [])
+        self.assertListEqual(index.search('', 10), [])
+
+        # Values are matched individually, not across fields or lines
+        self.assertListEqual(index.search('1636Tetralogy', 10), [])
+        self.assertListEqual(index.search('thrive\ninf', 10), [])
+        self.assertListEqual([r['id'] for r in index.search('thrive inf', 10)], ['HP:0001508'])
+
+        # Prefix matches are ranked first, in the order of the prefix fields
+        self.assertListEqual([r['id'] for r in index.search('t', 10, prefix_fields=['name'])], [
+            'HP:0001636', 'HP:0011675', 'HP:0001631', 'HP:0001508', 'HP:0002011',
+        ])
+        self.assertListEqual([r['id'] for r in index.search('hp:0012', 10, prefix_fields=['name', 'id'])], [
+            'HP:0012639',
+        ])
+        self.assertListEqual([r['id'] for r in index.search('a', 4, prefix_fields=['name', 'id'])], [
+            'HP:0011675', 'HP:0001631', 'HP:0001508', 'HP:0002011',
+        ])
+        self.assertListEqual([r['id'] for r in index.search('HP:0001', 10, prefix_fields=['name', 'id'])], [
+            'HP:0001631', 'HP:0001508', 'HP:0001636',
+        ])
+
+        # Records are ranked in the order they are given, which for records loaded from the database is the order of
+        # its collation rather than python string order
+        collated_records = [
+            {'id': 'HP:0000001', 'name': 'abnormal gait'},
+            {'id': 'HP:0000002', 'name': 'Abnormal-Gait'},
+            {'id': 'HP:0000003', 'name': "Abnormal's gait"},
+            {'id': 'HP:0000004', 'name': 'ABNORMAL GAIT, mild'},
+            {'id': 'HP:0000005', 'name': '(Abnormal) gait'},
+        ]
+        index = AutocompleteIndex(collated_records, fields=['id', 'name'])
+        self.assertListEqual([r['id'] for r in index.search('abnormal', 10, prefix_fields=['name'])], [
+            'HP:0000001', 'HP:0000002', 'HP:0000003', 'HP:0000004', 'HP:0000005',
+        ])
+        self.assertListEqual([r['id'] for r in index.search('L G', 10, prefix_fields=['name'])], [
+            'HP:0000001', 'HP:0000004',
+        ])
+        self.assertListEqual([r['id'] for r in index.search('(abn', 10, prefix_fields=['name'])], ['HP:0000005'])
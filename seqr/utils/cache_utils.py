@@ -0,0 +1,83 @@
+from collections import OrderedDict, defaultdict
+from threading import Lock, local
+from time import monotonic
+
+from django.db import transaction
+
+
+class LocalCache(object):
+
+    def __init__(self, max_size=1000, ttl=300):
+        """
+        Thread-safe in-process LRU cache where entries expire after ttl seconds. Entries are not shared between server
+        processes, so should only be used in front of a shared cache or for data which tolerates being briefly stale
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._get(key, default)
+
+    def get_many(self, keys):
+        """Returns a dict of the cached values for any of the given keys which are in the cache"""
+        missing = object()
+        with self._lock:
+            values = {key: self._get(key, missing) for key in keys}
+        return {key: value for key, value in values.items() if value is not missing}
+
+    def _get(self, key, default):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        if self._max_size < 1:
+            return
+        with self._lock:
+            self._entries[key] = (monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_PENDING_ON_COMMIT = local()
+
+
+def batch_on_commit(callback, items):
+    """
+    Calls callback once with the set of all items batched for it in the current transaction, after the transaction
+    commits. Outside of a transaction the callback is called immediately. Items batched in a transaction which is rolled
+    back are passed to the next call of the callback
+    """
+    if not hasattr(_PENDING_ON_COMMIT, 'items'):
+        _PENDING_ON_COMMIT.items = defaultdict(set)
+    _PENDING_ON_COMMIT.items[callback].update(items)
+    # Every batched call registers a callback, since callbacks registered in a rolled back transaction are discarded.
+    # The first one to run after the commit handles all of the batched items
+    transaction.on_commit(lambda: _run_batched_callback(callback))
+
+
+def _run_batched_callback(callback):
+    items = _PENDING_ON_COMMIT.items.pop(callback, None)
+    if items:
+        callback(items)
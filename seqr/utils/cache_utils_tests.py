@@ -0,0 +1,74 @@
+import mock
+from django.db import transaction
+from django.test import TestCase as DjangoTestCase
+from unittest import TestCase
+
+from seqr.utils.cache_utils import LocalCache, batch_on_commit
+
+
+@mock.patch('seqr.utils.cache_utils.monotonic')
+class LocalCacheTest(TestCase):
+
+    def test_local_cache(self, mock_time):
+        mock_time.return_value = 100
+        cache = LocalCache(max_size=2, ttl=10)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 'default'), 'default')
+
+        cache.set('a', {'value': 1})
+        cache.set('b', None)
+        self.assertDictEqual(cache.get('a'), {'value': 1})
+        self.assertDictEqual(cache.get_many(['a', 'b', 'c']), {'a': {'value': 1}, 'b': None})
+
+        # Least recently used entries are evicted
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertDictEqual(cache.get_many(['a', 'b', 'c']), {'a': {'value': 1}, 'c': 3})
+
+        # Expired entries are not returned
+        mock_time.return_value = 105
+        cache.set('c', 4)
+        mock_time.return_value = 111
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 4)
+
+        cache.delete('c')
+        cache.delete('missing')
+        self.assertEqual(len(cache), 0)
+
+        cache.set('a', 1)
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+
+        disabled_cache = LocalCache(max_size=0)
+        disabled_cache.set('a', 1)
+        self.assertIsNone(disabled_cache.get('a'))
+
+
+class BatchOnCommitTest(DjangoTestCase):
+
+    def test_batch_on_commit(self):
+        callback = mock.MagicMock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            batch_on_commit(callback, [1, 2])
+            batch_on_commit(callback, [2, 3])
+            callback.assert_not_called()
+        callback.assert_called_once_with({1, 2, 3})
+
+        # Items from a rolled back transaction are kept for the next call
+        callback.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    batch_on_commit(callback, [4])
+                    raise ValueError
+            except ValueError:
+                pass
+        callback.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            batch_on_commit(callback, [5])
+        callback.assert_called_once_with({4, 5})
@@ -6,6 +6,7 @@ MAX_COMPOUND_HET_GENES = 1000
 MAX_INDEX_NAME_LENGTH = 4000
 MAX_SEARCH_CLAUSES = 1024
 MAX_NO_LOCATION_COMP_HET_FAMILIES = 100
+CACHED_RESULTS_CHUNK_SIZE = 100
 
 XPOS_SORT_KEY = 'xpos'
 
@@ -306,11 +307,11 @@ CORE_FIELDS_CONFIG = {
     'variantId': {},
     'xpos': {'format_value': int},
     XSTOP_FIELD:  {'format_value': int},
-    'rg37_locus_end': {'response_key': 'rg37LocusEnd', 'format_value': lambda locus: locus.to_dict()},
+    'rg37_locus_end': {'response_key': 'rg37LocusEnd', 'format_value': dict},
     'sv_type_detail': {'response_key': 'svTypeDetail'},
     'cpx_intervals': {
       'response_key': 'cpxIntervals',
-      'format_value': lambda intervals:  [interval.to_dict() for interval in (intervals or [])],
+      'format_value': lambda intervals:  [dict(interval) for interval in (intervals or [])],
     },
     'algorithms': {'format_value': ', '.join},
     'bothsides_support': {'response_key': 'bothsidesSupport'},
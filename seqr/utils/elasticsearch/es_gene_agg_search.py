@@ -7,6 +7,7 @@ from seqr.utils.elasticsearch.es_search import EsSearch
 class EsGeneAggSearch(EsSearch):
     AGGREGATION_NAME = 'gene aggregation'
     CACHED_COUNTS_KEY = None
+    CACHED_RESULTS_PAGINATED = False
 
     def search(self, *args, **kwargs):
         self._aggregate_by_gene()
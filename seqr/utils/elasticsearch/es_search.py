@@ -1,4 +1,5 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from copy import deepcopy
 import elasticsearch
 from elasticsearch_dsl import Search, Q, MultiSearch
@@ -6,7 +7,7 @@ import hashlib
 import json
 from pyliftover.liftover import LiftOver
 from sys import maxsize
-from itertools import combinations
+from time import time
 
 from reference_data.models import GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37
 from seqr.models import Sample, Individual
@@ -19,26 +20,30 @@ from seqr.utils.elasticsearch.constants import XPOS_SORT_KEY, COMPOUND_HET, RECE
     PREDICTION_FIELD_LOOKUP, SPLICE_AI_FIELD, CLINVAR_KEY, HGMD_KEY, CLINVAR_PATH_SIGNIFICANCES, \
     PATH_FREQ_OVERRIDE_CUTOFF, MAX_NO_LOCATION_COMP_HET_FAMILIES, NEW_SV_FIELD, AFFECTED, UNAFFECTED, HAS_ALT, \
     get_prediction_response_key, XSTOP_FIELD, GENOTYPE_FIELDS
+from seqr.utils.elasticsearch.search_samples import get_samples_by_family_index
 from seqr.utils.logging_utils import SeqrLogger
 from seqr.utils.redis_utils import safe_redis_get_json, safe_redis_set_json
 from seqr.utils.xpos_utils import get_xpos, MIN_POS, MAX_POS, get_chrom_pos
 from seqr.views.utils.json_utils import _to_camel_case
+from settings import ELASTICSEARCH_PARALLEL_SEARCH_WORKERS, ELASTICSEARCH_INDEX_SEARCH_TIMEOUT
 
 logger = SeqrLogger(__name__)
 
+INDEX_SEARCH_SECONDS_KEY = 'index_search_seconds'
+SEARCH_CURSORS_KEY = 'search_cursors'
+COMPOUND_HET_KEYS_KEY = 'compound_het_keys'
+
 class EsSearch(object):
 
     AGGREGATION_NAME = 'compound het'
     CACHED_COUNTS_KEY = 'loaded_variant_counts'
+    CACHED_RESULTS_PAGINATED = True
 
     def __init__(self, families, previous_search_results=None, return_all_queried_families=False, user=None, sort=None):
         from seqr.utils.elasticsearch.utils import get_es_client, InvalidIndexException, InvalidSearchException
         self._client = get_es_client()
 
-        self.samples_by_family_index = defaultdict(lambda: defaultdict(dict))
-        samples = Sample.objects.filter(is_active=True, individual__family__in=families, elasticsearch_index__isnull=False)
-        for s in samples.select_related('individual__family'):
-            self.samples_by_family_index[s.elasticsearch_index][s.individual.family.guid][s.sample_id] = s
+        self.samples_by_family_index = get_samples_by_family_index([family.id for family in families])
 
         if len(self.samples_by_family_index) < 1:
             raise InvalidSearchException('No es index found for families {}'.format(
@@ -58,8 +63,10 @@ class EsSearch(object):
         genome_versions = {meta['genomeVersion'] for meta in self.index_metadata.values()}
         if len(genome_versions) > 1:
             versions = defaultdict(set)
-            for s in samples.select_related('individual__family__project'):
-                versions[self.index_metadata[s.elasticsearch_index]['genomeVersion']].add(s.individual.family.project.name)
+            for index, project_name in Sample.objects.filter(
+                is_active=True, individual__family__in=families, elasticsearch_index__isnull=False,
+            ).values_list('elasticsearch_index', 'individual__family__project__name').distinct():
+                versions[self.index_metadata[index]['genomeVersion']].add(project_name)
             raise InvalidSearchException(
                 'Searching across multiple genome builds is not supported. Remove projects with differing genome builds from search: {}'.format(
                     '; '.join(['{} - {}'.format(build, ', '.join(sorted(projects))) for build, projects in versions.items()])
@@ -122,7 +129,10 @@ class EsSearch(object):
     def _set_index_metadata(self):
         self._set_index_name()
         from seqr.utils.elasticsearch.utils import get_index_metadata
-        self.index_metadata = get_index_metadata(self.index_name, self._client, include_fields=True)
+        index_name = ','.join(sorted(self._indices))
+        self.index_metadata = get_index_metadata(
+            index_name, self._client, include_fields=True,
+            fetch_alias=self.index_name if self.index_name != index_name else None)
 
     def _update_alias_metadata(self):
         additional_meta_indices = set(self.index_metadata.keys()) - set(self._indices)
@@ -626,7 +636,7 @@ class EsSearch(object):
             self.index_name, page=page, num_results=num_results_for_search, start_index=start_index
         )[0]
         response = self._execute_search(search)
-        parsed_response = self._parse_response(response)
+        parsed_response = self._parse_paginated_response(self.index_name, search, response)
         return self._process_single_search_response(
             parsed_response, page=page, num_results=num_results, deduplicate=deduplicate, **kwargs)
 
@@ -658,7 +668,7 @@ class EsSearch(object):
         if self.CACHED_COUNTS_KEY and not self.previous_search_results.get(self.CACHED_COUNTS_KEY):
             self.previous_search_results[self.CACHED_COUNTS_KEY] = {}
 
-        ms = MultiSearch()
+        index_searches = []
         for index_name in indices:
             start_index = 0
             if self.CACHED_COUNTS_KEY:
@@ -671,16 +681,63 @@ class EsSearch(object):
                     self.previous_search_results[self.CACHED_COUNTS_KEY][index_name] = {'loaded': 0, 'total': 0}
 
             searches = self._get_paginated_searches(index_name, start_index=start_index, **kwargs)
-            for search in searches:
-                ms = ms.add(search)
+            index_searches += [(index_name, search) for search in searches]
 
-        responses = self._execute_search(ms) if ms._searches else []
-        parsed_responses = [self._parse_response(response) for response in responses]
+        if ELASTICSEARCH_PARALLEL_SEARCH_WORKERS and len(index_searches) > 1:
+            parsed_responses = self._execute_parallel_searches(index_searches)
+        else:
+            ms = MultiSearch()
+            for _, search in index_searches:
+                ms = ms.add(search)
+            responses = self._execute_search(ms) if ms._searches else []
+            parsed_responses = []
+            for (index_name, search), response in zip(index_searches, responses):
+                parsed_responses.append(self._parse_paginated_response(index_name, search, response))
         return self._process_multi_search_responses(parsed_responses, **kwargs)
 
+    def _execute_parallel_searches(self, index_searches):
+        """
+        Executes each index search as its own request on a bounded thread pool, so a single slow index does not hold up
+        the others. Responses are parsed as they complete, and are returned in the same order as the searches
+        """
+        parsed_responses = [None] * len(index_searches)
+        search_seconds_by_index = defaultdict(float)
+        num_workers = min(ELASTICSEARCH_PARALLEL_SEARCH_WORKERS, len(index_searches))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = {
+                executor.submit(
+                    self._execute_timed_search, search.params(request_timeout=ELASTICSEARCH_INDEX_SEARCH_TIMEOUT),
+                ): (i, index_name, search) for i, (index_name, search) in enumerate(index_searches)
+            }
+            try:
+                for future in as_completed(futures):
+                    i, index_name, search = futures[future]
+                    response, search_seconds = future.result()
+                    search_seconds_by_index[index_name] = max(search_seconds_by_index[index_name], search_seconds)
+                    parsed_responses[i] = self._parse_paginated_response(index_name, search, response)
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                raise e
+
+        logger.info('Searched {} indices in parallel ({})'.format(len(search_seconds_by_index), ', '.join([
+            '{}: {:.3f} seconds'.format(index_name, search_seconds)
+            for index_name, search_seconds in sorted(search_seconds_by_index.items())
+        ])), self._user)
+        self.previous_search_results[INDEX_SEARCH_SECONDS_KEY] = {
+            index_name: round(search_seconds, 3) for index_name, search_seconds in search_seconds_by_index.items()
+        }
+        return parsed_responses
+
+    def _execute_timed_search(self, search):
+        start_time = time()
+        response = self._execute_search(search)
+        return response, time() - start_time
+
     def _process_multi_search_responses(self, parsed_responses, page=1, num_results=100):
         new_results = []
-        compound_het_results = self.previous_search_results.get('compound_het_results', [])
+        # Copied so the cached pending results stay aligned with their cached keys
+        compound_het_results = list(self.previous_search_results.get('compound_het_results', []))
         loaded_counts = defaultdict(lambda: defaultdict(int))
         for response_hits, response_total, is_compound_het, index_name in parsed_responses:
             if not response_hits:
@@ -715,13 +772,16 @@ class EsSearch(object):
         variant_results = self._deduplicate_results(new_results)
 
         if compound_het_results or self.previous_search_results.get('grouped_results'):
+            compound_het_keys = []
             if compound_het_results:
-                compound_het_results = self._deduplicate_compound_het_results(compound_het_results)
-                compound_het_results = _sort_compound_hets(compound_het_results)
+                compound_het_results, compound_het_keys = self._deduplicate_compound_het_results(compound_het_results)
+                compound_het_results, compound_het_keys = _sort_keyed_compound_hets(
+                    compound_het_results, compound_het_keys)
             loaded_results = sum(
                 counts['loaded'] for counts in self.previous_search_results['loaded_variant_counts'].values())
             return self._process_compound_hets(
-                compound_het_results, variant_results, num_results, all_loaded=loaded_results == total_results)
+                compound_het_results, variant_results, num_results, all_loaded=loaded_results == total_results,
+                compound_het_keys=compound_het_keys)
         else:
             end_index = num_results * page
             num_loaded = num_results * page - len(all_loaded_results)
@@ -737,21 +797,58 @@ class EsSearch(object):
 
         response_total = response.hits.total['value']
         logger.info('Total hits: {} ({} seconds)'.format(response_total, response.took / 1000.0), self._user)
-        return [self._parse_hit(hit) for hit in response], response_total, False, index_name
-
-
-    def _parse_hit(self, raw_hit):
-        hit = {k: raw_hit[k] for k in QUERY_FIELD_NAMES if k in raw_hit}
-        index_name = raw_hit.meta.index
+        return self._parse_hits(response), response_total, False, index_name
+
+
+    def _parse_hits(self, raw_hits):
+        """
+        Parses a page of hits at once. Field lookups are precompiled, and per-index state is computed once per index
+        rather than once per hit
+        """
+        index_parse_contexts = {}
+        results = []
+        for raw_hit in raw_hits:
+            index_name = raw_hit.meta.index
+            if index_name not in index_parse_contexts:
+                index_parse_contexts[index_name] = self._get_index_parse_context(index_name)
+            results.append(self._parse_hit(raw_hit, index_parse_contexts[index_name]))
+        return results
+
+    def _get_index_parse_context(self, index_name):
         index_family_samples = self.samples_by_family_index[index_name]
-        data_type = self._get_index_dataset_type(index_name)
+        samples_by_id = defaultdict(list)
+        for family_guid, family_samples in index_family_samples.items():
+            for sample_id, sample in family_samples.items():
+                samples_by_id[sample_id].append((family_guid, sample))
+
+        existing_fields = self.index_metadata[index_name]['fields']
+        return {
+            'index_family_samples': index_family_samples,
+            'samples_by_id': samples_by_id,
+            'data_type': self._get_index_dataset_type(index_name),
+            'population_field_getters': {
+                population: _get_field_getters(
+                    POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
+                    lookup_field_prefix=population,
+                    existing_fields=existing_fields,
+                    get_addl_fields=lambda field: pop_config[field] if isinstance(pop_config[field], list) else [pop_config[field]],
+                    skip_fields=[field for field, val in pop_config.items() if val is None],
+                )
+                for population, pop_config in POPULATIONS.items()
+            },
+        }
+
+    def _parse_hit(self, raw_hit, parse_context):
+        source = raw_hit.to_dict()
+        hit = {k: source[k] for k in QUERY_FIELD_NAMES if k in source}
+        data_type = parse_context['data_type']
 
-        family_guids, genotypes = self._parse_genotypes(raw_hit, hit, index_family_samples, data_type)
+        family_guids, genotypes = self._parse_genotypes(raw_hit, hit, parse_context)
 
-        result = _get_field_values(hit, CORE_FIELDS_CONFIG, format_response_key=str)
+        result = _get_field_values(hit, CORE_FIELD_GETTERS)
         result.update({
-            field_name: _get_field_values(hit, fields, lookup_field_prefix=field_name)
-            for field_name, fields in NESTED_FIELDS.items()
+            field_name: _get_field_values(hit, field_getters)
+            for field_name, field_getters in NESTED_FIELD_GETTERS.items()
         })
         if hasattr(raw_hit.meta, 'sort'):
             result['_sort'] = [_parse_es_sort(sort, self._sort[i]) for i, sort in enumerate(raw_hit.meta.sort)]
@@ -766,19 +863,13 @@ class EsSearch(object):
             self._set_sv_genotype_coords(genotypes, result)
 
         populations = {
-            population: _get_field_values(
-                hit, POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
-                lookup_field_prefix=population,
-                existing_fields=self.index_metadata[index_name]['fields'],
-                get_addl_fields=lambda field: pop_config[field] if isinstance(pop_config[field], list) else [pop_config[field]],
-                skip_fields=[field for field, val in pop_config.items() if val is None],
-            )
-            for population, pop_config in POPULATIONS.items()
+            population: _get_field_values(hit, field_getters)
+            for population, field_getters in parse_context['population_field_getters'].items()
         }
 
         sorted_transcripts = [
-            {_to_camel_case(k): v for k, v in transcript.to_dict().items()}
-            for transcript in hit[SORTED_TRANSCRIPTS_FIELD_KEY] or []
+            {_to_camel_case(k): v for k, v in transcript.items()}
+            for transcript in hit.get(SORTED_TRANSCRIPTS_FIELD_KEY) or []
         ]
         transcripts = defaultdict(list)
         for transcript in sorted_transcripts:
@@ -794,14 +885,14 @@ class EsSearch(object):
             'mainTranscriptId': main_transcript_id,
             'selectedMainTranscriptId': selected_main_transcript_id,
             'populations': populations,
-            'predictions': _get_field_values(
-                hit, PREDICTION_FIELDS_CONFIG, format_response_key=get_prediction_response_key
-            ),
+            'predictions': _get_field_values(hit, PREDICTION_FIELD_GETTERS),
             'transcripts': dict(transcripts),
         })
         return result
 
-    def _parse_genotypes(self, raw_hit, hit, index_family_samples, data_type):
+    def _parse_genotypes(self, raw_hit, hit, parse_context):
+        index_family_samples = parse_context['index_family_samples']
+        data_type = parse_context['data_type']
         if hasattr(raw_hit.meta, 'matched_queries'):
             family_guids = list(raw_hit.meta.matched_queries)
         elif self._return_all_queried_families:
@@ -826,21 +917,21 @@ class EsSearch(object):
                        for sample_id, sample in samples_by_id.items())]
 
         genotypes = {}
-        genotype_fields_config = GENOTYPE_FIELDS[data_type]
-        for family_guid in family_guids:
-            samples_by_id = index_family_samples[family_guid]
-            for genotype_hit in hit[GENOTYPES_FIELD_KEY]:
-                sample = samples_by_id.get(genotype_hit['sample_id'])
-                if sample:
+        genotype_field_getters = GENOTYPE_FIELD_GETTERS[data_type]
+        family_guid_set = set(family_guids)
+        for genotype_hit in hit[GENOTYPES_FIELD_KEY]:
+            for family_guid, sample in parse_context['samples_by_id'].get(genotype_hit['sample_id'], []):
+                if family_guid in family_guid_set:
                     genotype_hit['sample_type'] = sample.sample_type
-                    genotypes[sample.individual.guid] = _get_field_values(genotype_hit, genotype_fields_config)
+                    genotypes[sample.individual.guid] = _get_field_values(genotype_hit, genotype_field_getters)
 
-            if len(samples_by_id) != len(genotypes) and data_type == Sample.DATASET_TYPE_SV_CALLS:
-                # Family members with no variants are not included in the SV index
-                for sample_id, sample in samples_by_id.items():
+        if data_type == Sample.DATASET_TYPE_SV_CALLS:
+            # Family members with no variants are not included in the SV index
+            for family_guid in family_guids:
+                for sample_id, sample in index_family_samples[family_guid].items():
                     if sample.individual.guid not in genotypes:
                         genotypes[sample.individual.guid] = _get_field_values(
-                            {'sample_id': sample_id}, genotype_fields_config)
+                            {'sample_id': sample_id}, genotype_field_getters)
                         genotypes[sample.individual.guid]['isRef'] = True
                         genotypes[sample.individual.guid]['cn'] = \
                             1 if hit['contig'] == 'X' and sample.individual.sex == Individual.SEX_MALE else 2
@@ -949,7 +1040,7 @@ class EsSearch(object):
         return compound_het_results, total_compound_het_results
 
     def _parse_compound_het_gene(self, gene_agg, compound_het_pairs_by_gene, family_unaffected_individual_guids):
-        gene_variants = [self._parse_hit(hit) for hit in gene_agg['vars_by_gene']]
+        gene_variants = self._parse_hits(gene_agg['vars_by_gene'])
         gene_id = gene_agg['key']
 
         if gene_id in compound_het_pairs_by_gene:
@@ -1045,51 +1136,29 @@ class EsSearch(object):
         )]
 
     def _filter_invalid_family_compound_hets(self, gene_id, family_compound_het_pairs, family_unaffected_individual_guids):
+        check_secondary_consequences = bool(self._allowed_consequences and self._allowed_consequences_secondary)
         for family_guid, variants in family_compound_het_pairs.items():
             unaffected_individuals = family_unaffected_individual_guids.get(family_guid, [])
 
-            hom_alt_variant_ids = set()
+            hom_alt_indices = set()
             if self._paired_index_comp_het:
                 hom_alt_variant_ids = {
                     var['variantId'] for var in variants if any(gen.get('numAlt') == 2 for gen in var['genotypes'].values())
                 }
+                hom_alt_indices = {i for i, var in enumerate(variants) if var['variantId'] in hom_alt_variant_ids}
 
-            valid_combinations = []
-            for ch_1_index, ch_2_index in combinations(range(len(variants)), 2):
-                variant_1 = variants[ch_1_index]
-                variant_2 = variants[ch_2_index]
-
-                if hom_alt_variant_ids:
-                    # SNPs overlapped by trans deletions may be incorrectly called as hom alt, and should be
-                    # considered comp hets with said deletions. Any other hom alt variants are not valid comp hets
-                    hom_alt_var = next(
-                        (var for var in [variant_1, variant_2] if var['variantId'] in hom_alt_variant_ids), None)
-                    if hom_alt_var:
-                        pair_var = variant_1 if hom_alt_var == variant_2 else variant_2
-                        is_valid = pair_var.get('svType') == 'DEL' and pair_var['pos'] <= hom_alt_var['pos'] <= pair_var['end']
-                        if not is_valid:
-                            continue
-
-                is_valid_for_individual = True
-                for individual_guid in unaffected_individuals:
-                    genotype_1 = variant_1['genotypes'].get(individual_guid)
-                    genotype_2 = variant_2['genotypes'].get(individual_guid)
-                    if genotype_1 and genotype_2 and genotype_1.get('numAlt') != 0 and not genotype_1.get('isRef') and \
-                            genotype_2.get('numAlt') != 0 and not genotype_2.get('isRef'):
-                        is_valid_for_individual = False
-                        break
-                if not is_valid_for_individual:
-                    continue
-
-                if self._allowed_consequences and self._allowed_consequences_secondary:
-                    # Make a copy of lists to prevent blowing up memory usage
-                    consequences = [] + variant_1['gene_consequences'].get(gene_id, [])
-                    consequences += variant_2['gene_consequences'].get(gene_id, [])
-                    if all(consequence not in self._allowed_consequences for consequence in consequences) or all(
-                            consequence not in self._allowed_consequences_secondary for consequence in consequences):
-                        continue
+            allowed_mask = secondary_mask = None
+            if check_secondary_consequences:
+                allowed_mask = _get_variants_bitmask(variants, lambda variant: any(
+                    consequence in self._allowed_consequences
+                    for consequence in variant['gene_consequences'].get(gene_id, [])))
+                secondary_mask = _get_variants_bitmask(variants, lambda variant: any(
+                    consequence in self._allowed_consequences_secondary
+                    for consequence in variant['gene_consequences'].get(gene_id, [])))
 
-                valid_combinations.append([ch_1_index, ch_2_index])
+            valid_combinations = _get_valid_compound_het_indices(
+                variants, _get_unaffected_carrier_masks(variants, unaffected_individuals), hom_alt_indices,
+                allowed_mask, secondary_mask)
 
             family_compound_het_pairs[family_guid] = [
                 [variants[valid_ch_1_index], variants[valid_ch_2_index]] for
@@ -1122,43 +1191,49 @@ class EsSearch(object):
         variant['familyGuids'] = sorted(set(variant['familyGuids'] + duplicate_variant['familyGuids']))
 
     def _deduplicate_compound_het_results(self, compound_het_results):
+        """
+        Merges compound het pairs for the same variants in the same gene returned by different indices. Pairs are looked
+        up by a key for the gene and variant ids. The keys for pairs that are not returned on this page are cached with
+        them, so they are not rebuilt for the next page. Returns the deduplicated pairs and their keys
+        """
+        previous_compound_het_results = self.previous_search_results.get('compound_het_results') or []
+        cached_keys = self.previous_search_results.get(COMPOUND_HET_KEYS_KEY) or []
+        if len(cached_keys) != len(previous_compound_het_results):
+            cached_keys = []
+
         duplicates = 0
-        results = {}
-        for gene_compound_het_pair in compound_het_results:
+        results = defaultdict(list)
+        existing_pairs_by_key = {}
+        for i, gene_compound_het_pair in enumerate(compound_het_results):
             gene = next(iter(gene_compound_het_pair))
             compound_het_pair = gene_compound_het_pair[gene]
-            if gene in results:
-                variant_ids = {variant['variantId'] for variant in compound_het_pair}
-                existing_index = next(
-                    (i for i, existing in enumerate(results[gene]) if
-                     {variant['variantId'] for variant in existing} == variant_ids), None,
-                )
-                if existing_index is not None:
-                    existing_compound_het_pair = results[gene][existing_index]
-
-                    def _update_existing_variant(existing_variant, variant):
-                        existing_variant['genotypes'].update(variant['genotypes'])
-                        family_guids = set(existing_variant['familyGuids'])
-                        family_guids.update(variant['familyGuids'])
-                        existing_variant['familyGuids'] = sorted(family_guids)
-                    _update_existing_variant(existing_compound_het_pair[0], compound_het_pair[0])
-                    _update_existing_variant(existing_compound_het_pair[1], compound_het_pair[1])
-                    duplicates += 1
-                else:
-                    results[gene].append(compound_het_pair)
+            key = cached_keys[i] if i < len(cached_keys) else _compound_het_key(gene, compound_het_pair)
+            existing_compound_het_pair = existing_pairs_by_key.get(key)
+            if existing_compound_het_pair:
+                for existing_variant, variant in zip(existing_compound_het_pair, compound_het_pair):
+                    existing_variant['genotypes'].update(variant['genotypes'])
+                    family_guids = set(existing_variant['familyGuids'])
+                    family_guids.update(variant['familyGuids'])
+                    existing_variant['familyGuids'] = sorted(family_guids)
+                duplicates += 1
             else:
-                results[gene] = [compound_het_pair]
+                existing_pairs_by_key[key] = compound_het_pair
+                results[gene].append((compound_het_pair, key))
 
         deduplicated_results = []
+        deduplicated_keys = []
         for gene, compound_het_pairs in results.items():
-            deduplicated_results += [{gene: ch_pair} for ch_pair in compound_het_pairs]
+            for ch_pair, key in compound_het_pairs:
+                deduplicated_results.append({gene: ch_pair})
+                deduplicated_keys.append(key)
 
         self.previous_search_results['duplicate_doc_count'] = duplicates + self.previous_search_results.get('duplicate_doc_count', 0)
         self.previous_search_results['total_results'] -= duplicates
 
-        return deduplicated_results
+        return deduplicated_results, deduplicated_keys
 
-    def _process_compound_hets(self, compound_het_results, variant_results, num_results, all_loaded=False):
+    def _process_compound_hets(self, compound_het_results, variant_results, num_results, all_loaded=False,
+                               compound_het_keys=None):
         if not self.previous_search_results.get('grouped_results'):
             self.previous_search_results['grouped_results'] = []
 
@@ -1185,6 +1260,7 @@ class EsSearch(object):
                 break
 
         self.previous_search_results['compound_het_results'] = compound_het_results[num_compound_hets:]
+        self.previous_search_results[COMPOUND_HET_KEYS_KEY] = (compound_het_keys or [])[num_compound_hets:]
         self.previous_search_results['variant_results'] = variant_results[num_single_variants:]
         return merged_variant_results
 
@@ -1201,19 +1277,75 @@ class EsSearch(object):
                 end_index = page * num_results
                 if start_index is None:
                     start_index = end_index - num_results
-                if end_index > MAX_VARIANTS:
+                search_after = self._get_search_cursor(index_name, start_index)
+                if search_after:
+                    # Continuing from the last loaded hit does not require ES to sort every hit up to the offset, and is
+                    # not subject to the offset + size request limit
+                    search = search.extra(search_after=search_after)[:end_index - start_index]
+                elif end_index > MAX_VARIANTS:
                     # ES request size limits are limited by offset + size, which is the same as end_index
                     from seqr.utils.elasticsearch.utils import InvalidSearchException
                     raise InvalidSearchException(
                         'Unable to load more than {} variants ({} requested)'.format(MAX_VARIANTS, end_index))
-
-                search = search[start_index:end_index]
+                else:
+                    search = search[start_index:end_index]
+                    if self._can_use_search_cursor(index_name):
+                        # Later pages continue from the cursor established by this search, so only this search needs
+                        # an exact total past the ES default of 10000
+                        search = search.extra(track_total_hits=True)
                 search = search.source(QUERY_FIELD_NAMES)
                 logger.info('Loading {} records {}-{}'.format(index_name, start_index, end_index), self._user)
 
             searches.append(search)
         return searches
 
+    def _get_search_cursor(self, index_name, start_index):
+        cursor = self.previous_search_results.get(SEARCH_CURSORS_KEY, {}).get(index_name)
+        if cursor and cursor['position'] == start_index:
+            return cursor['sort']
+        return None
+
+    def _can_use_search_cursor(self, index_name):
+        """
+        Cursors are only kept for searches of a single index with a single paginated search, as only then are the sort
+        values unique
+        """
+        if index_name not in self.index_metadata:
+            return False
+        index_searches = self._index_searches.get(index_name, [self._search])
+        return len([index_search for index_search in index_searches if not index_search.aggs.to_dict()]) == 1
+
+    def _update_search_cursor(self, index_name, search, response):
+        """
+        Saves the sort values for the last loaded hit, so the next page can be loaded with search_after. The exact total
+        is saved when the cursor is established, as it is not tracked for searches continuing from the cursor
+        """
+        if search.aggs.to_dict() or not response.hits or not hasattr(response.hits[-1].meta, 'sort') or \
+                not self._can_use_search_cursor(index_name):
+            return
+
+        search_cursors = self.previous_search_results.setdefault(SEARCH_CURSORS_KEY, {})
+        if 'search_after' in search._extra:
+            start_index = search_cursors[index_name]['position']
+            total = search_cursors[index_name]['total']
+        else:
+            start_index = search._extra.get('from', 0)
+            total = response.hits.total['value']
+        search_cursors[index_name] = {
+            'position': start_index + len(response.hits), 'sort': list(response.hits[-1].meta.sort), 'total': total,
+        }
+
+    def _parse_paginated_response(self, index_name, search, response):
+        self._update_search_cursor(index_name, search, response)
+        parsed_response = self._parse_response(response)
+        if 'search_after' in search._extra:
+            response_hits, _, is_compound_het, response_index_name = parsed_response
+            parsed_response = (
+                response_hits, self.previous_search_results[SEARCH_CURSORS_KEY][index_name]['total'], is_compound_het,
+                response_index_name,
+            )
+        return parsed_response
+
     def _execute_search(self, search):
         logger.debug(json.dumps(search.to_dict(), indent=2), self._user)
         try:
@@ -1508,27 +1640,113 @@ def _or_filters(filter_qs):
     return q
 
 
+def _get_variants_bitmask(variants, include_variant):
+    mask = 0
+    for i, variant in enumerate(variants):
+        if include_variant(variant):
+            mask |= 1 << i
+    return mask
+
+
+def _get_unaffected_carrier_masks(variants, unaffected_individuals):
+    """Returns a bitmask of the variants carried by each unaffected individual"""
+    return [
+        _get_variants_bitmask(variants, lambda variant: _is_carrier_genotype(variant['genotypes'].get(individual_guid)))
+        for individual_guid in unaffected_individuals
+    ]
+
+
+def _is_carrier_genotype(genotype):
+    return bool(genotype) and genotype.get('numAlt') != 0 and not genotype.get('isRef')
+
+
+def _get_valid_compound_het_indices(variants, unaffected_carrier_masks, hom_alt_indices, allowed_mask=None,
+                                    secondary_mask=None):
+    """
+    Returns the index pairs for valid compound het pairs of the given variants, in the same order as combinations.
+    Rather than checking every pair, the valid partners for each variant are computed in bulk as a bitmask:
+    - Variants can not be paired with any variant that is also carried by an unaffected individual who carries them
+    - If consequence masks are provided, at least one variant in the pair must be in each mask
+    - Hom alt variants can only be paired with a deletion overlapping them. SNPs overlapped by trans deletions may be
+      incorrectly called as hom alt, and should be considered comp hets with said deletions
+    """
+    num_variants = len(variants)
+    all_mask = (1 << num_variants) - 1
+
+    unaffected_conflict_masks = [0] * num_variants
+    for carrier_mask in unaffected_carrier_masks:
+        remaining = carrier_mask
+        while remaining:
+            bit = remaining & -remaining
+            unaffected_conflict_masks[bit.bit_length() - 1] |= carrier_mask
+            remaining ^= bit
+
+    hom_alt_mask = 0
+    for i in hom_alt_indices:
+        hom_alt_mask |= 1 << i
+
+    valid_combinations = []
+    for i, variant in enumerate(variants):
+        # Only look at later variants, so each pair is considered once
+        partner_mask = all_mask & ~((1 << (i + 1)) - 1) & ~unaffected_conflict_masks[i]
+
+        if allowed_mask is not None:
+            if not (allowed_mask >> i) & 1:
+                partner_mask &= allowed_mask
+            if not (secondary_mask >> i) & 1:
+                partner_mask &= secondary_mask
+
+        if hom_alt_mask:
+            if i in hom_alt_indices:
+                partner_mask &= _get_variants_bitmask(
+                    variants, lambda pair_var: _is_overlapping_deletion(pair_var, variant))
+            elif variant.get('svType') == 'DEL':
+                partner_mask &= ~hom_alt_mask | _get_variants_bitmask(
+                    variants, lambda hom_alt_var: _is_overlapping_deletion(variant, hom_alt_var))
+            else:
+                partner_mask &= ~hom_alt_mask
+
+        while partner_mask:
+            bit = partner_mask & -partner_mask
+            valid_combinations.append([i, bit.bit_length() - 1])
+            partner_mask ^= bit
+
+    return valid_combinations
+
+
+def _is_overlapping_deletion(pair_var, hom_alt_var):
+    return pair_var.get('svType') == 'DEL' and pair_var['pos'] <= hom_alt_var['pos'] <= pair_var['end']
+
+
+def _compound_het_key(gene, compound_het_pair):
+    return '{}__{}'.format(gene, ','.join(sorted(variant['variantId'] for variant in compound_het_pair)))
+
+
+def _sort_keyed_compound_hets(compound_het_results, compound_het_keys):
+    sorted_indices = sorted(
+        range(len(compound_het_results)),
+        key=lambda i: next(iter(compound_het_results[i].values()))[0]['_sort'])
+    return [compound_het_results[i] for i in sorted_indices], [compound_het_keys[i] for i in sorted_indices]
+
+
 def _sort_compound_hets(grouped_variants):
     return sorted(grouped_variants, key=lambda variants: next(iter(variants.values()))[0]['_sort'])
 
 
 def _get_compound_het_page(grouped_variants, start_index, end_index):
-    skipped = 0
+    # Only the groups in the requested page are accessed, as groups outside the page may not be loaded from the cache
+    end_index = max(end_index, 1)
+    if len(grouped_variants) < end_index:
+        return None
+
     variant_results = []
-    variant_count = 0
-    for variants in grouped_variants:
+    for variants in grouped_variants[start_index:end_index]:
         curr_variant = next(iter(variants.values()))
-        if skipped < start_index:
-            skipped += 1
+        if len(curr_variant) == 1:
+            variant_results += curr_variant
         else:
-            if len(curr_variant) == 1:
-                variant_results += curr_variant
-            else:
-                variant_results.append(curr_variant)
-            variant_count += 1
-        if variant_count + skipped >= end_index:
-            return variant_results
-    return None
+            variant_results.append(curr_variant)
+    return variant_results
 
 
 def _parse_es_sort(sort, sort_config):
@@ -1541,21 +1759,41 @@ def _parse_es_sort(sort, sort_config):
     return sort
 
 
-def _get_field_values(hit, field_configs, format_response_key=_to_camel_case, get_addl_fields=None, lookup_field_prefix='', existing_fields=None, skip_fields=None):
-    return {
-        field_config.get('response_key', format_response_key(field)): _value_if_has_key(
-            hit,
-            (get_addl_fields(field) if get_addl_fields else []) +
-            ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field],
-            existing_fields=existing_fields,
-            **field_config
-        ) if field not in (skip_fields or []) else None
-        for field, field_config in field_configs.items()
-    }
-
-
-def _value_if_has_key(hit, keys, format_value=None, default_value=None, existing_fields=None, **kwargs):
-    for key in keys:
-        if key in hit:
-            return format_value(default_value if hit[key] is None else hit[key]) if format_value else hit[key]
-    return default_value if not existing_fields or any(key in existing_fields for key in keys) else None
+def _get_field_getters(field_configs, format_response_key=_to_camel_case, get_addl_fields=None, lookup_field_prefix='', existing_fields=None, skip_fields=None):
+    """Precomputes the response key, lookup keys and formatting for each field so they are not recomputed for every hit"""
+    field_getters = []
+    for field, field_config in field_configs.items():
+        response_key = field_config.get('response_key', format_response_key(field))
+        if field in (skip_fields or []):
+            field_getters.append((response_key, (), None, None, None))
+            continue
+        keys = (get_addl_fields(field) if get_addl_fields else []) + \
+               ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field]
+        default_value = field_config.get('default_value')
+        missing_value = default_value if not existing_fields or any(key in existing_fields for key in keys) else None
+        field_getters.append((response_key, tuple(keys), field_config.get('format_value'), default_value, missing_value))
+    return field_getters
+
+
+def _get_field_values(hit, field_getters):
+    values = {}
+    for response_key, keys, format_value, default_value, missing_value in field_getters:
+        value = missing_value
+        for key in keys:
+            if key in hit:
+                value = hit[key]
+                if format_value:
+                    value = format_value(default_value if value is None else value)
+                break
+        values[response_key] = value
+    return values
+
+
+CORE_FIELD_GETTERS = _get_field_getters(CORE_FIELDS_CONFIG, format_response_key=str)
+NESTED_FIELD_GETTERS = {
+    field_name: _get_field_getters(fields, lookup_field_prefix=field_name) for field_name, fields in NESTED_FIELDS.items()
+}
+PREDICTION_FIELD_GETTERS = _get_field_getters(PREDICTION_FIELDS_CONFIG, format_response_key=get_prediction_response_key)
+GENOTYPE_FIELD_GETTERS = {
+    data_type: _get_field_getters(field_configs) for data_type, field_configs in GENOTYPE_FIELDS.items()
+}
@@ -5,6 +5,7 @@ import json
 import re
 from collections import defaultdict
 from datetime import timedelta
+from fnmatch import fnmatch
 from django.test import TestCase
 from elasticsearch.exceptions import ConnectionTimeout, TransportError
 from sys import maxsize
@@ -12,8 +13,14 @@ from urllib3.exceptions import ReadTimeoutError
 
 from seqr.models import Family, Sample, VariantSearch, VariantSearchResults
 from seqr.utils.elasticsearch.utils import get_es_variants_for_variant_tuples, get_single_es_variant, get_es_variants, \
-    get_es_variant_gene_counts, get_es_variants_for_variant_ids, InvalidIndexException, InvalidSearchException
-from seqr.utils.elasticsearch.es_search import _get_family_affected_status, _liftover_grch38_to_grch37
+    get_es_variant_gene_counts, get_es_variants_for_variant_ids, InvalidIndexException, InvalidSearchException, \
+    get_es_client, get_es_client_pool_stats, get_index_metadata, invalidate_index_metadata, has_search_cursors, \
+    _get_cached_search_results, _set_cached_search_results, _load_last_cached_chunks
+from seqr.utils.elasticsearch.es_search import EsSearch, _get_family_affected_status, _liftover_grch38_to_grch37, \
+    _get_valid_compound_het_indices, _compound_het_key
+from seqr.utils.elasticsearch.search_samples import SEARCH_SAMPLES_CACHE
+from seqr.utils.gene_utils import REFERENCE_DATA_INDEX_CACHE
+from seqr.utils.redis_utils import decode_cache_value, encode_cache_value
 from seqr.views.utils.test_utils import urllib3_responses, PARSED_VARIANTS, PARSED_SV_VARIANT, PARSED_SV_WGS_VARIANT,\
     PARSED_MITO_VARIANT, TRANSCRIPT_2
 
@@ -1126,11 +1133,26 @@ RECESSIVE_INHERITANCE_QUERY = {
 ANNOTATION_QUERY = {'terms': {'transcriptConsequenceTerms': ['frameshift_variant']}}
 
 REDIS_CACHE = {}
-def _set_cache(k, v):
+def _set_cache(k, v, **kwargs):
     REDIS_CACHE[k] = v
 MOCK_REDIS = mock.MagicMock()
 MOCK_REDIS.get.side_effect = REDIS_CACHE.get
+MOCK_REDIS.mget.side_effect = lambda keys: [REDIS_CACHE.get(k) for k in keys]
 MOCK_REDIS.set.side_effect =_set_cache
+MOCK_REDIS.pipeline.return_value = MOCK_REDIS
+MOCK_REDIS.delete.side_effect = lambda *keys: [REDIS_CACHE.pop(k, None) for k in keys]
+MOCK_REDIS.keys.side_effect = lambda pattern: [k for k in REDIS_CACHE if fnmatch(k, pattern)]
+MOCK_REDIS.sadd.side_effect = lambda k, *members: REDIS_CACHE.setdefault(k, set()).update(members)
+MOCK_REDIS.smembers.side_effect = lambda k: REDIS_CACHE.get(k, set())
+
+def _get_cached_results(cache_key):
+    cached_results = decode_cache_value(REDIS_CACHE.get(cache_key))
+    for field, count in cached_results.pop('cached_result_counts').items():
+        cached_results[field] = []
+        for chunk_index in range(-(-count // 100)):
+            cached_results[field] += decode_cache_value(
+                REDIS_CACHE.get('{}__{}__{}'.format(cache_key, field, chunk_index)))
+    return cached_results
 
 def mock_hits(hits, increment_sort=False, include_matched_queries=True, sort=None, index=INDEX_NAME):
     parsed_hits = deepcopy(hits)
@@ -1263,11 +1285,19 @@ class EsUtilsTest(TestCase):
     def setUp(self):
         Sample.objects.filter(sample_id='NA19678').update(is_active=False)
         self.families = Family.objects.filter(guid__in=['F000003_3', 'F000002_2', 'F000005_5'])
+        for key in [k for k in REDIS_CACHE.keys() if k.startswith('index_metadata')]:
+            REDIS_CACHE.pop(key)
+        invalidate_index_metadata()
+        SEARCH_SAMPLES_CACHE.clear()
+        REFERENCE_DATA_INDEX_CACHE.clear()
 
     def assertExecutedSearch(self, filters=None, start_index=0, size=2, index=INDEX_NAME, **kwargs):
         executed_search = urllib3_responses.call_request_json()
         searched_indices = get_indices_from_url(urllib3_responses.calls[-1].request.url)
         self.assertListEqual(sorted(searched_indices.split(',')), sorted(index.split(',')))
+        if ',' in index:
+            # Searches of multiple indices in a single request do not have a search_after cursor
+            kwargs.setdefault('track_total_hits', False)
         self.assertSameSearch(
             executed_search,
             dict(filters=filters, start_index=start_index, size=size, **kwargs)
@@ -1293,6 +1323,9 @@ class EsUtilsTest(TestCase):
                 }
             }
 
+        if expected_search_params.get('search_after'):
+            expected_search['search_after'] = expected_search_params['search_after']
+
         if not expected_search_params.get('unsorted'):
             expected_search['sort'] = expected_search_params.get('sort') or ['xpos', 'variantId']
 
@@ -1311,6 +1344,9 @@ class EsUtilsTest(TestCase):
             del expected_search['sort']
         else:
             expected_search['_source'] = mock.ANY
+            # Exact totals are only tracked by searches which establish a search_after cursor
+            if expected_search_params.get('track_total_hits', not expected_search_params.get('search_after')):
+                expected_search['track_total_hits'] = True
 
         self.assertDictEqual(executed_search, expected_search)
 
@@ -1321,8 +1357,8 @@ class EsUtilsTest(TestCase):
 
     def assertCachedResults(self, results_model, expected_results, sort='xpos'):
         cache_key = 'search_results__{}__{}'.format(results_model.guid, sort)
-        self.assertDictEqual(json.loads(REDIS_CACHE.get(cache_key)), expected_results)
-        MOCK_REDIS.expire.assert_called_with(cache_key, timedelta(weeks=2))
+        self.assertDictEqual(_get_cached_results(cache_key), expected_results)
+        MOCK_REDIS.set.assert_any_call(cache_key, mock.ANY, ex=timedelta(weeks=2))
 
     @urllib3_responses.activate
     def test_get_es_variants_for_variant_tuples(self):
@@ -1516,7 +1552,8 @@ class EsUtilsTest(TestCase):
             cm.exception.info,
             {'type': 'search_phase_execution_exception', 'root_cause': [{'type': 'too_many_clauses'}]})
 
-        _set_cache(f'index_metadata__{INDEX_NAME},{MITO_WGS_INDEX_NAME},{SV_INDEX_NAME}', None)
+        for index in [INDEX_NAME, MITO_WGS_INDEX_NAME, SV_INDEX_NAME]:
+            invalidate_index_metadata(index)
         urllib3_responses.add(
             urllib3_responses.GET, f'/{INDEX_NAME},{MITO_WGS_INDEX_NAME},{SV_INDEX_NAME}/_mapping', body=Exception('Connection error'))
         with self.assertRaises(InvalidIndexException) as cm:
@@ -1542,22 +1579,32 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(variants[1], PARSED_VARIANTS[1])
         self.assertEqual(total_results, 5)
 
-        self.assertCachedResults(results_model, {'all_results': variants, 'total_results': 5})
-        self.assertTrue('index_metadata__{},{},{}'.format(INDEX_NAME, MITO_WGS_INDEX_NAME, SV_INDEX_NAME) in REDIS_CACHE)
+        self.assertCachedResults(results_model, {
+            'all_results': variants, 'total_results': 5,
+            'search_cursors': {INDEX_NAME: {'position': 2, 'sort': [2103343353], 'total': 5}},
+        })
+        for index in [INDEX_NAME, MITO_WGS_INDEX_NAME, SV_INDEX_NAME]:
+            self.assertTrue('index_metadata__{}'.format(index) in REDIS_CACHE)
 
         self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY])
 
         # does not save non-consecutive pages
         variants, total_results = get_es_variants(results_model, page=3, num_results=2)
         self.assertEqual(total_results, 5)
-        self.assertCachedResults(results_model, {'all_results': variants, 'total_results': 5})
+        self.assertCachedResults(results_model, {
+            'all_results': variants, 'total_results': 5,
+            'search_cursors': {INDEX_NAME: {'position': 6, 'sort': [2103343353], 'total': 5}},
+        })
         self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], start_index=4, size=2)
 
         # test pagination
         variants, total_results = get_es_variants(results_model, page=2, num_results=2)
         self.assertEqual(len(variants), 2)
         self.assertEqual(total_results, 5)
-        self.assertCachedResults(results_model, {'all_results': PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5})
+        self.assertCachedResults(results_model, {
+            'all_results': PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5,
+            'search_cursors': {INDEX_NAME: {'position': 4, 'sort': [2103343353], 'total': 5}},
+        })
         self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], start_index=2, size=2)
 
         # test does not re-fetch page
@@ -1576,7 +1623,9 @@ class EsUtilsTest(TestCase):
 
         mock_max_variants.__int__.return_value = 100
         variants, _ = get_es_variants(results_model, page=1, num_results=2, load_all=True)
-        self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], start_index=4, size=1)
+        # Remaining results are loaded from the end of the previous page
+        self.assertExecutedSearch(
+            filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], start_index=0, size=1, search_after=[2103343353])
         self.assertEqual(len(variants), 5)
         self.assertListEqual(variants, PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS[:1])
 
@@ -1587,6 +1636,52 @@ class EsUtilsTest(TestCase):
         self.assertEqual(len(variants), 5)
         self.assertListEqual(variants, PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS[:1])
 
+    @mock.patch('seqr.utils.elasticsearch.es_search.MAX_VARIANTS', 3)
+    @urllib3_responses.activate
+    def test_search_after_get_es_variants(self):
+        setup_responses()
+        search_model = VariantSearch.objects.create(search={'annotations': {'frameshift': ['frameshift_variant']}})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+
+        self.assertFalse(has_search_cursors(results_model))
+        get_es_variants(results_model, num_results=2)
+        self.assertTrue(has_search_cursors(results_model))
+        self.assertFalse(has_search_cursors(results_model, sort='cadd'))
+
+        # Exact totals are only tracked by the search establishing the cursor, so later pages use its saved total
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+        cached_results = decode_cache_value(REDIS_CACHE[cache_key])
+        cached_results['search_cursors'][INDEX_NAME]['total'] = 20000
+        _set_cache(cache_key, encode_cache_value(cached_results))
+
+        # Pages continuing from the loaded results are not limited by MAX_VARIANTS
+        variants, total_results = get_es_variants(results_model, page=2, num_results=2)
+        self.assertListEqual(variants, PARSED_VARIANTS)
+        self.assertEqual(total_results, 20000)
+        self.assertExecutedSearch(
+            filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], start_index=0, size=2, search_after=[2103343353])
+
+        with self.assertRaises(InvalidSearchException) as cm:
+            get_es_variants(results_model, page=4, num_results=2)
+        self.assertEqual(str(cm.exception), 'Unable to load more than 3 variants (8 requested)')
+
+        # Cursors are only used when every partially loaded index has one
+        _set_cache(cache_key, json.dumps({
+            'search_cursors': {INDEX_NAME: {'position': 2, 'sort': [2103343353], 'total': 5}},
+            'loaded_variant_counts': {
+                INDEX_NAME: {'loaded': 2, 'total': 5},
+                SECOND_INDEX_NAME: {'loaded': 5, 'total': 5},
+                '{}_compound_het'.format(SECOND_INDEX_NAME): {'loaded': 1, 'total': 2},
+            }}))
+        self.assertTrue(has_search_cursors(results_model))
+        _set_cache(cache_key, json.dumps({
+            'search_cursors': {INDEX_NAME: {'position': 2, 'sort': [2103343353], 'total': 5}},
+            'loaded_variant_counts': {
+                INDEX_NAME: {'loaded': 2, 'total': 5}, SECOND_INDEX_NAME: {'loaded': 2, 'total': 5},
+            }}))
+        self.assertFalse(has_search_cursors(results_model))
+
     @urllib3_responses.activate
     def test_filtered_get_es_variants(self):
         setup_responses()
@@ -2094,11 +2189,13 @@ class EsUtilsTest(TestCase):
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [],
+            'compound_het_keys': [],
             'variant_results': [PARSED_VARIANTS[1]],
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS}],
             'duplicate_doc_count': 0,
             'loaded_variant_counts': {'test_index_compound_het': {'total': 1, 'loaded': 1}, INDEX_NAME: {'loaded': 2, 'total': 5}},
             'total_results': 6,
+            'search_cursors': {INDEX_NAME: {'position': 2, 'sort': [2103343353], 'total': 5}},
         })
 
         pass_filter_query = {'bool': {'must_not': [{'exists': {'field': 'filters'}}]}}
@@ -2125,6 +2222,7 @@ class EsUtilsTest(TestCase):
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [],
+            'compound_het_keys': [],
             'variant_results': [],
             'grouped_results': [
                 {'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS},
@@ -2132,9 +2230,12 @@ class EsUtilsTest(TestCase):
             'duplicate_doc_count': 1,
             'loaded_variant_counts': {'test_index_compound_het': {'total': 1, 'loaded': 1}, INDEX_NAME: {'loaded': 4, 'total': 5}},
             'total_results': 5,
+            'search_cursors': {INDEX_NAME: {'position': 4, 'sort': [2103343353], 'total': 5}},
         })
 
-        self.assertExecutedSearches([dict(filters=[pass_filter_query, ANNOTATION_QUERY, RECESSIVE_INHERITANCE_QUERY], start_index=2, size=4)])
+        self.assertExecutedSearches([dict(
+            filters=[pass_filter_query, ANNOTATION_QUERY, RECESSIVE_INHERITANCE_QUERY], start_index=0, size=4,
+            search_after=[2103343353])])
 
         urllib3_responses.reset()
         get_es_variants(results_model, page=2, num_results=2)
@@ -2399,6 +2500,7 @@ class EsUtilsTest(TestCase):
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [],
+            'compound_het_keys': [],
             'variant_results': [PARSED_MULTI_SAMPLE_VARIANT],
             'grouped_results': [{'null': [PARSED_MULTI_SAMPLE_VARIANT_0]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS}],
             'duplicate_doc_count': 3,
@@ -2468,6 +2570,7 @@ class EsUtilsTest(TestCase):
                 ],
                 start_index=0,
                 size=2,
+                track_total_hits=False,
             ),
             dict(
                 filters=[
@@ -2483,6 +2586,7 @@ class EsUtilsTest(TestCase):
                 ],
                 start_index=0,
                 size=2,
+                track_total_hits=False,
             ),
         ])
 
@@ -2506,6 +2610,7 @@ class EsUtilsTest(TestCase):
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [{'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS_MULTI_PROJECT}],
+            'compound_het_keys': ['ENSG00000228198__1-248367227-TC-T,2-103343353-GAGA-G'],
             'variant_results': [PARSED_MULTI_INDEX_VARIANT],
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000135953': PARSED_COMPOUND_HET_VARIANTS_PROJECT_2}],
             'duplicate_doc_count': 2,
@@ -2516,6 +2621,10 @@ class EsUtilsTest(TestCase):
                 '{}_compound_het'.format(INDEX_NAME): {'total': 1, 'loaded': 1},
             },
             'total_results': 11,
+            'search_cursors': {
+                SECOND_INDEX_NAME: {'position': 1, 'sort': [2103343353], 'total': 5},
+                INDEX_NAME: {'position': 2, 'sort': [2103343353], 'total': 5},
+            },
         })
         self.assertTrue('index_metadata__{}'.format(INDEX_NAME) in REDIS_CACHE)
         self.assertTrue('index_metadata__{}'.format(SECOND_INDEX_NAME) in REDIS_CACHE)
@@ -2574,6 +2683,7 @@ class EsUtilsTest(TestCase):
 
         cache_results = {
             'compound_het_results': [],
+            'compound_het_keys': [],
             'variant_results': [PARSED_MULTI_SAMPLE_MULTI_INDEX_VARIANT],
             'grouped_results': [
                 {'null': [PARSED_VARIANTS[0]]},
@@ -2589,22 +2699,69 @@ class EsUtilsTest(TestCase):
                 '{}_compound_het'.format(INDEX_NAME): {'total': 1, 'loaded': 1},
             },
             'total_results': 9,
+            'search_cursors': {
+                SECOND_INDEX_NAME: {'position': 2, 'sort': [2103343353], 'total': 5},
+                INDEX_NAME: {'position': 4, 'sort': [2103343353], 'total': 5},
+            },
         }
         self.assertCachedResults(results_model, cache_results)
 
-        project_2_search['start_index'] = 1
+        # Subsequent pages are loaded from the end of the previous page for each index
         project_2_search['size'] = 3
-        project_1_search['start_index'] = 2
+        project_2_search['search_after'] = [2103343353]
+        project_1_search['search_after'] = [2103343353]
         self.assertExecutedSearches([project_2_search, project_1_search])
 
         # If one project is fully loaded, only query the second project
         cache_results['loaded_variant_counts'][INDEX_NAME]['total'] = 4
         _set_cache('search_results__{}__xpos'.format(results_model.guid), json.dumps(cache_results))
         get_es_variants(results_model, num_results=2, page=3)
-        project_2_search['start_index'] = 2
         project_2_search['size'] = 4
         self.assertExecutedSearches([project_2_search])
 
+    @urllib3_responses.activate
+    def test_parallel_multi_project_get_es_variants(self):
+        setup_responses()
+        search_model = VariantSearch.objects.create(search={
+            'annotations': {'frameshift': ['frameshift_variant']},
+            'qualityFilter': {'min_gq': 10},
+            'inheritance': {'mode': 'recessive'},
+        })
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(Family.objects.filter(guid__in=['F000011_11', 'F000003_3', 'F000002_2']))
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+
+        multi_search_variants, total_results = get_es_variants(results_model, num_results=2)
+        self.assertEqual(total_results, 11)
+        multi_search_cached_results = _get_cached_results(cache_key)
+        REDIS_CACHE.pop(cache_key)
+        num_calls = len(urllib3_responses.calls)
+
+        # Each index search is executed as a separate request, and results match the multi-search results
+        with mock.patch('seqr.utils.elasticsearch.es_search.ELASTICSEARCH_PARALLEL_SEARCH_WORKERS', 2):
+            variants, total_results = get_es_variants(results_model, num_results=2)
+        self.assertListEqual(variants, multi_search_variants)
+        self.assertEqual(total_results, 11)
+        self.assertListEqual(sorted([call.request.url for call in urllib3_responses.calls[num_calls:]]), [
+            '/{}/_search'.format(INDEX_NAME), '/{}/_search'.format(INDEX_NAME),
+            '/{}/_search'.format(SECOND_INDEX_NAME), '/{}/_search'.format(SECOND_INDEX_NAME),
+        ])
+        cached_results = _get_cached_results(cache_key)
+        self.assertSetEqual(set(cached_results.pop('index_search_seconds').keys()), {INDEX_NAME, SECOND_INDEX_NAME})
+        self.assertDictEqual(cached_results, multi_search_cached_results)
+
+        # A timeout for a single index fails the search
+        REDIS_CACHE.pop(cache_key)
+        urllib3_responses.reset()
+        urllib3_responses.add(
+            urllib3_responses.POST, '/{}/_search'.format(SECOND_INDEX_NAME), body=ReadTimeoutError('', '', 'timeout'))
+        urllib3_responses.add_json('/_tasks?actions=*search&group_by=parents', {'tasks': {}})
+        setup_responses()
+        with mock.patch('seqr.utils.elasticsearch.es_search.ELASTICSEARCH_PARALLEL_SEARCH_WORKERS', 2):
+            with self.assertRaises(ConnectionTimeout):
+                get_es_variants(results_model, num_results=2)
+        self.assertIsNone(REDIS_CACHE.get(cache_key))
+
     @urllib3_responses.activate
     def test_multi_project_all_samples_all_inheritance_get_es_variants(self):
         setup_responses()
@@ -2802,7 +2959,7 @@ class EsUtilsTest(TestCase):
 
         get_es_variants(results_model, num_results=2)
 
-        self.assertExecutedSearch(index=INDEX_ALIAS, size=8)
+        self.assertExecutedSearch(index=INDEX_ALIAS, size=8, track_total_hits=False)
         self.assertDictEqual(urllib3_responses.call_request_json(index=0), {
             'actions': [{'add': {'indices': [INDEX_NAME, MITO_WGS_INDEX_NAME, SECOND_INDEX_NAME, SV_INDEX_NAME], 'alias': INDEX_ALIAS}}]})
 
@@ -2836,7 +2993,22 @@ class EsUtilsTest(TestCase):
             dict(index=SUB_INDICES[1], **expected_search),
             dict(index=SUB_INDICES[0], **expected_search),
         ])
-        _set_cache('index_metadata__{}'.format(SECOND_INDEX_NAME), None)
+        # The alias is cached with the indices it resolves to
+        self.assertSetEqual(
+            set(decode_cache_value(REDIS_CACHE['index_metadata__{}'.format(SECOND_INDEX_NAME)]).keys()),
+            set(SUB_INDICES))
+        for index in SUB_INDICES:
+            self.assertSetEqual(REDIS_CACHE['index_metadata_aliases__{}'.format(index)], {SECOND_INDEX_NAME})
+
+        # Cached alias metadata is used without refetching the mapping
+        num_calls = len(urllib3_responses.calls)
+        metadata = get_index_metadata(SECOND_INDEX_NAME, get_es_client(), include_fields=True)
+        self.assertSetEqual(set(metadata.keys()), set(SUB_INDICES))
+        self.assertEqual(len(urllib3_responses.calls), num_calls)
+
+        # Invalidating an index in the alias removes the cached alias metadata
+        invalidate_index_metadata(SUB_INDICES[0])
+        self.assertFalse('index_metadata__{}'.format(SECOND_INDEX_NAME) in REDIS_CACHE)
 
     @urllib3_responses.activate
     def test_get_es_variants_search_multiple_index_alias(self):
@@ -2885,7 +3057,8 @@ class EsUtilsTest(TestCase):
             dict(index=SUB_INDICES[1], **first_alias_expected_search),
             dict(index=SUB_INDICES[0], **first_alias_expected_search),
         ])
-        _set_cache('index_metadata__{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME), None)
+        self.assertFalse('index_metadata__{}'.format(INDEX_NAME) in REDIS_CACHE)
+        self.assertFalse('index_metadata__{}'.format(SECOND_INDEX_NAME) in REDIS_CACHE)
 
     @urllib3_responses.activate
     def test_get_es_variant_gene_counts(self):
@@ -3084,6 +3257,186 @@ class EsUtilsTest(TestCase):
             'ENSG00000228198': {'total': 2, 'families': {'F000003_3': 2, 'F000011_11': 2}}
         })
 
+    def test_paged_search_results_cache(self):
+        search_model = VariantSearch.objects.create(search={})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+        cached_variants = [dict(PARSED_VARIANTS[0], variantId=str(i)) for i in range(250)]
+        _set_cached_search_results(cache_key, {'all_results': cached_variants, 'total_results': 300}, {})
+        self.assertSetEqual(
+            {key for key in REDIS_CACHE.keys() if key.startswith(cache_key)},
+            {cache_key, *['{}__all_results__{}'.format(cache_key, i) for i in range(3)]},
+        )
+
+        # Only the chunk containing the requested page is loaded
+        MOCK_REDIS.mget.reset_mock()
+        variants, total_results = get_es_variants(results_model, page=3, num_results=50)
+        self.assertListEqual(variants, cached_variants[100:150])
+        self.assertEqual(total_results, 300)
+        MOCK_REDIS.mget.assert_called_once_with(['{}__all_results__1'.format(cache_key)])
+
+        MOCK_REDIS.mget.reset_mock()
+        variants, _ = get_es_variants(results_model, page=2, num_results=80)
+        self.assertListEqual(variants, cached_variants[80:160])
+        MOCK_REDIS.mget.assert_called_once_with(
+            ['{}__all_results__0'.format(cache_key), '{}__all_results__1'.format(cache_key)])
+
+        # Appending results only writes the chunks which changed
+        MOCK_REDIS.set.reset_mock()
+        new_variants = [dict(PARSED_VARIANTS[1], variantId=str(i)) for i in range(250, 300)]
+        _set_cached_search_results(
+            cache_key, {'all_results': cached_variants + new_variants, 'total_results': 300}, {'all_results': 250})
+        self.assertListEqual([call.args[0] for call in MOCK_REDIS.set.call_args_list], [
+            cache_key, '{}__all_results__2'.format(cache_key)])
+        self.assertListEqual(
+            decode_cache_value(REDIS_CACHE['{}__all_results__2'.format(cache_key)]), cached_variants[200:] + new_variants)
+
+        variants, _ = get_es_variants(results_model, page=6, num_results=50)
+        self.assertListEqual(variants, new_variants)
+
+        # If a chunk is missing the cached results are ignored
+        _set_cache('{}__all_results__0'.format(cache_key), None)
+        self.assertTupleEqual(_get_cached_search_results(cache_key), ({}, {}))
+        results, counts = _get_cached_search_results(cache_key, start_index=100, end_index=200)
+        self.assertDictEqual(counts, {'all_results': 300})
+        self.assertListEqual(results['all_results'][100:200], cached_variants[100:200])
+
+        # Loading a page past the cached results only loads the last partially filled chunk
+        class _AppendingSearch(object):
+            CACHED_RESULTS_PAGINATED = True
+            process_previous_results = EsSearch.process_previous_results
+
+            def __init__(self, families, previous_search_results=None, **kwargs):
+                self.previous_search_results = previous_search_results
+
+            def filter_variants(self, **kwargs):
+                pass
+
+            def search(self, page=1, num_results=100):
+                self.previous_search_results['all_results'] = self.previous_search_results['all_results'] + new_variants
+                return new_variants[-num_results:]
+
+        new_variants = [dict(PARSED_VARIANTS[1], variantId=str(i)) for i in range(250, 400)]
+        _set_cached_search_results(cache_key, {'all_results': cached_variants, 'total_results': 400}, {})
+        MOCK_REDIS.mget.reset_mock()
+        MOCK_REDIS.set.reset_mock()
+        variants, _ = get_es_variants(results_model, es_search_cls=_AppendingSearch, page=4, num_results=100)
+        self.assertListEqual(variants, new_variants[50:])
+        MOCK_REDIS.mget.assert_called_once_with(['{}__all_results__2'.format(cache_key)])
+        self.assertListEqual([call.args[0] for call in MOCK_REDIS.set.call_args_list], [
+            cache_key, '{}__all_results__2'.format(cache_key), '{}__all_results__3'.format(cache_key)])
+        self.assertListEqual(
+            decode_cache_value(REDIS_CACHE['{}__all_results__2'.format(cache_key)]), cached_variants[200:] + new_variants[:50])
+        self.assertListEqual(decode_cache_value(REDIS_CACHE['{}__all_results__3'.format(cache_key)]), new_variants[50:])
+        self.assertListEqual(decode_cache_value(REDIS_CACHE['{}__all_results__0'.format(cache_key)]), cached_variants[:100])
+
+        # If the last chunk is missing the cached results are ignored
+        results, counts = _get_cached_search_results(cache_key, start_index=0, end_index=100)
+        results['all_results'] = results['all_results'][:250]
+        _set_cache('{}__all_results__2'.format(cache_key), None)
+        self.assertFalse(_load_last_cached_chunks(cache_key, results, {'all_results': 250}))
+
+    @urllib3_responses.activate
+    def test_get_index_metadata(self):
+        setup_responses()
+        client = get_es_client()
+
+        metadata = get_index_metadata(INDEX_NAME, client, include_fields=True)
+        self.assertSetEqual(set(metadata.keys()), {INDEX_NAME})
+        self.assertEqual(metadata[INDEX_NAME]['genomeVersion'], '37')
+        self.assertEqual(len(urllib3_responses.calls), 1)
+        self.assertTrue('index_metadata__{}'.format(INDEX_NAME) in REDIS_CACHE)
+
+        # Only indices without cached metadata are fetched
+        metadata = get_index_metadata('{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME), client, include_fields=True)
+        self.assertSetEqual(set(metadata.keys()), {INDEX_NAME, SECOND_INDEX_NAME})
+        self.assertEqual(len(urllib3_responses.calls), 2)
+        self.assertEqual(get_indices_from_url(urllib3_responses.calls[-1].request.url), SECOND_INDEX_NAME)
+
+        # Metadata is loaded from the in-process cache without a redis lookup
+        MOCK_REDIS.mget.reset_mock()
+        metadata = get_index_metadata('{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME), client, include_fields=True)
+        self.assertSetEqual(set(metadata.keys()), {INDEX_NAME, SECOND_INDEX_NAME})
+        MOCK_REDIS.mget.assert_not_called()
+        self.assertEqual(len(urllib3_responses.calls), 2)
+
+        # Metadata missing from the in-process cache is loaded from redis in a single lookup
+        invalidate_index_metadata()
+        metadata = get_index_metadata('{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME), client, include_fields=True)
+        self.assertSetEqual(set(metadata.keys()), {INDEX_NAME, SECOND_INDEX_NAME})
+        MOCK_REDIS.mget.assert_called_once_with(
+            ['index_metadata__{}'.format(INDEX_NAME), 'index_metadata__{}'.format(SECOND_INDEX_NAME)])
+        self.assertEqual(len(urllib3_responses.calls), 2)
+
+        # Invalidated indices are refetched
+        invalidate_index_metadata(INDEX_NAME)
+        self.assertFalse('index_metadata__{}'.format(INDEX_NAME) in REDIS_CACHE)
+        get_index_metadata('{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME), client, include_fields=True)
+        self.assertEqual(len(urllib3_responses.calls), 3)
+        self.assertEqual(get_indices_from_url(urllib3_responses.calls[-1].request.url), INDEX_NAME)
+
+        # Indices invalidated in another process are refetched, even if they are cached in this process
+        MOCK_REDIS.delete('index_metadata__{}'.format(INDEX_NAME))
+        _set_cache('index_metadata_version', json.dumps(12345))
+        get_index_metadata('{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME), client, include_fields=True)
+        self.assertEqual(len(urllib3_responses.calls), 4)
+        self.assertEqual(get_indices_from_url(urllib3_responses.calls[-1].request.url), INDEX_NAME)
+
+        # Invalidating an index removes cached metadata for any alias which includes it
+        alias_metadata = get_index_metadata(SECOND_INDEX_NAME, client, include_fields=True)
+        _set_cache('index_metadata__test_alias', encode_cache_value(dict(alias_metadata, **metadata)))
+        _set_cache('index_metadata__other_alias', encode_cache_value(alias_metadata))
+        MOCK_REDIS.sadd('index_metadata_aliases__{}'.format(INDEX_NAME), 'test_alias')
+        MOCK_REDIS.keys.reset_mock()
+        invalidate_index_metadata(INDEX_NAME)
+        MOCK_REDIS.keys.assert_not_called()
+        self.assertFalse('index_metadata__test_alias' in REDIS_CACHE)
+        self.assertFalse('index_metadata_aliases__{}'.format(INDEX_NAME) in REDIS_CACHE)
+        self.assertTrue('index_metadata__other_alias' in REDIS_CACHE)
+        self.assertTrue('index_metadata__{}'.format(SECOND_INDEX_NAME) in REDIS_CACHE)
+        self.assertNotEqual(json.loads(REDIS_CACHE['index_metadata_version']), 12345)
+
+        # Metadata without fields is not cached
+        get_index_metadata(HG38_INDEX_NAME, client, use_cache=False)
+        self.assertEqual(len(urllib3_responses.calls), 5)
+        self.assertFalse('index_metadata__{}'.format(HG38_INDEX_NAME) in REDIS_CACHE)
+
+    @mock.patch('seqr.utils.elasticsearch.utils.ELASTICSEARCH_SNIFF_INTERVAL', 60)
+    @mock.patch('seqr.utils.elasticsearch.utils.ELASTICSEARCH_CLIENT_MAX_AGE', 100)
+    @mock.patch('seqr.utils.elasticsearch.utils.ES_CLIENTS', {})
+    @mock.patch('seqr.utils.elasticsearch.utils.monotonic')
+    def test_get_es_client(self, mock_time):
+        mock_time.return_value = 1000
+        client = get_es_client()
+        self.assertIs(get_es_client(), client)
+        self.assertIs(get_es_client(timeout=300), client)
+        self.assertEqual(client.transport.sniffer_timeout, 60)
+        self.assertTrue(client.transport.sniff_on_connection_fail)
+
+        # Clients with different options use separate connection pools
+        ping_client = get_es_client(timeout=3, max_retries=0)
+        self.assertIsNot(ping_client, client)
+        self.assertIs(get_es_client(timeout=3, max_retries=0), ping_client)
+        self.assertEqual(ping_client.transport.max_retries, 0)
+
+        self.assertListEqual(get_es_client_pool_stats(), [
+            {'timeout': 300, 'options': {}, 'ageSeconds': 0, 'nodes': 1, 'maxConnections': 10, 'openedConnections': 0,
+             'idleConnections': 0, 'requests': 0},
+            {'timeout': 3, 'options': {'max_retries': 0}, 'ageSeconds': 0, 'nodes': 1, 'maxConnections': 10,
+             'openedConnections': 0, 'idleConnections': 0, 'requests': 0},
+        ])
+
+        # Clients are recreated once they reach the max age
+        mock_time.return_value = 1050
+        self.assertIs(get_es_client(), client)
+        mock_time.return_value = 1101
+        with mock.patch.object(client.transport, 'close') as mock_close:
+            new_client = get_es_client()
+        self.assertIsNot(new_client, client)
+        self.assertEqual(get_es_client_pool_stats()[0]['ageSeconds'], 0)
+        # The expired client is left open for searches which are still using it
+        mock_close.assert_not_called()
+
     def test_get_family_affected_status(self):
         samples_by_id = {
             sample_id: Sample.objects.get(sample_id=sample_id, dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS)
@@ -3103,6 +3456,80 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(custom_affected_status, {
             'I000004_hg00731': 'A', 'I000005_hg00732': 'A', 'I000006_hg00733': 'N'})
 
+    def test_get_valid_compound_het_indices(self):
+        variants = [
+            {'pos': 100},
+            {'pos': 200},
+            {'pos': 150, 'end': 300, 'svType': 'DEL'},
+            {'pos': 400},
+        ]
+        # Unaffected individuals carrying both variants invalidate the pair
+        self.assertListEqual(
+            _get_valid_compound_het_indices(variants, [0b0011, 0b1100], set()),
+            [[0, 2], [0, 3], [1, 2], [1, 3]])
+        self.assertListEqual(
+            _get_valid_compound_het_indices(variants, [0b1011], set()), [[0, 2], [1, 2], [2, 3]])
+
+        # Each pair must have at least one variant with an allowed and a secondary consequence
+        self.assertListEqual(
+            _get_valid_compound_het_indices(variants, [], set(), allowed_mask=0b0011, secondary_mask=0b1001),
+            [[0, 1], [0, 2], [0, 3], [1, 3]])
+
+        # Hom alt variants are only valid with an overlapping deletion
+        self.assertListEqual(_get_valid_compound_het_indices(variants, [], {1}), [[0, 2], [0, 3], [1, 2], [2, 3]])
+        self.assertListEqual(_get_valid_compound_het_indices(variants, [], {0, 3}), [[1, 2]])
+
+    @urllib3_responses.activate
+    def test_deduplicate_compound_het_results(self):
+        setup_responses()
+        def _pair(variant_ids, family_guid):
+            return [
+                {'variantId': variant_id, 'genotypes': {family_guid: {}}, 'familyGuids': [family_guid]}
+                for variant_id in variant_ids
+            ]
+
+        pending_pair = {'gene_1': _pair(['1-1-A-T', '1-5-A-T'], 'F1')}
+        es_search = EsSearch(self.families, previous_search_results={
+            'compound_het_results': [pending_pair], 'compound_het_keys': ['gene_1__1-1-A-T,1-5-A-T'],
+            'total_results': 4,
+        })
+        results, keys = es_search._deduplicate_compound_het_results([
+            pending_pair,
+            {'gene_2': _pair(['1-1-A-T', '1-5-A-T'], 'F2')},
+            {'gene_1': _pair(['1-1-A-T', '1-5-A-T'], 'F3')},
+            {'gene_1': _pair(['1-1-A-T', '1-9-A-T'], 'F3')},
+        ])
+        self.assertListEqual(keys, ['gene_1__1-1-A-T,1-5-A-T', 'gene_1__1-1-A-T,1-9-A-T', 'gene_2__1-1-A-T,1-5-A-T'])
+        self.assertListEqual([next(iter(result)) for result in results], ['gene_1', 'gene_1', 'gene_2'])
+        self.assertListEqual(results[0]['gene_1'][1]['familyGuids'], ['F1', 'F3'])
+        self.assertDictEqual(results[0]['gene_1'][1]['genotypes'], {'F1': {}, 'F3': {}})
+        self.assertEqual(es_search.previous_search_results['duplicate_doc_count'], 1)
+        self.assertEqual(es_search.previous_search_results['total_results'], 3)
+
+        # Cached keys are used for pending results
+        es_search.previous_search_results['compound_het_keys'] = ['cached_key']
+        _, keys = es_search._deduplicate_compound_het_results([pending_pair])
+        self.assertListEqual(keys, ['cached_key'])
+
+        # Cached keys are used when new results are loaded for the next page
+        def _sorted_pair(variant_ids, family_guid, sort):
+            return [dict(variant, _sort=[sort]) for variant in _pair(variant_ids, family_guid)]
+
+        es_search = EsSearch(self.families, previous_search_results={
+            'compound_het_results': [{'gene_1': _sorted_pair(['1-1-A-T', '1-5-A-T'], 'F1', 1)}],
+            'compound_het_keys': ['cached_key'], 'loaded_variant_counts': {'test_index': {'total': 5, 'loaded': 0}},
+            'total_results': 6,
+        })
+        new_pair = {'gene_2': _sorted_pair(['1-2-A-T', '1-6-A-T'], 'F2', 2)}
+        with mock.patch('seqr.utils.elasticsearch.es_search._compound_het_key', wraps=_compound_het_key) as mock_key:
+            results = es_search._process_multi_search_responses(
+                [([new_pair], 1, True, 'test_index'), ([{'variantId': '1-3-A-T', '_sort': [3]}], 5, False, 'test_index')],
+                num_results=1)
+        mock_key.assert_called_once_with('gene_2', new_pair['gene_2'])
+        self.assertListEqual([variant['variantId'] for variant in results[0]], ['1-1-A-T', '1-5-A-T'])
+        self.assertListEqual(es_search.previous_search_results['compound_het_results'], [new_pair])
+        self.assertListEqual(es_search.previous_search_results['compound_het_keys'], ['gene_2__1-2-A-T,1-6-A-T'])
+
     @urllib3_responses.activate
     def test_sort(self):
         setup_responses()
@@ -0,0 +1,139 @@
+from collections import defaultdict
+from time import time
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from seqr.models import Individual, Sample
+from seqr.utils.cache_utils import LocalCache, batch_on_commit
+from seqr.utils.redis_utils import safe_redis_get_json_bulk, safe_redis_set_json, safe_redis_set_json_bulk
+
+# Compact sample rows are cached by family. Entries are tagged with a global version and a version for their family,
+# both shared in redis, so updating samples or individuals in any process invalidates the entries cached in every process
+SEARCH_SAMPLES_CACHE = LocalCache(max_size=100000, ttl=3600)
+SEARCH_SAMPLES_VERSION_KEY = 'search_samples_version'
+
+# Individual fields included in the cached rows
+SEARCH_INDIVIDUAL_FIELDS = ['family_id', 'affected', 'sex']
+
+SAMPLE_ROW_FIELDS = [
+    'individual__family_id', 'individual__family__guid', 'elasticsearch_index', 'sample_id', 'sample_type',
+    'individual__guid', 'individual__affected', 'individual__sex',
+]
+
+
+class SearchIndividual(object):
+    __slots__ = ('guid', 'affected', 'sex')
+
+    def __init__(self, guid, affected, sex):
+        self.guid = guid
+        self.affected = affected
+        self.sex = sex
+
+
+class SearchSample(object):
+    """Lightweight stand in for the Sample fields used to build and parse searches"""
+    __slots__ = ('sample_id', 'sample_type', 'individual')
+
+    def __init__(self, sample_id, sample_type, individual):
+        self.sample_id = sample_id
+        self.sample_type = sample_type
+        self.individual = individual
+
+
+def _family_version_key(family_id):
+    return '{}__{}'.format(SEARCH_SAMPLES_VERSION_KEY, family_id)
+
+
+def get_samples_by_family_index(family_ids):
+    """Returns active samples for the given families as {index: {family_guid: {sample_id: SearchSample}}}"""
+    cached_versions = safe_redis_get_json_bulk(
+        [SEARCH_SAMPLES_VERSION_KEY] + [_family_version_key(family_id) for family_id in family_ids])
+    versions = {
+        family_id: (cached_versions[SEARCH_SAMPLES_VERSION_KEY], cached_versions[_family_version_key(family_id)])
+        for family_id in family_ids
+    }
+    rows_by_family = {}
+    for family_id, (cached_version, rows) in SEARCH_SAMPLES_CACHE.get_many(family_ids).items():
+        if cached_version == versions[family_id]:
+            rows_by_family[family_id] = rows
+
+    uncached_family_ids = [family_id for family_id in family_ids if family_id not in rows_by_family]
+    if uncached_family_ids:
+        fetched_rows = {family_id: [] for family_id in uncached_family_ids}
+        for row in Sample.objects.filter(
+            is_active=True, individual__family_id__in=uncached_family_ids, elasticsearch_index__isnull=False,
+        ).values_list(*SAMPLE_ROW_FIELDS):
+            fetched_rows[row[0]].append(row[1:])
+        for family_id, rows in fetched_rows.items():
+            SEARCH_SAMPLES_CACHE.set(family_id, (versions[family_id], rows))
+        rows_by_family.update(fetched_rows)
+
+    samples_by_family_index = defaultdict(lambda: defaultdict(dict))
+    individuals = {}
+    for rows in rows_by_family.values():
+        for family_guid, index, sample_id, sample_type, individual_guid, affected, sex in rows:
+            if individual_guid not in individuals:
+                individuals[individual_guid] = SearchIndividual(individual_guid, affected, sex)
+            samples_by_family_index[index][family_guid][sample_id] = SearchSample(
+                sample_id, sample_type, individuals[individual_guid])
+    return samples_by_family_index
+
+
+def invalidate_search_samples(family_ids=None):
+    """Invalidates the cached samples for the given families, or for all families if none are given"""
+    if family_ids is None:
+        SEARCH_SAMPLES_CACHE.clear()
+        safe_redis_set_json(SEARCH_SAMPLES_VERSION_KEY, time())
+        return
+
+    for family_id in family_ids:
+        SEARCH_SAMPLES_CACHE.delete(family_id)
+    version = time()
+    safe_redis_set_json_bulk({_family_version_key(family_id): version for family_id in sorted(family_ids)})
+
+
+def _invalidate_family_search_samples_batch(family_ids):
+    invalidate_search_samples(family_ids)
+
+
+def _invalidate_individual_search_samples_batch(individual_ids):
+    # Individuals deleted along with their samples invalidate their own families when they are deleted
+    invalidate_search_samples(set(
+        Individual.objects.filter(id__in=individual_ids).values_list('family_id', flat=True)))
+
+
+def _get_search_individual_values(instance):
+    # Deferred fields are not loaded, as they are missing from the instance dict
+    return tuple(instance.__dict__.get(field) for field in SEARCH_INDIVIDUAL_FIELDS)
+
+
+@receiver(post_init, sender=Individual)
+def _set_initial_search_individual_values(sender, instance, **kwargs):
+    instance._search_individual_values = _get_search_individual_values(instance)
+
+
+@receiver(post_save, sender=Individual)
+def _invalidate_updated_individual_search_samples(sender, instance, created=False, raw=False, **kwargs):
+    # Newly created individuals have no samples yet, and only edits to the family, affected status or sex change the
+    # cached rows. Sample loading updates samples in bulk and invalidates the rows directly
+    if raw or created:
+        return
+    initial_values = instance._search_individual_values
+    values = _get_search_individual_values(instance)
+    instance._search_individual_values = values
+    if values == initial_values:
+        return
+    batch_on_commit(_invalidate_family_search_samples_batch, {
+        family_id for family_id in [initial_values[0], values[0]] if family_id is not None
+    })
+
+
+@receiver(post_delete, sender=Individual)
+def _invalidate_deleted_individual_search_samples(sender, instance, **kwargs):
+    # Includes deletions cascaded from deleted families
+    batch_on_commit(_invalidate_family_search_samples_batch, [instance.family_id])
+
+
+@receiver(post_delete, sender=Sample)
+def _invalidate_deleted_sample_search_samples(sender, instance, **kwargs):
+    batch_on_commit(_invalidate_individual_search_samples_batch, [instance.individual_id])
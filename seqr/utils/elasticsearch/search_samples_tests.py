@@ -0,0 +1,161 @@
+import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from seqr.models import Individual, Sample
+from seqr.utils.elasticsearch.search_samples import get_samples_by_family_index, invalidate_search_samples, \
+    SEARCH_SAMPLES_CACHE
+from seqr.views.utils.dataset_utils import update_variant_samples
+
+REDIS_CACHE = {}
+MOCK_REDIS = mock.MagicMock()
+MOCK_REDIS.get.side_effect = REDIS_CACHE.get
+MOCK_REDIS.mget.side_effect = lambda keys: [REDIS_CACHE.get(k) for k in keys]
+MOCK_REDIS.set.side_effect = lambda key, value: REDIS_CACHE.update({key: value})
+MOCK_REDIS.pipeline.return_value = MOCK_REDIS
+
+
+@mock.patch('seqr.utils.redis_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
+class SearchSamplesTest(TestCase):
+    databases = '__all__'
+    fixtures = ['users', '1kg_project']
+
+    def setUp(self):
+        REDIS_CACHE.clear()
+        SEARCH_SAMPLES_CACHE.clear()
+
+    def _get_samples_summary(self, family_ids):
+        return {
+            index: {
+                family_guid: {
+                    sample_id: (sample.sample_type, sample.individual.guid, sample.individual.affected, sample.individual.sex)
+                    for sample_id, sample in samples_by_id.items()
+                } for family_guid, samples_by_id in family_samples.items()
+            } for index, family_samples in get_samples_by_family_index(family_ids).items()
+        }
+
+    def test_get_samples_by_family_index(self):
+        expected_samples = {
+            'test_index': {
+                'F000001_1': {'NA19675': ('WES', 'I000001_na19675', 'A', 'M')},
+                'F000002_2': {
+                    'HG00731': ('WES', 'I000004_hg00731', 'A', 'F'),
+                    'HG00732': ('WES', 'I000005_hg00732', 'N', 'M'),
+                    'HG00733': ('WES', 'I000006_hg00733', 'N', 'F'),
+                },
+            },
+            'test_index_old': {'F000001_1': {'NA19678': ('WES', 'I000002_na19678', 'N', 'M')}},
+            'test_index_sv': {'F000002_2': {
+                'HG00731': ('WES', 'I000004_hg00731', 'A', 'F'),
+                'HG00732': ('WES', 'I000005_hg00732', 'N', 'M'),
+                'HG00733': ('WES', 'I000006_hg00733', 'N', 'F'),
+            }},
+            'test_index_mito_wgs': {'F000002_2': {'HG00733': ('WGS', 'I000006_hg00733', 'N', 'F')}},
+        }
+        with self.assertNumQueries(1, using='default'):
+            self.assertDictEqual(self._get_samples_summary([1, 2]), expected_samples)
+
+        # Individuals are shared between their samples
+        samples_by_family_index = get_samples_by_family_index([2])
+        self.assertIs(
+            samples_by_family_index['test_index']['F000002_2']['HG00731'].individual,
+            samples_by_family_index['test_index_sv']['F000002_2']['HG00731'].individual,
+        )
+
+        # Cached families are not refetched
+        with self.assertNumQueries(0, using='default'):
+            self.assertDictEqual(self._get_samples_summary([1, 2]), expected_samples)
+        with self.assertNumQueries(1, using='default'):
+            samples_by_family_index = get_samples_by_family_index([1, 2, 3])
+        self.assertSetEqual(set(samples_by_family_index['test_index'].keys()), {'F000001_1', 'F000002_2', 'F000003_3'})
+
+        # Updating samples invalidates the cache
+        Sample.objects.filter(sample_id='NA19678').update(is_active=False)
+        with self.assertNumQueries(0, using='default'):
+            self.assertDictEqual(self._get_samples_summary([1, 2]), expected_samples)
+
+        invalidate_search_samples()
+        self.assertTrue('search_samples_version' in REDIS_CACHE)
+        del expected_samples['test_index_old']
+        with self.assertNumQueries(1, using='default'):
+            self.assertDictEqual(self._get_samples_summary([1, 2]), expected_samples)
+
+        # Cached entries from before the shared version changed are refetched
+        REDIS_CACHE['search_samples_version'] = '1.0'
+        with self.assertNumQueries(1, using='default'):
+            self.assertDictEqual(self._get_samples_summary([1, 2]), expected_samples)
+
+        # Invalidating a family only refetches that family
+        invalidate_search_samples([1])
+        self.assertTrue('search_samples_version__1' in REDIS_CACHE)
+        with self.assertNumQueries(1, using='default'):
+            self.assertDictEqual(self._get_samples_summary([1, 2]), expected_samples)
+        with self.assertNumQueries(0, using='default'):
+            self.assertDictEqual(self._get_samples_summary([1, 2]), expected_samples)
+
+        # Families invalidated in another process are refetched
+        REDIS_CACHE['search_samples_version__2'] = '1.0'
+        with self.assertNumQueries(1, using='default'):
+            self.assertDictEqual(self._get_samples_summary([1, 2]), expected_samples)
+
+    def test_update_variant_samples_invalidation(self):
+        self.assertEqual(len(get_samples_by_family_index([1])['test_index']), 1)
+        samples = Sample.objects.filter(sample_id='NA19679', dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS)
+        update_variant_samples(samples, User.objects.get(username='test_user'), elasticsearch_index='test_index')
+        self.assertSetEqual(
+            set(get_samples_by_family_index([1])['test_index']['F000001_1'].keys()), {'NA19675', 'NA19679'})
+
+    def test_individual_update_invalidation(self):
+        MOCK_REDIS.set.reset_mock()
+        self.assertEqual(get_samples_by_family_index([1])['test_index']['F000001_1']['NA19675'].individual.affected, 'A')
+        get_samples_by_family_index([2])
+
+        # Edits to fields which are not cached do not invalidate the cache
+        individual = Individual.objects.get(guid='I000001_na19675')
+        individual.notes = 'A new note'
+        individual.features = [{'id': 'HP:0002017'}]
+        with self.captureOnCommitCallbacks(execute=True):
+            individual.save()
+        MOCK_REDIS.set.assert_not_called()
+        with self.assertNumQueries(0, using='default'):
+            get_samples_by_family_index([1, 2])
+
+        individual.affected = 'N'
+        with self.captureOnCommitCallbacks(execute=True):
+            individual.save()
+        MOCK_REDIS.set.assert_called_once_with('search_samples_version__1', mock.ANY)
+        # Other families are not invalidated
+        with self.assertNumQueries(0, using='default'):
+            get_samples_by_family_index([2])
+        self.assertEqual(get_samples_by_family_index([1])['test_index']['F000001_1']['NA19675'].individual.affected, 'N')
+
+        # Moving an individual to a different family invalidates both families
+        MOCK_REDIS.set.reset_mock()
+        individual.family_id = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            individual.save()
+        MOCK_REDIS.set.assert_has_calls([
+            mock.call('search_samples_version__1', mock.ANY), mock.call('search_samples_version__2', mock.ANY),
+        ])
+        samples_by_family_index = get_samples_by_family_index([1, 2])
+        self.assertNotIn('F000001_1', samples_by_family_index['test_index'])
+        self.assertIn('NA19675', samples_by_family_index['test_index']['F000002_2'])
+
+        # Invalidations are batched until the transaction commits
+        MOCK_REDIS.set.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Sample.objects.filter(individual__family_id=2).delete()
+            with self.assertNumQueries(0, using='default'):
+                self.assertIn('F000002_2', get_samples_by_family_index([2])['test_index'])
+        self.assertGreater(len(callbacks), 1)
+        MOCK_REDIS.set.assert_called_once_with('search_samples_version__2', mock.ANY)
+        self.assertDictEqual(get_samples_by_family_index([2]), {})
+
+        # Deleted individuals invalidate their family
+        get_samples_by_family_index([1])
+        MOCK_REDIS.set.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            Sample.objects.filter(individual__guid='I000002_na19678').delete()
+            Individual.objects.get(guid='I000002_na19678').delete()
+        MOCK_REDIS.set.assert_called_once_with('search_samples_version__1', mock.ANY)
+        self.assertNotIn('test_index_old', get_samples_by_family_index([1]))
@@ -1,15 +1,37 @@
 from datetime import timedelta
 import elasticsearch
+import logging
+from threading import Lock
+from time import monotonic, time
 
-from settings import ELASTICSEARCH_SERVICE_HOSTNAME, ELASTICSEARCH_SERVICE_PORT, ELASTICSEARCH_CREDENTIALS, ELASTICSEARCH_PROTOCOL, ES_SSL_CONTEXT
+from settings import ELASTICSEARCH_SERVICE_HOSTNAME, ELASTICSEARCH_SERVICE_PORT, ELASTICSEARCH_CREDENTIALS, ELASTICSEARCH_PROTOCOL, ES_SSL_CONTEXT, \
+    ELASTICSEARCH_CONNECTION_POOL_SIZE, ELASTICSEARCH_CLIENT_MAX_AGE, ELASTICSEARCH_SNIFF_INTERVAL
 from seqr.models import Sample
-from seqr.utils.redis_utils import safe_redis_get_json, safe_redis_set_json
-from seqr.utils.elasticsearch.constants import XPOS_SORT_KEY, MAX_VARIANTS
+from seqr.utils.cache_utils import LocalCache
+from seqr.utils.redis_utils import safe_redis_get_json, safe_redis_get_json_bulk, safe_redis_set_json, \
+    safe_redis_set_json_bulk, safe_redis_delete, safe_redis_add_to_sets, safe_redis_get_set
+from seqr.utils.elasticsearch.constants import XPOS_SORT_KEY, MAX_VARIANTS, CACHED_RESULTS_CHUNK_SIZE
 from seqr.utils.elasticsearch.es_gene_agg_search import EsGeneAggSearch
-from seqr.utils.elasticsearch.es_search import EsSearch
+from seqr.utils.elasticsearch.es_search import EsSearch, SEARCH_CURSORS_KEY
 from seqr.utils.gene_utils import parse_locus_list_items
 from seqr.utils.xpos_utils import get_xpos, get_chrom_pos
 
+logger = logging.getLogger(__name__)
+
+SEARCH_RESULTS_CACHE_EXPIRE = timedelta(weeks=2)
+CHUNKED_RESULT_FIELDS = ['all_results', 'grouped_results']
+CACHED_RESULT_COUNTS_KEY = 'cached_result_counts'
+
+# Index metadata is only changed by reloading an index, so a short lived local cache avoids repeated redis lookups.
+# Entries are tagged with a version shared in redis, so invalidating metadata in any process invalidates the entries
+# cached in every process
+INDEX_METADATA_LOCAL_CACHE = LocalCache(max_size=1000, ttl=300)
+INDEX_METADATA_VERSION_KEY = 'index_metadata_version'
+
+# Clients are shared across requests in a process, keyed by their options, so connections are reused between searches
+ES_CLIENTS = {}
+ES_CLIENTS_LOCK = Lock()
+
 
 class InvalidIndexException(Exception):
     pass
@@ -19,9 +41,22 @@ class InvalidSearchException(Exception):
 
 
 def get_es_client(timeout=300, **kwargs):
+    client_key = (timeout, tuple(sorted(kwargs.items())))
+    with ES_CLIENTS_LOCK:
+        client, created = ES_CLIENTS.get(client_key, (None, None))
+        if client is None or (ELASTICSEARCH_CLIENT_MAX_AGE and monotonic() - created > ELASTICSEARCH_CLIENT_MAX_AGE):
+            # Expired clients are not closed, as they may still be in use by in-flight searches. Their connections are
+            # released once the client is no longer referenced and is garbage collected
+            client = _create_es_client(timeout, **kwargs)
+            ES_CLIENTS[client_key] = (client, monotonic())
+    return client
+
+
+def _create_es_client(timeout, **kwargs):
     client_kwargs = {
         'hosts': [{'host': ELASTICSEARCH_SERVICE_HOSTNAME, 'port': ELASTICSEARCH_SERVICE_PORT}],
         'timeout': timeout,
+        'maxsize': ELASTICSEARCH_CONNECTION_POOL_SIZE,
     }
     if ELASTICSEARCH_CREDENTIALS:
         client_kwargs['http_auth'] = ELASTICSEARCH_CREDENTIALS
@@ -29,35 +64,131 @@ def get_es_client(timeout=300, **kwargs):
         client_kwargs['scheme'] = ELASTICSEARCH_PROTOCOL
     if ES_SSL_CONTEXT:
         client_kwargs['ssl_context'] = ES_SSL_CONTEXT
-    return elasticsearch.Elasticsearch(**client_kwargs, **kwargs)
-
-
-def get_index_metadata(index_name, client, include_fields=False, use_cache=True):
+    if ELASTICSEARCH_SNIFF_INTERVAL:
+        client_kwargs.update({'sniffer_timeout': ELASTICSEARCH_SNIFF_INTERVAL, 'sniff_on_connection_fail': True})
+    client_kwargs.update(kwargs)
+    return elasticsearch.Elasticsearch(**client_kwargs)
+
+
+def get_es_client_pool_stats():
+    with ES_CLIENTS_LOCK:
+        clients = list(ES_CLIENTS.items())
+
+    stats = []
+    for (timeout, options), (client, created) in clients:
+        pools = [connection.pool for connection in client.transport.connection_pool.connections]
+        stats.append({
+            'timeout': timeout,
+            'options': dict(options),
+            'ageSeconds': round(monotonic() - created),
+            'nodes': len(pools),
+            'maxConnections': sum(pool.pool.maxsize for pool in pools),
+            'openedConnections': sum(pool.num_connections for pool in pools),
+            # Unused slots in the urllib3 pool queue are None placeholders
+            'idleConnections': sum(len([conn for conn in list(pool.pool.queue) if conn]) for pool in pools),
+            'requests': sum(pool.num_requests for pool in pools),
+        })
+    return stats
+
+
+def get_index_metadata(index_name, client, include_fields=False, use_cache=True, fetch_alias=None):
+    """
+    Metadata is cached separately for each index, so metadata for any combination of indices is assembled from cached
+    entries and only indices without cached metadata are fetched from elasticsearch. If a fetch_alias is provided, it is
+    used to fetch any missing metadata instead of listing every index
+    """
+    requested_indices = index_name.split(',')
+    indices = requested_indices
+    index_metadata = {}
     if use_cache:
-        cache_key = 'index_metadata__{}'.format(index_name)
-        cached_metadata = safe_redis_get_json(cache_key)
-        if cached_metadata:
-            return cached_metadata
-
+        cached_metadata = _get_cached_index_metadata(indices)
+        for metadata in cached_metadata.values():
+            index_metadata.update(metadata)
+        # Cached aliases are keyed by the alias name, not the indices they resolve to
+        indices = [index for index in indices if index not in cached_metadata]
+        if not indices:
+            return index_metadata
+
+    fetch_index_name = fetch_alias or ','.join(indices)
     try:
-        mappings = client.indices.get_mapping(index=index_name)
+        mappings = client.indices.get_mapping(index=fetch_index_name)
     except Exception as e:
         raise InvalidIndexException('{} - Error accessing index: {}'.format(
-            index_name, e.error if hasattr(e, 'error') else str(e)))
-    index_metadata = {}
-    for index_name, mapping in mappings.items():
+            fetch_index_name, e.error if hasattr(e, 'error') else str(e)))
+    fetched_metadata = {}
+    for mapping_index_name, mapping in mappings.items():
         variant_mapping = mapping['mappings']
-        index_metadata[index_name] = variant_mapping.get('_meta', {})
+        fetched_metadata[mapping_index_name] = variant_mapping.get('_meta', {})
         if include_fields:
-            index_metadata[index_name]['fields'] = {
+            fetched_metadata[mapping_index_name]['fields'] = {
                 field: field_props.get('type') for field, field_props in variant_mapping['properties'].items()
             }
     if use_cache and include_fields:
         # Only cache metadata with fields
-        safe_redis_set_json(cache_key, index_metadata)
+        _set_cached_index_metadata(indices, requested_indices, fetched_metadata)
+    index_metadata.update(fetched_metadata)
     return index_metadata
 
 
+def _index_metadata_cache_key(index_name):
+    return 'index_metadata__{}'.format(index_name)
+
+
+def _index_aliases_cache_key(index_name):
+    return 'index_metadata_aliases__{}'.format(index_name)
+
+
+def _get_cached_index_metadata(indices):
+    version = safe_redis_get_json(INDEX_METADATA_VERSION_KEY)
+    cached_metadata = {
+        index: metadata for index, (cached_version, metadata) in INDEX_METADATA_LOCAL_CACHE.get_many(indices).items()
+        if cached_version == version
+    }
+    uncached_indices = [index for index in indices if index not in cached_metadata]
+    if uncached_indices:
+        redis_metadata = safe_redis_get_json_bulk([_index_metadata_cache_key(index) for index in uncached_indices])
+        for index in uncached_indices:
+            metadata = redis_metadata[_index_metadata_cache_key(index)]
+            if metadata:
+                cached_metadata[index] = metadata
+                INDEX_METADATA_LOCAL_CACHE.set(index, (version, metadata))
+    return cached_metadata
+
+
+def _set_cached_index_metadata(fetched_indices, requested_indices, fetched_metadata):
+    metadata_by_index = {index: {index: metadata} for index, metadata in fetched_metadata.items()}
+    # Requested names with no returned mapping are aliases. The indices an alias resolves to are only known if there
+    # is a single alias in the request
+    aliases = [index for index in fetched_indices if index not in fetched_metadata]
+    alias_indices = []
+    if len(aliases) == 1:
+        metadata_by_index[aliases[0]] = {
+            index: metadata for index, metadata in fetched_metadata.items() if index not in requested_indices
+        }
+        alias_indices = metadata_by_index[aliases[0]].keys()
+
+    version = safe_redis_get_json(INDEX_METADATA_VERSION_KEY)
+    for index, metadata in metadata_by_index.items():
+        INDEX_METADATA_LOCAL_CACHE.set(index, (version, metadata))
+    safe_redis_set_json_bulk({_index_metadata_cache_key(index): metadata for index, metadata in metadata_by_index.items()})
+    # The aliases cached for each index are tracked, so they can be invalidated with the index
+    safe_redis_add_to_sets({_index_aliases_cache_key(index): [aliases[0]] for index in alias_indices})
+
+
+def invalidate_index_metadata(index_name=None):
+    """
+    Removes cached metadata for the given index and for any alias which includes it. Metadata cached in every process
+    is invalidated, so other indices are reloaded from redis if no index is given
+    """
+    if index_name:
+        aliases = safe_redis_get_set(_index_aliases_cache_key(index_name))
+        safe_redis_delete([_index_metadata_cache_key(index_name), _index_aliases_cache_key(index_name)] + [
+            _index_metadata_cache_key(alias) for alias in sorted(aliases)
+        ])
+    INDEX_METADATA_LOCAL_CACHE.clear()
+    safe_redis_set_json(INDEX_METADATA_VERSION_KEY, time())
+
+
 def get_single_es_variant(families, variant_id, return_all_queried_families=False, user=None):
     variants = EsSearch(
         families, return_all_queried_families=return_all_queried_families, user=user,
@@ -85,13 +216,19 @@ def get_es_variants_for_variant_tuples(families, xpos_ref_alt_tuples):
 
 
 def get_es_variants(search_model, es_search_cls=EsSearch, sort=XPOS_SORT_KEY, skip_genotype_filter=False, load_all=False, user=None, page=1, num_results=100):
-    cache_key = 'search_results__{}__{}'.format(search_model.guid, sort or XPOS_SORT_KEY)
-    previous_search_results = safe_redis_get_json(cache_key) or {}
+    cache_key = _search_results_cache_key(search_model, sort)
+    if load_all or not es_search_cls.CACHED_RESULTS_PAGINATED:
+        previous_search_results, cached_result_counts = _get_cached_search_results(cache_key)
+    else:
+        previous_search_results, cached_result_counts = _get_cached_search_results(
+            cache_key, start_index=(page - 1) * num_results, end_index=page * num_results)
     total_results = previous_search_results.get('total_results')
 
     previously_loaded_results, search_kwargs = es_search_cls.process_previous_results(previous_search_results, load_all=load_all, page=page, num_results=num_results)
     if previously_loaded_results is not None:
         return previously_loaded_results, previous_search_results.get('total_results')
+    if not _load_last_cached_chunks(cache_key, previous_search_results, cached_result_counts):
+        previous_search_results, cached_result_counts = {}, {}
     page = search_kwargs.get('page', page)
     num_results = search_kwargs.get('num_results', num_results)
 
@@ -133,11 +270,116 @@ def get_es_variants(search_model, es_search_cls=EsSearch, sort=XPOS_SORT_KEY, sk
 
     variant_results = es_search.search(page=page, num_results=num_results)
 
-    safe_redis_set_json(cache_key, es_search.previous_search_results, expire=timedelta(weeks=2))
+    _set_cached_search_results(cache_key, es_search.previous_search_results, cached_result_counts)
 
     return variant_results, es_search.previous_search_results.get('total_results')
 
 
+def has_search_cursors(search_model, sort=XPOS_SORT_KEY):
+    """
+    Returns whether every partially loaded index for the cached search has a search_after cursor, in which case further
+    pages can be loaded past MAX_VARIANTS
+    """
+    results = safe_redis_get_json(_search_results_cache_key(search_model, sort)) or {}
+    search_cursors = results.get(SEARCH_CURSORS_KEY)
+    if not search_cursors:
+        return False
+    return all(
+        index_name in search_cursors for index_name, counts in results.get('loaded_variant_counts', {}).items()
+        if counts['loaded'] < counts['total'] and not index_name.endswith('_compound_het')
+    )
+
+
+def _search_results_cache_key(search_model, sort):
+    return 'search_results__{}__{}'.format(search_model.guid, sort or XPOS_SORT_KEY)
+
+
+def _chunk_cache_key(cache_key, field, chunk_index):
+    return '{}__{}__{}'.format(cache_key, field, chunk_index)
+
+
+def _get_cached_search_results(cache_key, start_index=None, end_index=None):
+    """
+    Loads cached search results. The large result lists are stored in fixed size chunks separately from a small header,
+    so only the chunks overlapping the requested range are fetched. Entries outside the range are left as None
+    placeholders so list positions are preserved. Returns the results and the per-field counts of cached entries
+    """
+    results = safe_redis_get_json(cache_key) or {}
+    cached_result_counts = results.pop(CACHED_RESULT_COUNTS_KEY, None)
+    if not cached_result_counts:
+        # Results cached before chunking was supported have all the results inline
+        return results, {}
+
+    chunk_keys = []
+    for field, count in cached_result_counts.items():
+        results[field] = [None] * count
+        field_end_index = count if end_index is None else min(end_index, count)
+        first_chunk = (start_index or 0) // CACHED_RESULTS_CHUNK_SIZE
+        for chunk_index in range(first_chunk, _num_chunks(field_end_index)):
+            chunk_keys.append((field, chunk_index))
+
+    if not _load_cached_chunks(cache_key, results, chunk_keys):
+        return {}, {}
+    return results, cached_result_counts
+
+
+def _load_last_cached_chunks(cache_key, results, cached_result_counts):
+    """
+    Loads the last, partially filled chunk of each cached list if it is not already loaded. New results are only
+    appended to the cached lists, so this is the only chunk outside of the requested page which is rewritten when the
+    results are cached again, and the chunks before it are left as placeholders
+    """
+    chunk_keys = []
+    for field, count in cached_result_counts.items():
+        if count % CACHED_RESULTS_CHUNK_SIZE == 0:
+            continue
+        chunk_index = count // CACHED_RESULTS_CHUNK_SIZE
+        if results[field][chunk_index * CACHED_RESULTS_CHUNK_SIZE] is None:
+            chunk_keys.append((field, chunk_index))
+    return _load_cached_chunks(cache_key, results, chunk_keys)
+
+
+def _load_cached_chunks(cache_key, results, chunk_keys):
+    if not chunk_keys:
+        return True
+
+    cached_chunks = safe_redis_get_json_bulk([_chunk_cache_key(cache_key, *chunk_key) for chunk_key in chunk_keys])
+    for field, chunk_index in chunk_keys:
+        chunk = cached_chunks[_chunk_cache_key(cache_key, field, chunk_index)]
+        if chunk is None:
+            logger.warning('Missing cached chunk {} for {}, ignoring cached results'.format(chunk_index, cache_key))
+            return False
+        start = chunk_index * CACHED_RESULTS_CHUNK_SIZE
+        results[field][start:start + len(chunk)] = chunk
+    return True
+
+
+def _set_cached_search_results(cache_key, results, cached_result_counts):
+    """
+    Caches search results as a header and fixed size chunks. Cached result lists are only ever appended to, so only the
+    chunks at or after the end of the previously cached results need to be written
+    """
+    header = {k: v for k, v in results.items() if k not in CHUNKED_RESULT_FIELDS}
+    header[CACHED_RESULT_COUNTS_KEY] = {}
+    values_by_key = {cache_key: header}
+    for field in CHUNKED_RESULT_FIELDS:
+        if field not in results:
+            continue
+        field_results = results[field]
+        header[CACHED_RESULT_COUNTS_KEY][field] = len(field_results)
+        first_chunk = cached_result_counts.get(field, 0) // CACHED_RESULTS_CHUNK_SIZE
+        for chunk_index in range(first_chunk, _num_chunks(len(field_results))):
+            start = chunk_index * CACHED_RESULTS_CHUNK_SIZE
+            values_by_key[_chunk_cache_key(cache_key, field, chunk_index)] = \
+                field_results[start:start + CACHED_RESULTS_CHUNK_SIZE]
+
+    safe_redis_set_json_bulk(values_by_key, expire=SEARCH_RESULTS_CACHE_EXPIRE, compress=True)
+
+
+def _num_chunks(count):
+    return -(-count // CACHED_RESULTS_CHUNK_SIZE)
+
+
 def get_es_variant_gene_counts(search_model, user):
     gene_counts, _ = get_es_variants(search_model, es_search_cls=EsGeneAggSearch, sort=None, user=user)
     return gene_counts
@@ -1,14 +1,41 @@
 import re
 from collections import defaultdict
-from django.db.models import Q, prefetch_related_objects, Prefetch
+from copy import deepcopy
+from time import time
+from django.db.models import prefetch_related_objects, Prefetch
 from django.db.models.functions import Length
 
 from reference_data.models import GeneInfo, GeneConstraint, dbNSFPGene, Omim, MGI, PrimateAI, GeneCopyNumberSensitivity, \
     GenCC, ClinGen
+from seqr.utils.autocomplete_utils import AutocompleteIndex
+from seqr.utils.cache_utils import LocalCache
+from seqr.utils.redis_utils import safe_redis_get_json, safe_redis_set_json
 from seqr.utils.xpos_utils import get_xpos
 from seqr.views.utils.orm_to_json_utils import _get_json_for_model, _get_json_for_models, _get_empty_json_for_model, \
     get_json_for_gene_notes_by_gene_id
 
+# Gene json which does not depend on the user is cached by field set and gene. Entries are tagged with a reference data
+# version shared in redis, so running a reference data update in any process invalidates the entries in every process
+GENE_JSON_CACHE = LocalCache(max_size=200000, ttl=24 * 3600)
+REFERENCE_DATA_VERSION_KEY = 'reference_data_version'
+VARIANT_DISPLAY_FIELDS_CACHE_KEY = 'variant_display'
+VARIANT_FIELDS_CACHE_KEY = 'variant'
+
+# Indices built over entire reference data tables, such as gene ids by symbol for parsing locus lists, are held in
+# memory. They are versioned in the same way as the gene json cache
+REFERENCE_DATA_INDEX_CACHE = LocalCache(max_size=10, ttl=24 * 3600)
+GENE_LOCUS_INDEX_KEY = 'gene_locus_index'
+GENE_AUTOCOMPLETE_INDEX_KEY = 'gene_autocomplete_index'
+GENE_LOCUS_FIELDS = [
+    'gene_id', 'gene_symbol', 'chrom_grch37', 'start_grch37', 'end_grch37', 'chrom_grch38', 'start_grch38', 'end_grch38',
+]
+GENE_LOCUS_JSON_FIELDS = [
+    'geneId', 'geneSymbol', 'chromGrch37', 'startGrch37', 'endGrch37', 'chromGrch38', 'startGrch38', 'endGrch38',
+]
+
+INTERVAL_REGEX = re.compile('(?P<chrom>\w+):(?P<start>\d+)-(?P<end>\d+)(%(?P<offset>(\d+)))?')
+TAB_INTERVAL_REGEX = re.compile('(?P<chrom>\w+)<TAB>(?P<start>\d+)<TAB>(?P<end>\d+)')
+
 
 def get_gene(gene_id, user):
     gene = GeneInfo.objects.get(gene_id=gene_id)
@@ -21,11 +48,11 @@ def get_genes(gene_ids):
 
 
 def get_genes_for_variant_display(gene_ids):
-    return _get_genes(gene_ids, gene_fields=VARIANT_GENE_DISPLAY_FIELDS)
+    return _get_cached_genes(gene_ids, VARIANT_DISPLAY_FIELDS_CACHE_KEY, VARIANT_GENE_DISPLAY_FIELDS)
 
 
 def get_genes_for_variants(gene_ids):
-    return _get_genes(gene_ids, gene_fields=VARIANT_GENE_FIELDS)
+    return _get_cached_genes(gene_ids, VARIANT_FIELDS_CACHE_KEY, VARIANT_GENE_FIELDS)
 
 
 def get_genes_with_detail(gene_ids, user):
@@ -40,6 +67,63 @@ def _get_genes(gene_ids, user=None, gene_fields=None):
     return {gene['geneId']: gene for gene in _get_json_for_genes(genes, user=user, gene_fields=gene_fields)}
 
 
+def _get_cached_genes(gene_ids, fields_cache_key, gene_fields):
+    version = safe_redis_get_json(REFERENCE_DATA_VERSION_KEY)
+    cached_genes = {}
+    for (_, gene_id), (cached_version, gene_json) in GENE_JSON_CACHE.get_many(
+            [(fields_cache_key, gene_id) for gene_id in gene_ids]).items():
+        if cached_version == version:
+            cached_genes[gene_id] = gene_json
+
+    uncached_gene_ids = [gene_id for gene_id in gene_ids if gene_id not in cached_genes]
+    if uncached_gene_ids:
+        fetched_genes = _get_genes(uncached_gene_ids, gene_fields=gene_fields)
+        # Unknown genes are cached as None so they are not refetched
+        for gene_id in uncached_gene_ids:
+            gene_json = fetched_genes.get(gene_id)
+            GENE_JSON_CACHE.set((fields_cache_key, gene_id), (version, gene_json))
+            cached_genes[gene_id] = gene_json
+
+    # Callers add request specific fields to the returned genes, including nested fields, so the cached json is copied
+    return {gene_id: deepcopy(gene_json) for gene_id, gene_json in cached_genes.items() if gene_json is not None}
+
+
+def invalidate_reference_data_cache():
+    """Called whenever reference data is updated, so cached gene json and indices are rebuilt from the new data"""
+    GENE_JSON_CACHE.clear()
+    REFERENCE_DATA_INDEX_CACHE.clear()
+    safe_redis_set_json(REFERENCE_DATA_VERSION_KEY, time())
+
+
+def get_reference_data_index(index_key, build_index):
+    """Returns the cached index for the current reference data version, or calls build_index to rebuild it"""
+    version = safe_redis_get_json(REFERENCE_DATA_VERSION_KEY)
+    cached_version, index = REFERENCE_DATA_INDEX_CACHE.get(index_key, (None, None))
+    if index is None or cached_version != version:
+        index = build_index()
+        REFERENCE_DATA_INDEX_CACHE.set(index_key, (version, index))
+    return index
+
+
+def _build_gene_locus_index():
+    """Returns ({gene_symbol: gene_id}, {gene_id: gene locus row}) for all genes"""
+    symbols_to_id = {}
+    genes_by_id = {}
+    # Symbols resolve to the gene from the most recent gencode release
+    for gene in GeneInfo.objects.order_by('-gencode_release').values_list(*GENE_LOCUS_FIELDS):
+        genes_by_id[gene[0]] = gene
+        symbols_to_id.setdefault(gene[1], gene[0])
+    return symbols_to_id, genes_by_id
+
+
+def _build_gene_autocomplete_index():
+    # Genes are ranked by shortest symbol, with null symbols last
+    return AutocompleteIndex(
+        GeneInfo.objects.values('gene_id', 'gene_symbol').order_by(Length('gene_symbol').asc(), 'gene_symbol'),
+        fields=['gene_id', 'gene_symbol'],
+    )
+
+
 def get_gene_ids_for_gene_symbols(gene_symbols):
     genes = GeneInfo.objects.filter(gene_symbol__in=gene_symbols).only('gene_symbol', 'gene_id').order_by('-gencode_release')
     symbols_to_ids = defaultdict(list)
@@ -53,10 +137,8 @@ def get_filtered_gene_ids(gene_filter):
 
 
 def get_queried_genes(query, max_results):
-    matching_genes = GeneInfo.objects.filter(
-        Q(gene_id__icontains=query) | Q(gene_symbol__icontains=query)
-    ).only('gene_id', 'gene_symbol').order_by(Length('gene_symbol').asc(), 'gene_symbol').distinct()
-    return [{'gene_id': gene.gene_id, 'gene_symbol': gene.gene_symbol} for gene in matching_genes[:max_results]]
+    index = get_reference_data_index(GENE_AUTOCOMPLETE_INDEX_KEY, _build_gene_autocomplete_index)
+    return [dict(gene) for gene in index.search(query, max_results)]
 
 
 def _get_gene_model(gene, field):
@@ -149,18 +231,24 @@ def _get_json_for_genes(genes, user=None, gene_fields=None):
 
 
 def parse_locus_list_items(request_json):
+    """
+    Returns (genes_by_id, intervals, invalid_items) for the raw locus list items. Genes are resolved from the in memory
+    gene locus index, so the returned gene json only has the gene symbol and coordinates
+    """
     raw_items = request_json.get('rawItems')
     if not raw_items:
         return None, None, None
 
+    symbols_to_id, gene_loci_by_id = get_reference_data_index(GENE_LOCUS_INDEX_KEY, _build_gene_locus_index)
+
     invalid_items = []
     intervals = []
     gene_ids = set()
-    gene_symbols = set()
+    invalid_gene_symbols = {}
     for item in raw_items.replace(',', ' ').replace('\t', '<TAB>').split():
-        interval_match = re.match('(?P<chrom>\w+):(?P<start>\d+)-(?P<end>\d+)(%(?P<offset>(\d+)))?', item)
+        interval_match = INTERVAL_REGEX.match(item)
         if not interval_match:
-            interval_match = re.match('(?P<chrom>\w+)<TAB>(?P<start>\d+)<TAB>(?P<end>\d+)', item)
+            interval_match = TAB_INTERVAL_REGEX.match(item)
         if interval_match:
             interval = interval_match.groupdict()
             try:
@@ -181,11 +269,17 @@ def parse_locus_list_items(request_json):
         elif item.upper().startswith('ENSG'):
             gene_ids.add(item.replace('<TAB>', ''))
         else:
-            gene_symbols.add(item.replace('<TAB>', ''))
-
-    gene_symbols_to_ids = get_gene_ids_for_gene_symbols(gene_symbols)
-    invalid_items += [symbol for symbol in gene_symbols if not gene_symbols_to_ids.get(symbol)]
-    gene_ids.update({gene_ids[0] for gene_ids in gene_symbols_to_ids.values() if len(gene_ids)})
-    genes_by_id = get_genes(list(gene_ids)) if gene_ids else {}
-    invalid_items += [gene_id for gene_id in gene_ids if not genes_by_id.get(gene_id)]
-    return genes_by_id, intervals, invalid_items
\ No newline at end of file
+            gene_symbol = item.replace('<TAB>', '')
+            gene_id = symbols_to_id.get(gene_symbol)
+            if gene_id:
+                gene_ids.add(gene_id)
+            else:
+                invalid_gene_symbols[gene_symbol] = True
+
+    invalid_items += list(invalid_gene_symbols.keys())
+    genes_by_id = {
+        gene_id: dict(zip(GENE_LOCUS_JSON_FIELDS, gene_loci_by_id[gene_id]))
+        for gene_id in gene_ids if gene_id in gene_loci_by_id
+    }
+    invalid_items += [gene_id for gene_id in gene_ids if gene_id not in genes_by_id]
+    return genes_by_id, intervals, invalid_items
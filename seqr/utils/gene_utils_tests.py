@@ -1,16 +1,31 @@
+import mock
 from django.contrib.auth.models import User
 from django.test import TestCase
 
+from reference_data.models import GeneConstraint
 from seqr.utils.gene_utils import get_gene, get_genes, get_genes_for_variant_display, get_genes_for_variants, \
-    get_genes_with_detail
+    get_genes_with_detail, invalidate_reference_data_cache, parse_locus_list_items, GENE_JSON_CACHE, \
+    REFERENCE_DATA_INDEX_CACHE
 from seqr.views.utils.test_utils import GENE_FIELDS, GENE_DETAIL_FIELDS, GENE_VARIANT_FIELDS, GENE_VARIANT_DISPLAY_FIELDS
 
 GENE_ID = 'ENSG00000223972'
 
+REDIS_CACHE = {}
+MOCK_REDIS = mock.MagicMock()
+MOCK_REDIS.get.side_effect = REDIS_CACHE.get
+MOCK_REDIS.set.side_effect = lambda key, value: REDIS_CACHE.update({key: value})
+
+
+@mock.patch('seqr.utils.redis_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
 class GeneUtilsTest(TestCase):
     databases = '__all__'
     fixtures = ['reference_data']
 
+    def setUp(self):
+        REDIS_CACHE.clear()
+        GENE_JSON_CACHE.clear()
+        REFERENCE_DATA_INDEX_CACHE.clear()
+
     def test_get_gene(self):
         json = get_gene(GENE_ID, user=None)
         self.assertSetEqual(set(json.keys()), GENE_DETAIL_FIELDS)
@@ -54,3 +69,74 @@ class GeneUtilsTest(TestCase):
         self.assertListEqual(sparse_gene['omimPhenotypes'], [])
         self.assertDictEqual(sparse_gene['genCc'], {})
         self.assertIsNone(sparse_gene['clinGen'])
+
+    def test_get_genes_cache(self):
+        gene_ids = [GENE_ID, 'ENSG00000227232', 'ENSG00000000000']
+        with self.assertNumQueries(7, using='reference_data'):
+            json = get_genes_for_variant_display(gene_ids)
+        self.assertSetEqual(set(json.keys()), {GENE_ID, 'ENSG00000227232'})
+        self.assertEqual(json[GENE_ID]['constraints']['totalGenes'], 1)
+
+        # Cached genes, including unknown genes, are not refetched, and returned json can be updated by callers
+        json[GENE_ID]['locusListGuids'] = ['LL00049_pid_genes_autosomal_do']
+        json[GENE_ID]['constraints']['totalGenes'] = 2
+        with self.assertNumQueries(0, using='reference_data'):
+            cached_json = get_genes_for_variant_display(gene_ids)
+        self.assertDictEqual(cached_json, get_genes_for_variant_display(gene_ids))
+        self.assertNotIn('locusListGuids', cached_json[GENE_ID])
+        self.assertEqual(cached_json[GENE_ID]['constraints']['totalGenes'], 1)
+
+        # Genes are cached separately for each field set
+        with self.assertNumQueries(7, using='reference_data'):
+            get_genes_for_variant_display(gene_ids + ['ENSG00000135953'])
+        with self.assertNumQueries(9, using='reference_data'):
+            variant_json = get_genes_for_variants(gene_ids)
+        self.assertSetEqual(set(variant_json[GENE_ID].keys()), GENE_VARIANT_FIELDS)
+
+        # Updating reference data invalidates the cache
+        GeneConstraint.objects.filter(gene__gene_id=GENE_ID).delete()
+        with self.assertNumQueries(0, using='reference_data'):
+            self.assertEqual(get_genes_for_variant_display(gene_ids)[GENE_ID]['constraints']['totalGenes'], 1)
+
+        invalidate_reference_data_cache()
+        self.assertTrue('reference_data_version' in REDIS_CACHE)
+        with self.assertNumQueries(7, using='reference_data'):
+            json = get_genes_for_variant_display(gene_ids)
+        self.assertDictEqual(json[GENE_ID]['constraints'], {})
+
+        # Cached entries from before the shared version changed are refetched
+        REDIS_CACHE['reference_data_version'] = '1.0'
+        with self.assertNumQueries(7, using='reference_data'):
+            get_genes_for_variant_display(gene_ids)
+
+    def test_parse_locus_list_items(self):
+        self.assertTupleEqual(parse_locus_list_items({}), (None, None, None))
+
+        raw_items = 'DDX11L1, ENSG00000227232 chr2:1234-5678%20 chr7\t100\t10100, chr27:1234-5678 FOO, ENSG00012345 FOO'
+        with self.assertNumQueries(1, using='reference_data'):
+            genes_by_id, intervals, invalid_items = parse_locus_list_items({'rawItems': raw_items})
+        self.assertDictEqual(genes_by_id, {
+            GENE_ID: {
+                'geneId': GENE_ID, 'geneSymbol': 'DDX11L1', 'chromGrch37': '1', 'startGrch37': 11869,
+                'endGrch37': 14409, 'chromGrch38': '1', 'startGrch38': 11869, 'endGrch38': 14409,
+            },
+            'ENSG00000227232': {
+                'geneId': 'ENSG00000227232', 'geneSymbol': 'WASH7P', 'chromGrch37': '1', 'startGrch37': 14404,
+                'endGrch37': 29570, 'chromGrch38': '1', 'startGrch38': 14404, 'endGrch38': 29570,
+            },
+        })
+        self.assertListEqual(intervals, [
+            {'chrom': '2', 'start': 1234, 'end': 5678, 'offset': 0.2},
+            {'chrom': '7', 'start': 100, 'end': 10100},
+        ])
+        self.assertListEqual(invalid_items, ['chr27:1234-5678', 'FOO', 'ENSG00012345'])
+
+        # Genes are resolved from the cached index
+        with self.assertNumQueries(0, using='reference_data'):
+            genes_by_id, _, _ = parse_locus_list_items({'rawItems': 'WASH7P'})
+        self.assertSetEqual(set(genes_by_id.keys()), {'ENSG00000227232'})
+
+        # Updating reference data rebuilds the index
+        invalidate_reference_data_cache()
+        with self.assertNumQueries(1, using='reference_data'):
+            parse_locus_list_items({'rawItems': 'WASH7P'})
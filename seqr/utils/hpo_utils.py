@@ -0,0 +1,67 @@
+from collections import defaultdict
+
+from reference_data.models import HumanPhenotypeOntology
+from seqr.utils.gene_utils import get_reference_data_index
+
+HPO_ONTOLOGY_INDEX_KEY = 'hpo_ontology'
+HPO_TERM_FIELDS = ['hpo_id', 'name', 'parent_id', 'category_id', 'is_category']
+
+
+class HpoOntology(object):
+    """
+    All HPO terms, held in memory so terms, categories and child terms can be looked up without querying the database
+    """
+
+    def __init__(self, terms):
+        """
+        Args:
+            terms: HumanPhenotypeOntology values, with the HPO_TERM_FIELDS for each term
+        """
+        self._terms_by_id = {}
+        self._child_ids = defaultdict(list)
+        for term in terms:
+            hpo_id = term['hpo_id']
+            self._terms_by_id[hpo_id] = {field: term[field] for field in HPO_TERM_FIELDS}
+            if term['parent_id']:
+                self._child_ids[term['parent_id']].append(hpo_id)
+
+    def __contains__(self, hpo_id):
+        return hpo_id in self._terms_by_id
+
+    def __len__(self):
+        return len(self._terms_by_id)
+
+    def get_term(self, hpo_id):
+        """Returns the HPO_TERM_FIELDS for the given term, or None if it is not in the ontology"""
+        return self._terms_by_id.get(hpo_id)
+
+    def get_name(self, hpo_id):
+        term = self._terms_by_id.get(hpo_id)
+        return term and term['name']
+
+    def get_category_id(self, hpo_id):
+        term = self._terms_by_id.get(hpo_id)
+        return term and term['category_id']
+
+    def get_child_terms(self, parent_id):
+        return [self._terms_by_id[hpo_id] for hpo_id in self._child_ids.get(parent_id, [])]
+
+    def get_names(self, hpo_ids):
+        """Returns {hpo_id: name} for the given terms that are in the ontology, ordered by hpo id"""
+        return self._get_term_field(hpo_ids, 'name')
+
+    def get_category_ids(self, hpo_ids):
+        """Returns {hpo_id: category_id} for the given terms that are in the ontology, ordered by hpo id"""
+        return self._get_term_field(hpo_ids, 'category_id')
+
+    def _get_term_field(self, hpo_ids, field):
+        return {hpo_id: self._terms_by_id[hpo_id][field] for hpo_id in sorted(hpo_ids) if hpo_id in self._terms_by_id}
+
+
+def _build_hpo_ontology():
+    return HpoOntology(HumanPhenotypeOntology.objects.values(*HPO_TERM_FIELDS))
+
+
+def get_hpo_ontology():
+    """Returns the in-memory HPO ontology, which is rebuilt whenever the reference data is updated"""
+    return get_reference_data_index(HPO_ONTOLOGY_INDEX_KEY, _build_hpo_ontology)
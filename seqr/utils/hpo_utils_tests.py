@@ -0,0 +1,54 @@
+import mock
+from django.test import TestCase
+
+from reference_data.models import HumanPhenotypeOntology
+from seqr.utils.gene_utils import invalidate_reference_data_cache, REFERENCE_DATA_INDEX_CACHE
+from seqr.utils.hpo_utils import get_hpo_ontology
+
+REDIS_CACHE = {}
+MOCK_REDIS = mock.MagicMock()
+MOCK_REDIS.get.side_effect = REDIS_CACHE.get
+MOCK_REDIS.set.side_effect = lambda key, value: REDIS_CACHE.update({key: value})
+
+
+@mock.patch('seqr.utils.redis_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
+class HpoUtilsTest(TestCase):
+    databases = '__all__'
+    fixtures = ['reference_data']
+
+    def setUp(self):
+        REDIS_CACHE.clear()
+        REFERENCE_DATA_INDEX_CACHE.clear()
+
+    def test_get_hpo_ontology(self):
+        with self.assertNumQueries(1, using='reference_data'):
+            ontology = get_hpo_ontology()
+        self.assertEqual(len(ontology), 11)
+        self.assertIn('HP:0002017', ontology)
+        self.assertNotIn('HP:0000118', ontology)
+
+        self.assertDictEqual(ontology.get_term('HP:0002017'), {
+            'hpo_id': 'HP:0002017', 'name': 'Nausea and vomiting', 'parent_id': 'HP:0011458',
+            'category_id': 'HP:0025031', 'is_category': False,
+        })
+        self.assertIsNone(ontology.get_term('HP:0000118'))
+        self.assertEqual(ontology.get_name('HP:0001636'), 'Tetralogy of Fallot')
+        self.assertIsNone(ontology.get_name('HP:0000118'))
+        self.assertEqual(ontology.get_category_id('HP:0001636'), 'HP:0033127')
+        names = ontology.get_names({'HP:0011675', 'HP:0001636', 'HP:0000118'})
+        self.assertDictEqual(names, {'HP:0001636': 'Tetralogy of Fallot', 'HP:0011675': 'Arrhythmia'})
+        self.assertListEqual(list(names.keys()), ['HP:0001636', 'HP:0011675'])
+        self.assertDictEqual(ontology.get_category_ids(['HP:0001636', 'HP:0000118']), {'HP:0001636': 'HP:0033127'})
+
+        self.assertListEqual(
+            sorted(term['hpo_id'] for term in ontology.get_child_terms('HP:0011458')), ['HP:0001252', 'HP:0002017'])
+        self.assertListEqual(ontology.get_child_terms('HP:0000118'), [])
+
+        # The ontology is only rebuilt when the reference data is updated
+        HumanPhenotypeOntology.objects.filter(hpo_id='HP:0001636').update(name='Fallot tetralogy')
+        with self.assertNumQueries(0, using='reference_data'):
+            self.assertEqual(get_hpo_ontology().get_name('HP:0001636'), 'Tetralogy of Fallot')
+
+        invalidate_reference_data_cache()
+        with self.assertNumQueries(1, using='reference_data'):
+            self.assertEqual(get_hpo_ontology().get_name('HP:0001636'), 'Fallot tetralogy')
@@ -0,0 +1,154 @@
+from collections import defaultdict
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from seqr.models import Project, Family, Individual, Sample, SavedVariant, pre_bulk_update
+from seqr.utils.cache_utils import batch_on_commit
+from seqr.utils.redis_utils import safe_redis_get_json_bulk, safe_redis_set_json_bulk, safe_redis_delete
+
+# Summary counts are cached in redis for each project. A project's counts are deleted whenever a family, individual,
+# sample or saved variant in it is saved or deleted, or bulk updated with ModelWithGUID.bulk_update, or when datasets
+# are loaded for it, so only changed projects are recounted. Deletions from saved, deleted or bulk updated models are
+# batched until the transaction commits. Queryset update and bulk_create calls made directly on a model manager do not
+# send any signals, so callers must invalidate the counts for the changed projects themselves
+PROJECT_STATS_KEY_TEMPLATE = 'project_stats__{}'
+PROJECT_STATS_EXPIRE_SECONDS = 24 * 60 * 60
+PROJECT_STATS_BATCH_SIZE = 500
+
+# The lookup for the project of each model, and the fields of the model which are counted. Bulk updates to other
+# fields do not change the counts. Bulk updates which move models to a different family are not supported
+BULK_UPDATE_PROJECT_STATS_FIELDS = {
+    Family: ('project_id', {'analysis_status'}),
+    Sample: ('individual__family__project_id', {'sample_type', 'dataset_type', 'is_active'}),
+}
+
+
+def _project_stats_key(project_id):
+    return PROJECT_STATS_KEY_TEMPLATE.format(project_id)
+
+
+def get_project_stats(project_ids):
+    """
+    Returns summary counts for each of the given projects, as
+    {project_id: {'numFamilies', 'numIndividuals', 'numVariantTags', 'analysisStatusCounts', 'sampleTypeCounts',
+    'activeSampleCounts'}}
+    """
+    cached_stats = safe_redis_get_json_bulk([_project_stats_key(project_id) for project_id in project_ids])
+    stats_by_project_id = {
+        project_id: cached_stats[_project_stats_key(project_id)] for project_id in project_ids
+        if cached_stats[_project_stats_key(project_id)] is not None
+    }
+    uncached_project_ids = [project_id for project_id in project_ids if project_id not in stats_by_project_id]
+    if uncached_project_ids:
+        stats_by_project_id.update(update_project_stats(uncached_project_ids))
+    return stats_by_project_id
+
+
+def update_project_stats(project_ids):
+    """Recounts and caches the summary counts for the given projects"""
+    stats_by_project_id = _count_project_stats(project_ids)
+    safe_redis_set_json_bulk({
+        _project_stats_key(project_id): stats for project_id, stats in stats_by_project_id.items()
+    }, expire=PROJECT_STATS_EXPIRE_SECONDS)
+    return stats_by_project_id
+
+
+def _count_project_stats(project_ids):
+    stats_by_project_id = {project_id: {
+        'numFamilies': 0,
+        'numIndividuals': 0,
+        'numVariantTags': 0,
+        'analysisStatusCounts': defaultdict(int),
+        'sampleTypeCounts': defaultdict(int),
+        'activeSampleCounts': defaultdict(int),
+    } for project_id in project_ids}
+
+    for agg in Family.objects.filter(project_id__in=project_ids).values('project_id', 'analysis_status').annotate(
+            count=Count('*')):
+        stats = stats_by_project_id[agg['project_id']]
+        stats['numFamilies'] += agg['count']
+        stats['analysisStatusCounts'][agg['analysis_status']] += agg['count']
+
+    for agg in Individual.objects.filter(family__project_id__in=project_ids).values('family__project_id').annotate(
+            count=Count('*')):
+        stats_by_project_id[agg['family__project_id']]['numIndividuals'] = agg['count']
+
+    for agg in SavedVariant.objects.filter(family__project_id__in=project_ids).values('family__project_id').annotate(
+            count=Count('*')):
+        stats_by_project_id[agg['family__project_id']]['numVariantTags'] = agg['count']
+
+    for agg in Sample.objects.filter(
+        individual__family__project_id__in=project_ids, dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS,
+    ).values('individual__family__project_id', 'sample_type').annotate(count=Count('individual_id', distinct=True)):
+        stats_by_project_id[agg['individual__family__project_id']]['sampleTypeCounts'][agg['sample_type']] = agg['count']
+
+    for agg in Sample.objects.filter(individual__family__project_id__in=project_ids, is_active=True).values(
+            'individual__family__project_id', 'sample_type', 'dataset_type').annotate(count=Count('*')):
+        stats_by_project_id[agg['individual__family__project_id']]['activeSampleCounts'][
+            '{}__{}'.format(agg['sample_type'], agg['dataset_type'])] = agg['count']
+
+    for stats in stats_by_project_id.values():
+        for key in ['analysisStatusCounts', 'sampleTypeCounts', 'activeSampleCounts']:
+            stats[key] = dict(stats[key])
+    return stats_by_project_id
+
+
+def invalidate_project_stats(project_ids):
+    safe_redis_delete([_project_stats_key(project_id) for project_id in set(project_ids)])
+
+
+def _invalidate_batched_project_stats(items):
+    project_ids = {item_id for model_cls, item_id in items if model_cls is Project}
+    family_ids = {item_id for model_cls, item_id in items if model_cls is Family}
+    individual_ids = {item_id for model_cls, item_id in items if model_cls is Individual}
+    # Deleted parents no longer exist, but their projects are already included from their own delete signal
+    if family_ids:
+        project_ids.update(Family.objects.filter(id__in=family_ids).values_list('project_id', flat=True))
+    if individual_ids:
+        project_ids.update(
+            Individual.objects.filter(id__in=individual_ids).values_list('family__project_id', flat=True))
+    invalidate_project_stats(project_ids)
+
+
+def _batch_invalidate_project_stats(model_cls, item_id):
+    batch_on_commit(_invalidate_batched_project_stats, [(model_cls, item_id)])
+
+
+@receiver([post_save, post_delete], sender=Family)
+def _invalidate_family_project_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _batch_invalidate_project_stats(Project, instance.project_id)
+
+
+@receiver([post_save, post_delete], sender=Individual)
+@receiver([post_save, post_delete], sender=SavedVariant)
+def _invalidate_family_model_project_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if sender.family.is_cached(instance):
+        _batch_invalidate_project_stats(Project, instance.family.project_id)
+    else:
+        _batch_invalidate_project_stats(Family, instance.family_id)
+
+
+@receiver([post_save, post_delete], sender=Sample)
+def _invalidate_sample_project_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if not Sample.individual.is_cached(instance):
+        _batch_invalidate_project_stats(Individual, instance.individual_id)
+    elif Individual.family.is_cached(instance.individual):
+        _batch_invalidate_project_stats(Project, instance.individual.family.project_id)
+    else:
+        _batch_invalidate_project_stats(Family, instance.individual.family_id)
+
+
+@receiver(pre_bulk_update, sender=Family)
+@receiver(pre_bulk_update, sender=Sample)
+def _invalidate_bulk_update_project_stats(sender, queryset, update_fields, **kwargs):
+    project_id_field, counted_fields = BULK_UPDATE_PROJECT_STATS_FIELDS[sender]
+    if counted_fields.intersection(update_fields):
+        for project_id in set(queryset.values_list(project_id_field, flat=True)):
+            _batch_invalidate_project_stats(Project, project_id)
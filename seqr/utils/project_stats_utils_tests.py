@@ -0,0 +1,111 @@
+import json
+import mock
+from django.test import TestCase
+
+from seqr.models import Family, Individual, Sample
+from seqr.utils.project_stats_utils import get_project_stats, invalidate_project_stats, \
+    _invalidate_family_project_stats
+
+REDIS_CACHE = {}
+MOCK_REDIS = mock.MagicMock()
+MOCK_REDIS.mget.side_effect = lambda keys: [REDIS_CACHE.get(key) for key in keys]
+MOCK_REDIS.set.side_effect = lambda key, value, **kwargs: REDIS_CACHE.update({key: value})
+MOCK_REDIS.delete.side_effect = lambda *keys: [REDIS_CACHE.pop(key, None) for key in keys]
+MOCK_REDIS.pipeline.return_value = MOCK_REDIS
+
+PROJECT_1_STATS = {
+    'numFamilies': 11,
+    'numIndividuals': 14,
+    'numVariantTags': 4,
+    'analysisStatusCounts': {'Q': 11},
+    'sampleTypeCounts': {'WES': 13, 'RNA': 1},
+    'activeSampleCounts': {'WES__VARIANTS': 7, 'WES__SV': 3, 'WGS__MITO': 1, 'RNA__VARIANTS': 1},
+}
+
+
+def _cached_project_keys():
+    return {key for key in REDIS_CACHE.keys() if key.startswith('project_stats__')}
+
+
+@mock.patch('seqr.utils.redis_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
+class ProjectStatsUtilsTest(TestCase):
+    fixtures = ['users', '1kg_project']
+
+    def setUp(self):
+        REDIS_CACHE.clear()
+
+    def test_get_project_stats(self):
+        with self.assertNumQueries(5):
+            stats = get_project_stats([1, 2])
+        self.assertDictEqual(stats[1], PROJECT_1_STATS)
+        self.assertDictEqual(stats[2], {
+            'numFamilies': 0, 'numIndividuals': 0, 'numVariantTags': 0, 'analysisStatusCounts': {},
+            'sampleTypeCounts': {}, 'activeSampleCounts': {},
+        })
+        self.assertDictEqual(json.loads(REDIS_CACHE['project_stats__1']), PROJECT_1_STATS)
+
+        # Cached counts are not recomputed
+        with self.assertNumQueries(0):
+            self.assertDictEqual(get_project_stats([1, 2])[1], PROJECT_1_STATS)
+
+        # Only uncached projects are counted
+        invalidate_project_stats([2])
+        self.assertSetEqual(_cached_project_keys(), {'project_stats__1'})
+        with self.assertNumQueries(5):
+            stats = get_project_stats([1, 2, 3])
+        self.assertEqual(stats[3]['numFamilies'], 2)
+        self.assertEqual(stats[3]['numIndividuals'], 3)
+
+        # Saving and deleting models invalidates the counts for their project
+        family = Family.objects.get(guid='F000001_1')
+        family.analysis_status = 'I'
+        with self.captureOnCommitCallbacks(execute=True):
+            family.save()
+        self.assertSetEqual(_cached_project_keys(), {'project_stats__2', 'project_stats__3'})
+        self.assertDictEqual(get_project_stats([1])[1]['analysisStatusCounts'], {'Q': 10, 'I': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            individual = Individual.objects.create(family_id=12, individual_id='NA21000', guid='I000030_na21000')
+        self.assertSetEqual(_cached_project_keys(), {'project_stats__1', 'project_stats__2'})
+        self.assertEqual(get_project_stats([3])[3]['numIndividuals'], 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            individual.delete()
+        self.assertSetEqual(_cached_project_keys(), {'project_stats__1', 'project_stats__2'})
+        self.assertEqual(get_project_stats([3])[3]['numIndividuals'], 3)
+
+        # Invalidations are batched until the transaction commits, and cached parent models are used to find the project
+        get_project_stats([1, 2, 3])
+        MOCK_REDIS.delete.reset_mock()
+        family = Family.objects.get(guid='F000001_1')
+        individuals = list(Individual.objects.filter(family=family))
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(len(individuals)):
+                for individual in individuals:
+                    individual.family = family
+                    individual.save()
+            self.assertSetEqual(_cached_project_keys(), {'project_stats__1', 'project_stats__2', 'project_stats__3'})
+        MOCK_REDIS.delete.assert_called_once_with('project_stats__1')
+
+        # Bulk updates invalidate the counts for their projects, only if a counted field is updated
+        get_project_stats([1, 2, 3])
+        MOCK_REDIS.delete.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            Family.bulk_update(None, {'assigned_analyst': None}, guid__in=['F000001_1', 'F000012_12'])
+        MOCK_REDIS.delete.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Family.bulk_update(None, {'analysis_status': 'Q'}, guid__in=['F000001_1', 'F000012_12'])
+        self.assertSetEqual(_cached_project_keys(), {'project_stats__2'})
+        self.assertDictEqual(get_project_stats([1])[1]['analysisStatusCounts'], {'Q': 11})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Sample.bulk_update(None, {'is_active': False}, individual__family__guid='F000001_1')
+        self.assertSetEqual(_cached_project_keys(), {'project_stats__2'})
+
+        # Fixture loads are skipped
+        MOCK_REDIS.delete.reset_mock()
+        _invalidate_family_project_stats(Family, family, raw=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            _invalidate_family_project_stats(Family, family, raw=True)
+        MOCK_REDIS.delete.assert_not_called()
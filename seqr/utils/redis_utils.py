@@ -1,31 +1,190 @@
 import json
 import logging
 import redis
+from time import time
+import zlib
 
-from settings import REDIS_SERVICE_HOSTNAME, REDIS_SERVICE_PORT
+from settings import REDIS_SERVICE_HOSTNAME, REDIS_SERVICE_PORT, REDIS_MAX_CONNECTIONS
 
 logger = logging.getLogger(__name__)
 
+REDIS_CONNECTION_POOL = None
+
+REDIS_STATS = {'hits': 0, 'misses': 0, 'errors': 0, 'requests': 0, 'latency_seconds': 0.0}
+
+# Compressed values are prefixed with an encoding version so the format can change without invalidating the cache.
+# Values with no prefix are plain JSON written before compression was supported
+COMPRESSED_VALUE_PREFIX = b'seqr-zlib-v1:'
+COMPRESSION_LEVEL = 3
+
+
+def _get_connection_pool():
+    global REDIS_CONNECTION_POOL
+    if REDIS_CONNECTION_POOL is None:
+        REDIS_CONNECTION_POOL = redis.ConnectionPool(
+            host=REDIS_SERVICE_HOSTNAME, port=REDIS_SERVICE_PORT, socket_connect_timeout=3,
+            max_connections=REDIS_MAX_CONNECTIONS,
+        )
+    return REDIS_CONNECTION_POOL
+
+
+def get_redis_client():
+    """Returns a redis client backed by a process-wide connection pool, so open connections are reused across calls"""
+    return redis.StrictRedis(connection_pool=_get_connection_pool())
+
+
+def get_redis_stats():
+    stats = dict(REDIS_STATS)
+    stats['avg_latency_ms'] = round(stats['latency_seconds'] * 1000 / stats['requests'], 3) if stats['requests'] else 0
+    return stats
+
+
+def reset_redis_stats():
+    REDIS_STATS.update({'hits': 0, 'misses': 0, 'errors': 0, 'requests': 0, 'latency_seconds': 0.0})
+
+
+def encode_cache_value(value, compress=False):
+    encoded = json.dumps(value)
+    if compress:
+        encoded = COMPRESSED_VALUE_PREFIX + zlib.compress(encoded.encode('utf-8'), COMPRESSION_LEVEL)
+    return encoded
+
+
+def decode_cache_value(value):
+    if isinstance(value, bytes) and value.startswith(COMPRESSED_VALUE_PREFIX):
+        value = zlib.decompress(value[len(COMPRESSED_VALUE_PREFIX):])
+    return json.loads(value)
+
+
+def _record_request(start_time, hits=0, misses=0):
+    REDIS_STATS['requests'] += 1
+    REDIS_STATS['latency_seconds'] += time() - start_time
+    REDIS_STATS['hits'] += hits
+    REDIS_STATS['misses'] += misses
+
+
+def _parse_cached_value(cache_key, value):
+    try:
+        start_time = time()
+        parsed = decode_cache_value(value)
+        if isinstance(value, bytes) and value.startswith(COMPRESSED_VALUE_PREFIX):
+            logger.info('Decoded {} ({} compressed bytes) in {:.3f} seconds'.format(
+                cache_key, len(value), time() - start_time))
+        return parsed
+    except (ValueError, zlib.error) as e:
+        logger.warning('Unable to fetch "{}" from redis:\t{}'.format(cache_key, str(e)))
+    return None
+
 
 def safe_redis_get_json(cache_key):
     try:
-        redis_client = redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, port=REDIS_SERVICE_PORT, socket_connect_timeout=3)
-        value = redis_client.get(cache_key)
+        start_time = time()
+        value = get_redis_client().get(cache_key)
+        _record_request(start_time, hits=1 if value else 0, misses=0 if value else 1)
         if value:
             logger.info('Loaded {} from redis'.format(cache_key))
-            return json.loads(value)
-    except ValueError as e:
-        logger.warning('Unable to fetch "{}" from redis:\t{}'.format(cache_key, str(e)))
+            return _parse_cached_value(cache_key, value)
     except Exception as e:
+        REDIS_STATS['errors'] += 1
         logger.error('Unable to connect to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
     return None
 
 
-def safe_redis_set_json(cache_key, value, expire=None):
+def safe_redis_get_json_bulk(cache_keys):
+    """Fetches multiple cached values in a single round trip. Returns a dict keyed by cache key, with None for misses"""
+    cache_keys = list(cache_keys)
+    results = {cache_key: None for cache_key in cache_keys}
+    if not cache_keys:
+        return results
+
     try:
-        redis_client = redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, port=REDIS_SERVICE_PORT, socket_connect_timeout=3)
-        redis_client.set(cache_key, json.dumps(value))
+        start_time = time()
+        values = get_redis_client().mget(cache_keys)
+        hits = [(cache_key, value) for cache_key, value in zip(cache_keys, values) if value]
+        _record_request(start_time, hits=len(hits), misses=len(cache_keys) - len(hits))
+        if hits:
+            logger.info('Loaded {} from redis'.format(', '.join([cache_key for cache_key, _ in hits])))
+        for cache_key, value in hits:
+            results[cache_key] = _parse_cached_value(cache_key, value)
+    except Exception as e:
+        REDIS_STATS['errors'] += 1
+        logger.error('Unable to connect to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
+    return results
+
+
+def safe_redis_set_json(cache_key, value, expire=None, compress=False):
+    try:
+        start_time = time()
+        encoded = encode_cache_value(value, compress=compress)
+        if compress:
+            logger.info('Caching {} ({} compressed bytes)'.format(cache_key, len(encoded)))
+        redis_client = get_redis_client()
         if expire:
-            redis_client.expire(cache_key, expire)
+            redis_client.set(cache_key, encoded, ex=expire)
+        else:
+            redis_client.set(cache_key, encoded)
+        _record_request(start_time)
     except Exception as e:
+        REDIS_STATS['errors'] += 1
         logger.error('Unable to write to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
+
+
+def safe_redis_set_json_bulk(values_by_key, expire=None, compress=False):
+    """Writes multiple values in a single pipelined round trip"""
+    if not values_by_key:
+        return
+
+    try:
+        start_time = time()
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for cache_key, value in values_by_key.items():
+            encoded = encode_cache_value(value, compress=compress)
+            if expire:
+                pipeline.set(cache_key, encoded, ex=expire)
+            else:
+                pipeline.set(cache_key, encoded)
+        pipeline.execute()
+        _record_request(start_time)
+    except Exception as e:
+        REDIS_STATS['errors'] += 1
+        logger.error('Unable to write to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
+
+
+def safe_redis_add_to_sets(members_by_key):
+    """Adds members to multiple redis sets in a single pipelined round trip"""
+    if not members_by_key:
+        return
+
+    try:
+        start_time = time()
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for cache_key, members in members_by_key.items():
+            pipeline.sadd(cache_key, *members)
+        pipeline.execute()
+        _record_request(start_time)
+    except Exception as e:
+        REDIS_STATS['errors'] += 1
+        logger.error('Unable to write to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
+
+
+def safe_redis_get_set(cache_key):
+    try:
+        start_time = time()
+        members = get_redis_client().smembers(cache_key)
+        _record_request(start_time, hits=1 if members else 0, misses=0 if members else 1)
+        return {member.decode() if isinstance(member, bytes) else member for member in members}
+    except Exception as e:
+        REDIS_STATS['errors'] += 1
+        logger.error('Unable to connect to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
+    return set()
+
+
+def safe_redis_delete(cache_keys):
+    if not cache_keys:
+        return
+
+    try:
+        get_redis_client().delete(*cache_keys)
+    except Exception as e:
+        REDIS_STATS['errors'] += 1
+        logger.error('Unable to delete from redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
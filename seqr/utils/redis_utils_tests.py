@@ -1,13 +1,18 @@
 import json
 import mock
+import zlib
 from unittest import TestCase
-from seqr.utils.redis_utils import safe_redis_set_json, safe_redis_get_json
+from seqr.utils.redis_utils import safe_redis_set_json, safe_redis_get_json, safe_redis_get_json_bulk, \
+    safe_redis_set_json_bulk, safe_redis_delete, safe_redis_add_to_sets, safe_redis_get_set, get_redis_stats, reset_redis_stats, encode_cache_value, decode_cache_value
 
 
 @mock.patch('seqr.utils.redis_utils.logger')
 @mock.patch('seqr.utils.redis_utils.redis.StrictRedis')
 class RedisUtilsTest(TestCase):
 
+    def setUp(self):
+        reset_redis_stats()
+
     def test_safe_redis_get_json(self, mock_redis, mock_logger):
         # test with valid json
         mock_redis.return_value.get.side_effect = lambda key: json.dumps({key: 'test'})
@@ -39,6 +44,40 @@ class RedisUtilsTest(TestCase):
         mock_logger.warning.assert_not_called()
         mock_logger.error.assert_called_with('Unable to connect to redis host localhost: invalid redis')
 
+        stats = get_redis_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['requests'], 3)
+
+        # test all calls share a single connection pool
+        pools = {call.kwargs['connection_pool'] for call in mock_redis.call_args_list}
+        self.assertEqual(len(pools), 1)
+
+    def test_safe_redis_get_json_bulk(self, mock_redis, mock_logger):
+        self.assertDictEqual(safe_redis_get_json_bulk([]), {})
+        mock_redis.return_value.mget.assert_not_called()
+
+        mock_redis.return_value.mget.side_effect = lambda keys: [
+            json.dumps({'a': 1}), None, 'invalid']
+        self.assertDictEqual(safe_redis_get_json_bulk(['key_1', 'key_2', 'key_3']), {
+            'key_1': {'a': 1}, 'key_2': None, 'key_3': None,
+        })
+        mock_redis.return_value.mget.assert_called_with(['key_1', 'key_2', 'key_3'])
+        mock_logger.info.assert_called_with('Loaded key_1, key_3 from redis')
+        self.assertEqual(mock_logger.warning.call_args.args[0].split('\t')[0], 'Unable to fetch "key_3" from redis:')
+
+        stats = get_redis_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['requests'], 1)
+
+        # test with redis connection error
+        mock_logger.reset_mock()
+        mock_redis.side_effect = Exception('invalid redis')
+        self.assertDictEqual(safe_redis_get_json_bulk(['key_1']), {'key_1': None})
+        mock_logger.error.assert_called_with('Unable to connect to redis host localhost: invalid redis')
+
     def test_safe_redis_set_json(self, mock_redis, mock_logger): # pylint: disable=no-self-use
         safe_redis_set_json('test_key', {'a': 1})
         mock_redis.return_value.set.assert_called_with('test_key', '{"a": 1}')
@@ -46,8 +85,8 @@ class RedisUtilsTest(TestCase):
         mock_logger.error.assert_not_called()
 
         safe_redis_set_json('test_key', {'a': 1}, expire=100)
-        mock_redis.return_value.set.assert_called_with('test_key', '{"a": 1}')
-        mock_redis.return_value.expire.assert_called_with('test_key', 100)
+        mock_redis.return_value.set.assert_called_with('test_key', '{"a": 1}', ex=100)
+        mock_redis.return_value.expire.assert_not_called()
         mock_logger.error.assert_not_called()
 
         # test with redis connection error
@@ -55,3 +94,91 @@ class RedisUtilsTest(TestCase):
         mock_redis.side_effect = Exception('invalid redis')
         safe_redis_set_json('test_key', {'a': 1})
         mock_logger.error.assert_called_with('Unable to write to redis host localhost: invalid redis')
+
+    def test_safe_redis_set_json_bulk(self, mock_redis, mock_logger):
+        mock_pipeline = mock_redis.return_value.pipeline.return_value
+        safe_redis_set_json_bulk({})
+        mock_redis.return_value.pipeline.assert_not_called()
+
+        safe_redis_set_json_bulk({'key_1': {'a': 1}, 'key_2': [1, 2]})
+        mock_redis.return_value.pipeline.assert_called_with(transaction=False)
+        mock_pipeline.set.assert_has_calls([mock.call('key_1', '{"a": 1}'), mock.call('key_2', '[1, 2]')])
+        mock_pipeline.execute.assert_called_once()
+
+        safe_redis_set_json_bulk({'key_1': {'a': 1}}, expire=100)
+        mock_pipeline.set.assert_called_with('key_1', '{"a": 1}', ex=100)
+        mock_logger.error.assert_not_called()
+
+        # test with redis connection error
+        mock_pipeline.execute.side_effect = Exception('invalid redis')
+        safe_redis_set_json_bulk({'key_1': {'a': 1}})
+        mock_logger.error.assert_called_with('Unable to write to redis host localhost: invalid redis')
+        self.assertEqual(get_redis_stats()['errors'], 1)
+
+    def test_safe_redis_sets(self, mock_redis, mock_logger):
+        mock_pipeline = mock_redis.return_value.pipeline.return_value
+        safe_redis_add_to_sets({})
+        mock_redis.return_value.pipeline.assert_not_called()
+
+        safe_redis_add_to_sets({'key_1': ['a', 'b'], 'key_2': ['c']})
+        mock_redis.return_value.pipeline.assert_called_with(transaction=False)
+        mock_pipeline.sadd.assert_has_calls([mock.call('key_1', 'a', 'b'), mock.call('key_2', 'c')])
+        mock_pipeline.execute.assert_called_once()
+
+        mock_redis.return_value.smembers.return_value = {b'a', b'b'}
+        self.assertSetEqual(safe_redis_get_set('key_1'), {'a', 'b'})
+        mock_redis.return_value.smembers.assert_called_with('key_1')
+        mock_logger.error.assert_not_called()
+
+        # test with redis connection error
+        mock_pipeline.execute.side_effect = Exception('invalid redis')
+        safe_redis_add_to_sets({'key_1': ['a']})
+        mock_logger.error.assert_called_with('Unable to write to redis host localhost: invalid redis')
+
+        mock_redis.return_value.smembers.side_effect = Exception('invalid redis')
+        self.assertSetEqual(safe_redis_get_set('key_1'), set())
+        mock_logger.error.assert_called_with('Unable to connect to redis host localhost: invalid redis')
+        self.assertEqual(get_redis_stats()['errors'], 2)
+
+    def test_safe_redis_delete(self, mock_redis, mock_logger):
+        safe_redis_delete([])
+        mock_redis.return_value.delete.assert_not_called()
+
+        safe_redis_delete(['key_1', 'key_2'])
+        mock_redis.return_value.delete.assert_called_with('key_1', 'key_2')
+        mock_logger.error.assert_not_called()
+
+        # test with redis connection error
+        mock_redis.return_value.delete.side_effect = Exception('invalid redis')
+        safe_redis_delete(['key_1'])
+        mock_logger.error.assert_called_with('Unable to delete from redis host localhost: invalid redis')
+
+    def test_compressed_values(self, mock_redis, mock_logger):
+        value = {'all_results': [{'variantId': '1-248367227-TC-T', 'genotypes': {}}] * 100, 'total_results': 100}
+
+        encoded = encode_cache_value(value, compress=True)
+        self.assertTrue(encoded.startswith(b'seqr-zlib-v1:'))
+        self.assertLess(len(encoded), len(json.dumps(value)))
+        self.assertDictEqual(decode_cache_value(encoded), value)
+        # Uncompressed JSON entries, including those written before compression was supported, are still decoded
+        self.assertDictEqual(decode_cache_value(json.dumps(value)), value)
+        self.assertDictEqual(decode_cache_value(json.dumps(value).encode('utf-8')), value)
+
+        safe_redis_set_json('test_key', value, expire=100, compress=True)
+        mock_redis.return_value.set.assert_called_with('test_key', encoded, ex=100)
+        mock_logger.info.assert_called_with('Caching test_key ({} compressed bytes)'.format(len(encoded)))
+
+        mock_redis.return_value.get.side_effect = lambda key: encoded
+        self.assertDictEqual(safe_redis_get_json('test_key'), value)
+        self.assertRegex(
+            mock_logger.info.call_args.args[0],
+            r'Decoded test_key \({} compressed bytes\) in \d+\.\d+ seconds'.format(len(encoded)))
+
+        mock_redis.return_value.get.side_effect = lambda key: json.dumps(value)
+        self.assertDictEqual(safe_redis_get_json('test_key'), value)
+        mock_logger.info.assert_called_with('Loaded test_key from redis')
+
+        # test with corrupted compressed data
+        mock_redis.return_value.get.side_effect = lambda key: b'seqr-zlib-v1:' + zlib.compress(b'{"a": 1}')[:-4]
+        self.assertIsNone(safe_redis_get_json('test_key'))
+        self.assertEqual(mock_logger.warning.call_args.args[0].split('\t')[0], 'Unable to fetch "test_key" from redis:')
@@ -1,10 +1,11 @@
 """API that generates auto-complete suggestions for the search bar in the header of seqr pages"""
-from django.db.models import F, Q, Case, When, Value, ExpressionWrapper, BooleanField, CharField
+from django.db.models import F, Q, Case, When, Value, CharField
 from django.db.models.functions import Cast, Coalesce, Concat, Left, Length, NullIf, Replace
 from django.views.decorators.http import require_GET
 
 from reference_data.models import Omim, HumanPhenotypeOntology
-from seqr.utils.gene_utils import get_queried_genes
+from seqr.utils.autocomplete_utils import AutocompleteIndex
+from seqr.utils.gene_utils import get_queried_genes, get_reference_data_index
 from seqr.views.utils.json_utils import create_json_response, _to_title_case
 from seqr.views.utils.permissions_utils import get_project_guids_user_can_view, login_and_policies_required
 from seqr.models import Project, Family, Individual, AnalysisGroup, ProjectCategory
@@ -16,6 +17,9 @@ MAX_STRING_LENGTH = 100
 
 FUZZY_MATCH_CHARS = ['-', '_', '.']
 
+OMIM_AUTOCOMPLETE_INDEX_KEY = 'omim_autocomplete_index'
+HPO_AUTOCOMPLETE_INDEX_KEY = 'hpo_autocomplete_index'
+
 
 def _get_matching_objects(query, project_guids, object_cls, core_fields, href_expression, description_content=None,
                           project_field=None, select_related_project=True, exclude_criteria=None):
@@ -151,42 +155,48 @@ def _get_matching_genes(query, *args):
     return result
 
 
+def _build_omim_autocomplete_index():
+    return AutocompleteIndex(
+        Omim.objects.filter(phenotype_mim_number__isnull=False).values(
+            'phenotype_mim_number', 'phenotype_description').order_by('phenotype_description'),
+        fields=['phenotype_mim_number', 'phenotype_description'],
+    )
+
+
 def _get_matching_omim(query, *args):
     """Returns OMIM records that match the given query string"""
-    records = Omim.objects.filter(
-        Q(phenotype_mim_number__icontains=query) | Q(phenotype_description__icontains=query)
-    ).filter(phenotype_mim_number__isnull=False).annotate(
-        description_start=ExpressionWrapper(Q(phenotype_description__istartswith=query), output_field=BooleanField()),
-        mim_number_start=ExpressionWrapper(Q(phenotype_mim_number__istartswith=query), output_field=BooleanField()),
-    ).only('phenotype_mim_number', 'phenotype_description').order_by(
-        '-description_start', '-mim_number_start', 'phenotype_description').distinct()[:MAX_RESULTS_PER_CATEGORY]
+    index = get_reference_data_index(OMIM_AUTOCOMPLETE_INDEX_KEY, _build_omim_autocomplete_index)
+    records = index.search(
+        query, MAX_RESULTS_PER_CATEGORY, prefix_fields=['phenotype_description', 'phenotype_mim_number'])
     result = []
     for record in records:
         result.append({
-            'key': record.phenotype_mim_number,
-            'title': record.phenotype_description,
-            'description': '({})'.format(record.phenotype_mim_number) if record.phenotype_mim_number else None,
+            'key': record['phenotype_mim_number'],
+            'title': record['phenotype_description'],
+            'description': '({})'.format(record['phenotype_mim_number']) if record['phenotype_mim_number'] else None,
         })
 
     return result
 
 
+def _build_hpo_autocomplete_index():
+    return AutocompleteIndex(
+        HumanPhenotypeOntology.objects.values('hpo_id', 'name', 'category_id').order_by('name'),
+        fields=['hpo_id', 'name'],
+    )
+
+
 def _get_matching_hpo_terms(query, *args):
     """Returns OMIM records that match the given query string"""
-    records = HumanPhenotypeOntology.objects.filter(
-        Q(hpo_id__icontains=query) | Q(name__icontains=query)
-    ).annotate(
-        name_start=ExpressionWrapper(Q(name__istartswith=query), output_field=BooleanField()),
-        hpo_id_start=ExpressionWrapper(Q(hpo_id__istartswith=query), output_field=BooleanField()),
-    ).only('hpo_id', 'name', 'category_id').order_by(
-        '-name_start', '-hpo_id_start', 'name').distinct()[:MAX_RESULTS_PER_CATEGORY]
+    index = get_reference_data_index(HPO_AUTOCOMPLETE_INDEX_KEY, _build_hpo_autocomplete_index)
+    records = index.search(query, MAX_RESULTS_PER_CATEGORY, prefix_fields=['name', 'hpo_id'])
     result = []
     for record in records:
         result.append({
-            'key': record.hpo_id,
-            'title': record.name,
-            'description': '({})'.format(record.hpo_id),
-            'category': record.category_id,
+            'key': record['hpo_id'],
+            'title': record['name'],
+            'description': '({})'.format(record['hpo_id']),
+            'category': record['category_id'],
         })
 
     return result
@@ -1,6 +1,11 @@
 import mock
+from django.db.models import Q, ExpressionWrapper, BooleanField
+from django.test import TestCase
 from django.urls.base import reverse
-from seqr.views.apis.awesomebar_api import awesomebar_autocomplete_handler
+
+from reference_data.models import HumanPhenotypeOntology
+from seqr.utils.gene_utils import REFERENCE_DATA_INDEX_CACHE
+from seqr.views.apis.awesomebar_api import awesomebar_autocomplete_handler, _get_matching_hpo_terms
 from seqr.views.utils.test_utils import AuthenticationTestCase, AnvilAuthenticationTestCase
 
 
@@ -163,3 +168,30 @@ class AnvilAwesomebarAPITest(AnvilAuthenticationTestCase, AwesomebarAPITest):
         self.mock_list_workspaces.assert_has_calls(calls)
         self.mock_get_ws_acl.assert_not_called()
         self.mock_get_ws_access_level.assert_not_called()
+
+
+@mock.patch('seqr.utils.gene_utils.safe_redis_get_json', lambda *args: None)
+class AwesomebarRankingTest(TestCase):
+    databases = '__all__'
+    fixtures = ['reference_data']
+
+    def test_hpo_term_ranking(self):
+        # Mixed case and punctuated names are ranked in the same order as by the database collation
+        HumanPhenotypeOntology.objects.bulk_create([
+            HumanPhenotypeOntology(hpo_id='HP:990000{}'.format(i), name=name) for i, name in enumerate([
+                'abnormal gait', 'Abnormal-Gait', "Abnormal's gait", 'ABNORMAL GAIT, mild', '(Abnormal) gait',
+                'Gait, abnormal', 'gait Abnormality', 'Abnormal_gait',
+            ])
+        ])
+        REFERENCE_DATA_INDEX_CACHE.clear()
+
+        for query in ['abnormal', 'AbNoRmAl G', 'gait', 'l g', '(', 'HP:99']:
+            db_ranked_hpo_ids = list(HumanPhenotypeOntology.objects.filter(
+                Q(hpo_id__icontains=query) | Q(name__icontains=query)
+            ).annotate(
+                name_start=ExpressionWrapper(Q(name__istartswith=query), output_field=BooleanField()),
+                hpo_id_start=ExpressionWrapper(Q(hpo_id__istartswith=query), output_field=BooleanField()),
+            ).order_by('-name_start', '-hpo_id_start', 'name').values_list('hpo_id', flat=True)[:10])
+            with mock.patch('seqr.views.apis.awesomebar_api.MAX_RESULTS_PER_CATEGORY', 10):
+                hpo_ids = [term['key'] for term in _get_matching_hpo_terms(query)]
+            self.assertListEqual(hpo_ids, db_ranked_hpo_ids, query)
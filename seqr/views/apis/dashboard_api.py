@@ -1,9 +1,8 @@
 """
 APIs used by the main seqr dashboard page
 """
-from django.db import models
-
-from seqr.models import ProjectCategory, Sample, Family, Project
+from seqr.models import ProjectCategory, Project
+from seqr.utils.project_stats_utils import get_project_stats
 from seqr.views.utils.json_utils import create_json_response
 from seqr.views.utils.orm_to_json_utils import get_json_for_projects
 from seqr.views.utils.permissions_utils import get_project_guids_user_can_view, login_and_policies_required
@@ -38,33 +37,20 @@ def _get_projects_json(user):
         return {}
 
     projects = Project.objects.filter(guid__in=project_guids)
-    projects_with_counts = projects.annotate(
-        models.Count('family', distinct=True), models.Count('family__individual', distinct=True),
-        models.Count('family__savedvariant', distinct=True))
-
     projects_by_guid = {p['projectGuid']: p for p in get_json_for_projects(projects, user=user)}
-    for project in projects_with_counts:
-        projects_by_guid[project.guid]['numFamilies'] = project.family__count
-        projects_by_guid[project.guid]['numIndividuals'] = project.family__individual__count
-        projects_by_guid[project.guid]['numVariantTags'] = project.family__savedvariant__count
-
-    analysis_status_counts = Family.objects.filter(project__in=projects).values(
-        'project__guid', 'analysis_status').annotate(count=models.Count('*'))
-    for agg in analysis_status_counts:
-        project_guid = agg['project__guid']
-        if 'analysisStatusCounts' not in projects_by_guid[project_guid]:
-            projects_by_guid[project_guid]['analysisStatusCounts'] = {}
-        projects_by_guid[project_guid]['analysisStatusCounts'][agg['analysis_status']] = agg['count']
-
-    sample_type_status_counts = Sample.objects.filter(individual__family__project__in=projects, dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS
-    ).values(
-        'individual__family__project__guid', 'sample_type',
-    ).annotate(count=models.Count('individual_id', distinct=True))
-    for agg in sample_type_status_counts:
-        project_guid = agg['individual__family__project__guid']
-        if 'sampleTypeCounts' not in projects_by_guid[project_guid]:
-            projects_by_guid[project_guid]['sampleTypeCounts'] = {}
-        projects_by_guid[project_guid]['sampleTypeCounts'][agg['sample_type']] = agg['count']
+
+    project_guids_by_id = dict(projects.values_list('id', 'guid'))
+    for project_id, stats in get_project_stats(list(project_guids_by_id.keys())).items():
+        project_json = projects_by_guid[project_guids_by_id[project_id]]
+        project_json.update({
+            'numFamilies': stats['numFamilies'],
+            'numIndividuals': stats['numIndividuals'],
+            'numVariantTags': stats['numVariantTags'],
+        })
+        if stats['analysisStatusCounts']:
+            project_json['analysisStatusCounts'] = stats['analysisStatusCounts']
+        if stats['sampleTypeCounts']:
+            project_json['sampleTypeCounts'] = stats['sampleTypeCounts']
 
     return projects_by_guid
 
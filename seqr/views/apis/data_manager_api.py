@@ -1,11 +1,11 @@
 import base64
 from collections import defaultdict
 from datetime import datetime
-import gzip
 import json
 import os
 import re
 import requests
+import shutil
 import urllib3
 
 from django.contrib.postgres.aggregates import ArrayAgg
@@ -14,11 +14,14 @@ from django.http.response import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from requests.exceptions import ConnectionError as RequestConnectionError
 
-from seqr.utils.elasticsearch.utils import get_es_client, get_index_metadata
+from seqr.utils.elasticsearch.utils import get_es_client, get_index_metadata, invalidate_index_metadata, \
+    get_es_client_pool_stats
 from seqr.utils.file_utils import file_iter, does_file_exist
 from seqr.utils.logging_utils import SeqrLogger
+from seqr.utils.redis_utils import get_redis_stats
 
-from seqr.views.utils.dataset_utils import load_rna_seq_outlier, load_rna_seq_tpm
+from seqr.views.utils.dataset_utils import load_rna_seq_outlier, load_rna_seq_tpm, copy_rna_seq_sample_data, \
+    get_staged_rna_seq_sample_file
 from seqr.views.utils.file_utils import parse_file, get_temp_upload_directory, load_uploaded_file
 from seqr.views.utils.json_utils import create_json_response, _to_camel_case
 from seqr.views.utils.permissions_utils import data_manager_required
@@ -56,6 +59,8 @@ def elasticsearch_status(request):
         'indices': indices,
         'diskStats': list(disk_status.values()),
         'nodeStats': list(node_stats.values()),
+        'clientPoolStats': get_es_client_pool_stats(),
+        'redisStats': {_to_camel_case(key): value for key, value in get_redis_stats().items()},
         'errors': errors,
     })
 
@@ -118,6 +123,7 @@ def delete_index(request):
 
     client = get_es_client()
     client.indices.delete(index)
+    invalidate_index_metadata(index)
     updated_indices, _ = _get_es_indices(client)
 
     return create_json_response({'indices': updated_indices})
@@ -353,18 +359,21 @@ def update_rna_seq(request):
     if uploaded_mapping_file_id:
         mapping_file = load_uploaded_file(uploaded_mapping_file_id)
 
+    # Each sample's data is staged in its own file, so samples can be loaded independently without scanning the others
+    file_name = f'rna_sample_data__{data_type}__{datetime.now().isoformat()}'
+    staging_dir = os.path.join(get_temp_upload_directory(), file_name)
+    os.makedirs(staging_dir, exist_ok=True)
     try:
         load_func = RNA_DATA_TYPE_CONFIGS[data_type]['load_func']
         samples_to_load, info, warnings = load_func(
-            file_path, user=request.user, mapping_file=mapping_file, ignore_extra_samples=request_json.get('ignoreExtraSamples'))
+            file_path, staging_dir, user=request.user, mapping_file=mapping_file,
+            ignore_extra_samples=request_json.get('ignoreExtraSamples'))
     except ValueError as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
         return create_json_response({'error': str(e)}, status=400)
-
-    # Save sample data for loading
-    file_name = f'rna_sample_data__{data_type}__{datetime.now().isoformat()}.json.gz'
-    with gzip.open(os.path.join(get_temp_upload_directory(), file_name), 'wt') as f:
-        for sample, sample_data in samples_to_load.items():
-            f.write(f'{sample.guid}\t\t{json.dumps(sample_data)}\n')
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
 
     return create_json_response({
         'info': info,
@@ -374,27 +383,88 @@ def update_rna_seq(request):
     })
 
 
+def _get_rna_seq_staging_dir(file_name, data_type):
+    # The staging directory is removed after loading, so only directories created by update_rna_seq are allowed
+    upload_directory = os.path.realpath(get_temp_upload_directory())
+    staging_dir = os.path.realpath(os.path.join(upload_directory, file_name))
+    if file_name != os.path.basename(file_name) or not file_name.startswith(f'rna_sample_data__{data_type}__') or \
+            os.path.dirname(staging_dir) != upload_directory:
+        raise ValueError(f'Invalid RNA-seq staging file: {file_name}')
+    return staging_dir
+
+
+def _load_rna_seq_sample(sample, staging_dir, model_cls, user):
+    sample_file = get_staged_rna_seq_sample_file(staging_dir, sample.guid)
+    num_created = copy_rna_seq_sample_data(model_cls, sample, sample_file)
+    logger.info(f'create {num_created} {model_cls.__name__}', user, db_update={
+        'dbEntity': model_cls.__name__, 'numEntities': num_created, 'parentEntityIds': [sample.guid], 'updateType': 'bulk_create',
+    })
+    # Staged files are removed once they are loaded, so retried loads only load the remaining samples
+    os.remove(sample_file)
+
+
+def _get_loaded_rna_seq_sample_ids(model_cls, samples):
+    return set(model_cls.objects.filter(sample__in=samples).values_list('sample_id', flat=True).distinct())
+
+
+def _remove_rna_seq_staged_file(staging_dir, sample_guid):
+    sample_file = get_staged_rna_seq_sample_file(staging_dir, sample_guid)
+    if os.path.isfile(sample_file):
+        os.remove(sample_file)
+
+
 @data_manager_required
 def load_rna_seq_sample_data(request, sample_guid):
     sample = Sample.objects.get(guid=sample_guid)
     logger.info(f'Loading outlier data for {sample.sample_id}', request.user)
 
     request_json = json.loads(request.body)
-    file_name = request_json['fileName']
     data_type = request_json['dataType']
-    with gzip.open(os.path.join(get_temp_upload_directory(), file_name), 'rt') as f:
-        row = next(line for line in f if line.split('\t\t')[0] == sample_guid)
-        data_by_gene = json.loads(row.split('\t\t')[1])
-
     model_cls = RNA_DATA_TYPE_CONFIGS[data_type]['model_class']
-    models = model_cls.objects.bulk_create([model_cls(sample=sample, **data) for data in data_by_gene.values()])
-    logger.info(f'create {len(models)} {model_cls.__name__}', request.user, db_update={
-        'dbEntity': model_cls.__name__, 'numEntities': len(models), 'parentEntityIds': [sample_guid], 'updateType': 'bulk_create',
-    })
+    try:
+        staging_dir = _get_rna_seq_staging_dir(request_json['fileName'], data_type)
+    except ValueError as e:
+        return create_json_response({'error': str(e)}, status=400)
+
+    if _get_loaded_rna_seq_sample_ids(model_cls, [sample]):
+        logger.info(f'Skipped loading {model_cls.__name__} for {sample.sample_id}, which is already loaded', request.user)
+        _remove_rna_seq_staged_file(staging_dir, sample_guid)
+    else:
+        _load_rna_seq_sample(sample, staging_dir, model_cls, request.user)
+
+    # The staging directory is removed once all of its samples are loaded
+    if os.path.isdir(staging_dir) and not os.listdir(staging_dir):
+        os.rmdir(staging_dir)
 
     return create_json_response({'success': True})
 
 
+@data_manager_required
+def load_rna_seq_samples(request):
+    request_json = json.loads(request.body)
+    data_type = request_json['dataType']
+    model_cls = RNA_DATA_TYPE_CONFIGS[data_type]['model_class']
+    try:
+        staging_dir = _get_rna_seq_staging_dir(request_json['fileName'], data_type)
+    except ValueError as e:
+        return create_json_response({'error': str(e)}, status=400)
+
+    sample_guids = sorted(sample_file.split('.')[0] for sample_file in os.listdir(staging_dir))
+    samples = Sample.objects.filter(guid__in=sample_guids).order_by('guid')
+    # Samples loaded individually or by an earlier partial load are skipped, so a failed load can be retried
+    loaded_sample_ids = _get_loaded_rna_seq_sample_ids(model_cls, samples)
+    if loaded_sample_ids:
+        logger.info(f'Skipped loading {len(loaded_sample_ids)} already loaded RNA-seq samples', request.user)
+    samples_to_load = [sample for sample in samples if sample.id not in loaded_sample_ids]
+    logger.info(f'Loading {data_type} data for {len(samples_to_load)} RNA-seq samples', request.user)
+    for sample in samples_to_load:
+        _load_rna_seq_sample(sample, staging_dir, model_cls, request.user)
+
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return create_json_response({'success': True, 'sampleGuids': [sample.guid for sample in samples_to_load]})
+
+
 # Hop-by-hop HTTP response headers shouldn't be forwarded.
 # More info at: http://www.w3.org/Protocols/rfc2616/rfc2616-sec13.html#sec13.5.1
 EXCLUDE_HTTP_RESPONSE_HEADERS = {
@@ -2,11 +2,14 @@ from datetime import datetime
 from django.urls.base import reverse
 import json
 import mock
+import os
 from requests import HTTPError
 import responses
+import shutil
+import tempfile
 
 from seqr.views.apis.data_manager_api import elasticsearch_status, upload_qc_pipeline_output, delete_index, \
-    update_rna_seq, load_rna_seq_sample_data
+    update_rna_seq, load_rna_seq_sample_data, load_rna_seq_samples
 from seqr.views.utils.orm_to_json_utils import get_json_for_rna_seq_outliers
 from seqr.views.utils.test_utils import AuthenticationTestCase, urllib3_responses
 from seqr.models import Individual, RnaSeqOutlier, RnaSeqTpm, Sample
@@ -269,17 +272,9 @@ SAMPLE_SV_WGS_QC_DATA = [
 
 RNA_SAMPLE_GUID = 'S000150_na19675_d2'
 RNA_FILE_ID = 'gs://rna_data/new_muscle_samples.tsv.gz'
-SAMPLE_GENE_OUTLIER_DATA = {
-    'ENSG00000240361': {'gene_id': 'ENSG00000240361', 'p_value': '0.01', 'p_adjust': '0.13', 'z_score': '-3.1'},
-    'ENSG00000233750': {'gene_id': 'ENSG00000233750', 'p_value': '0.064', 'p_adjust': '0.0000057', 'z_score': '7.8'},
-}
-SAMPLE_GENE_TPM_DATA = {
-    'ENSG00000240361': {'gene_id': 'ENSG00000240361', 'tpm': '7.8'},
-    'ENSG00000233750': {'gene_id': 'ENSG00000233750', 'tpm': '0.064'},
-}
-RNA_OUTLIER_SAMPLE_DATA = [f'{RNA_SAMPLE_GUID}\t\t{json.dumps(SAMPLE_GENE_OUTLIER_DATA)}\n']
-RNA_TPM_SAMPLE_DATA = [f'{RNA_SAMPLE_GUID}\t\t{json.dumps(SAMPLE_GENE_TPM_DATA)}\n']
-RNA_FILENAME_TEMPLATE = 'rna_sample_data__{}__2020-04-15T00:00:00.json.gz'
+RNA_OUTLIER_SAMPLE_DATA = 'ENSG00000240361\t0.01\t0.13\t-3.1\nENSG00000233750\t0.064\t0.0000057\t7.8\n'
+RNA_TPM_SAMPLE_DATA = 'ENSG00000240361\t7.8\nENSG00000233750\t0.064\n'
+RNA_FILENAME_TEMPLATE = 'rna_sample_data__{}__2020-04-15T00:00:00'
 
 
 class DataManagerAPITest(AuthenticationTestCase):
@@ -302,7 +297,8 @@ class DataManagerAPITest(AuthenticationTestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         response_json = response.json()
-        self.assertSetEqual(set(response_json.keys()), {'indices', 'errors', 'diskStats', 'nodeStats'})
+        self.assertSetEqual(
+            set(response_json.keys()), {'indices', 'errors', 'diskStats', 'nodeStats', 'clientPoolStats', 'redisStats'})
 
         self.assertEqual(len(response_json['indices']), 6)
         self.assertDictEqual(response_json['indices'][0], TEST_INDEX_EXPECTED_DICT)
@@ -313,9 +309,16 @@ class DataManagerAPITest(AuthenticationTestCase):
 
         self.assertListEqual(response_json['diskStats'], EXPECTED_DISK_ALLOCATION)
         self.assertListEqual(response_json['nodeStats'], EXPECTED_NODE_STATS)
+        pool_stats = next(stats for stats in response_json['clientPoolStats'] if stats['timeout'] == 300)
+        self.assertEqual(pool_stats['nodes'], 1)
+        self.assertEqual(pool_stats['maxConnections'], 10)
+        self.assertSetEqual(
+            set(response_json['redisStats'].keys()),
+            {'hits', 'misses', 'errors', 'requests', 'latencySeconds', 'avgLatencyMs'})
 
     @urllib3_responses.activate
-    def test_delete_index(self):
+    @mock.patch('seqr.views.apis.data_manager_api.invalidate_index_metadata')
+    def test_delete_index(self, mock_invalidate_index_metadata):
         url = reverse(delete_index)
         self.check_data_manager_login(url)
 
@@ -324,6 +327,7 @@ class DataManagerAPITest(AuthenticationTestCase):
         self.assertDictEqual(
             response.json(), ({'error': 'Index "test_index" is still used by: 1kg project n\xe5me with uni\xe7\xf8de'}))
         self.assertEqual(len(urllib3_responses.calls), 0)
+        mock_invalidate_index_metadata.assert_not_called()
 
         urllib3_responses.add_json(
             '/_cat/indices?format=json&h=index,docs.count,store.size,creation.date.string', ES_CAT_INDICES)
@@ -341,6 +345,7 @@ class DataManagerAPITest(AuthenticationTestCase):
         self.assertDictEqual(response_json['indices'][4], TEST_SV_INDEX_EXPECTED_DICT)
 
         self.assertEqual(urllib3_responses.calls[0].request.method, 'DELETE')
+        mock_invalidate_index_metadata.assert_called_with('unused_index')
 
     @mock.patch('seqr.utils.file_utils.logger')
     @mock.patch('seqr.utils.file_utils.subprocess.Popen')
@@ -588,14 +593,21 @@ class DataManagerAPITest(AuthenticationTestCase):
         },
     }
 
+    def _set_temp_upload_directory(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        patcher = mock.patch('seqr.views.apis.data_manager_api.get_temp_upload_directory', lambda: temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return temp_dir.name
+
     @mock.patch('seqr.views.utils.dataset_utils.ANALYST_PROJECT_CATEGORY', 'analyst-projects')
     @mock.patch('seqr.views.apis.data_manager_api.datetime')
-    @mock.patch('seqr.views.apis.data_manager_api.os')
     @mock.patch('seqr.views.apis.data_manager_api.load_uploaded_file')
     @mock.patch('seqr.utils.file_utils.subprocess.Popen')
-    @mock.patch('seqr.views.apis.data_manager_api.gzip.open')
     @mock.patch('seqr.views.utils.dataset_utils.logger')
-    def test_update_rna_seq(self, mock_logger, mock_open, mock_subprocess, mock_load_uploaded_file, mock_os, mock_datetime):
+    def test_update_rna_seq(self, mock_logger, mock_subprocess, mock_load_uploaded_file, mock_datetime):
+        temp_dir = self._set_temp_upload_directory()
         url = reverse(update_rna_seq)
         self.check_data_manager_login(url)
 
@@ -608,7 +620,6 @@ class DataManagerAPITest(AuthenticationTestCase):
                 # Test errors
                 body = {'dataType': data_type, 'file': 'gs://rna_data/muscle_samples.tsv.gz'}
                 mock_datetime.now.return_value = datetime(2020, 4, 15)
-                mock_os.path.join.side_effect = lambda *args: '/'.join(args[1:])
                 mock_load_uploaded_file.return_value = [['a']]
                 mock_does_file_exist = mock.MagicMock()
                 mock_does_file_exist.wait.return_value = 1
@@ -643,6 +654,8 @@ class DataManagerAPITest(AuthenticationTestCase):
                 response = self.client.post(url, content_type='application/json', data=json.dumps(body))
                 self.assertEqual(response.status_code, 400)
                 self.assertDictEqual(response.json(), {'error': 'Unable to find matches for the following samples: NA19675_D3'})
+                # Data staged for a failed upload is removed
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, RNA_FILENAME_TEMPLATE.format(data_type))))
 
                 mapping_body = {'mappingFile': {'uploadedFileId': 'map.tsv'}}
                 mapping_body.update(body)
@@ -666,14 +679,9 @@ class DataManagerAPITest(AuthenticationTestCase):
                 self.assertEqual(model_cls.objects.count(), params['initial_model_count'])
 
                 # Test loading new data
-                mock_open.reset_mock()
                 mock_logger.reset_mock()
                 _set_file_iter_stdout([header] + params['new_data'])
                 mock_load_uploaded_file.return_value = [['NA19675_D2', 'NA19675_1']]
-                mock_writes = []
-                def mock_write(content):
-                    mock_writes.append(content)
-                mock_open.return_value.__enter__.return_value.write.side_effect = mock_write
                 body.update({'ignoreExtraSamples': True, 'mappingFile': {'uploadedFileId': 'map.tsv'}, 'file': RNA_FILE_ID})
                 response = self.client.post(url, content_type='application/json', data=json.dumps(body))
                 self.assertEqual(response.status_code, 200)
@@ -713,24 +721,42 @@ class DataManagerAPITest(AuthenticationTestCase):
 
                 # test correct file interactions
                 mock_subprocess.assert_called_with(f'gsutil cat {RNA_FILE_ID} | gunzip -c -q - ', stdout=-1, stderr=-2, shell=True)
-                mock_open.assert_called_with(file_name, 'wt')
-                self.assertListEqual(mock_writes, params['parsed_file_data'])
+                self.assertListEqual(os.listdir(os.path.join(temp_dir, file_name)), [f'{RNA_SAMPLE_GUID}.tsv'])
+                with open(os.path.join(temp_dir, file_name, f'{RNA_SAMPLE_GUID}.tsv')) as f:
+                    self.assertEqual(f.read(), params['parsed_file_data'])
+
+    def _write_staged_sample_data(self, temp_dir, file_name, sample_data):
+        os.makedirs(os.path.join(temp_dir, file_name), exist_ok=True)
+        with open(os.path.join(temp_dir, file_name, f'{RNA_SAMPLE_GUID}.tsv'), 'w') as f:
+            f.write(sample_data)
+
+    def _test_invalid_rna_seq_staging_file(self, url, temp_dir):
+        self._write_staged_sample_data(temp_dir, RNA_FILENAME_TEMPLATE.format('tpm'), '')
+        for file_name in ['', '..', '/tmp', RNA_FILENAME_TEMPLATE.format('outlier'), f'{RNA_FILENAME_TEMPLATE.format("tpm")}/..']:
+            response = self.client.post(url, content_type='application/json', data=json.dumps({
+                'fileName': file_name, 'dataType': 'tpm',
+            }))
+            self.assertEqual(response.status_code, 400)
+            self.assertDictEqual(response.json(), {'error': f'Invalid RNA-seq staging file: {file_name}'})
+        # Invalid requests do not remove any files
+        self.assertTrue(os.path.isdir(os.path.join(temp_dir, RNA_FILENAME_TEMPLATE.format('tpm'))))
+        shutil.rmtree(os.path.join(temp_dir, RNA_FILENAME_TEMPLATE.format('tpm')))
 
-    @mock.patch('seqr.views.apis.data_manager_api.os')
-    @mock.patch('seqr.views.apis.data_manager_api.gzip.open')
     @mock.patch('seqr.views.apis.data_manager_api.logger')
-    def test_load_rna_seq_sample_data(self, mock_logger, mock_open, mock_os):
-        mock_os.path.join.side_effect = lambda *args: '/'.join(args[1:])
+    def test_load_rna_seq_sample_data(self, mock_logger):
+        temp_dir = self._set_temp_upload_directory()
 
         url = reverse(load_rna_seq_sample_data, args=[RNA_SAMPLE_GUID])
         self.check_data_manager_login(url)
 
+        self._test_invalid_rna_seq_staging_file(url, temp_dir)
+
         for data_type, params in self.RNA_DATA_TYPE_PARAMS.items():
             with self.subTest(data_type):
                 model_cls = params['model_cls']
                 model_cls.objects.all().delete()
-                mock_open.return_value.__enter__.return_value.__iter__.return_value = params['parsed_file_data']
                 file_name = RNA_FILENAME_TEMPLATE.format(data_type)
+                self._write_staged_sample_data(temp_dir, file_name, params['parsed_file_data'])
 
                 response = self.client.post(url, content_type='application/json', data=json.dumps({
                     'fileName': file_name, 'dataType': data_type,
@@ -742,8 +768,6 @@ class DataManagerAPITest(AuthenticationTestCase):
                 self.assertEqual(models.count(), 2)
                 self.assertSetEqual({model.sample.guid for model in models}, {RNA_SAMPLE_GUID})
 
-                mock_open.assert_called_with(file_name, 'rt')
-
                 mock_logger.info.assert_has_calls([
                     mock.call('Loading outlier data for NA19675_D2', self.data_manager_user),
                     mock.call(f'create 2 {model_cls.__name__}', self.data_manager_user, db_update={
@@ -752,3 +776,68 @@ class DataManagerAPITest(AuthenticationTestCase):
                 ])
 
                 self.assertListEqual(params['get_models_json'](models), params['expected_models_json'])
+                # Loaded staged data is removed, and loading the sample again is skipped
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, file_name)))
+                self._write_staged_sample_data(temp_dir, file_name, params['parsed_file_data'])
+                mock_logger.reset_mock()
+                response = self.client.post(url, content_type='application/json', data=json.dumps({
+                    'fileName': file_name, 'dataType': data_type,
+                }))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(model_cls.objects.count(), 2)
+                mock_logger.info.assert_called_with(
+                    f'Skipped loading {model_cls.__name__} for NA19675_D2, which is already loaded', self.data_manager_user)
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, file_name)))
+
+    @mock.patch('seqr.views.apis.data_manager_api.logger')
+    def test_load_rna_seq_samples(self, mock_logger):
+        temp_dir = self._set_temp_upload_directory()
+
+        url = reverse(load_rna_seq_samples)
+        self.check_data_manager_login(url)
+
+        self._test_invalid_rna_seq_staging_file(url, temp_dir)
+
+        for data_type, params in self.RNA_DATA_TYPE_PARAMS.items():
+            with self.subTest(data_type):
+                model_cls = params['model_cls']
+                model_cls.objects.all().delete()
+                mock_logger.reset_mock()
+                file_name = RNA_FILENAME_TEMPLATE.format(data_type)
+                self._write_staged_sample_data(temp_dir, file_name, params['parsed_file_data'])
+                with open(os.path.join(temp_dir, file_name, 'S000000_missing.tsv'), 'w') as f:
+                    f.write(params['parsed_file_data'])
+
+                response = self.client.post(url, content_type='application/json', data=json.dumps({
+                    'fileName': file_name, 'dataType': data_type,
+                }))
+                self.assertEqual(response.status_code, 200)
+                self.assertDictEqual(response.json(), {'success': True, 'sampleGuids': [RNA_SAMPLE_GUID]})
+
+                models = model_cls.objects.all()
+                self.assertEqual(models.count(), 2)
+                self.assertSetEqual({model.sample.guid for model in models}, {RNA_SAMPLE_GUID})
+                self.assertListEqual(params['get_models_json'](models), params['expected_models_json'])
+
+                mock_logger.info.assert_has_calls([
+                    mock.call(f'Loading {data_type} data for 1 RNA-seq samples', self.data_manager_user),
+                    mock.call(f'create 2 {model_cls.__name__}', self.data_manager_user, db_update={
+                        'dbEntity':  model_cls.__name__, 'numEntities': 2, 'parentEntityIds': [RNA_SAMPLE_GUID], 'updateType': 'bulk_create',
+                    }),
+                ])
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, file_name)))
+
+                # Retrying a load skips samples which are already loaded
+                self._write_staged_sample_data(temp_dir, file_name, params['parsed_file_data'])
+                mock_logger.reset_mock()
+                response = self.client.post(url, content_type='application/json', data=json.dumps({
+                    'fileName': file_name, 'dataType': data_type,
+                }))
+                self.assertEqual(response.status_code, 200)
+                self.assertDictEqual(response.json(), {'success': True, 'sampleGuids': []})
+                self.assertEqual(model_cls.objects.count(), 2)
+                mock_logger.info.assert_has_calls([
+                    mock.call('Skipped loading 1 already loaded RNA-seq samples', self.data_manager_user),
+                    mock.call(f'Loading {data_type} data for 0 RNA-seq samples', self.data_manager_user),
+                ])
+                self.assertFalse(os.path.exists(os.path.join(temp_dir, file_name)))
@@ -5,6 +5,7 @@ from django.urls.base import reverse
 from io import StringIO
 
 from seqr.models import Sample, Family
+from seqr.utils.cache_utils import LocalCache
 from seqr.views.apis.dataset_api import add_variants_dataset_handler
 from seqr.views.utils.test_utils import urllib3_responses, AuthenticationTestCase, AnvilAuthenticationTestCase
 
@@ -37,6 +38,7 @@ MOCK_OPEN = mock.MagicMock()
 MOCK_FILE_ITER = MOCK_OPEN.return_value.__enter__.return_value.__iter__
 
 @mock.patch('seqr.utils.redis_utils.redis.StrictRedis', lambda **kwargs: MOCK_REDIS)
+@mock.patch('seqr.utils.elasticsearch.utils.INDEX_METADATA_LOCAL_CACHE', LocalCache(max_size=0))
 @mock.patch('seqr.utils.file_utils.open', MOCK_OPEN)
 class DatasetAPITest(object):
 
@@ -83,8 +85,8 @@ class DatasetAPITest(object):
         }))
         self.assertEqual(response.status_code, 200)
         MOCK_OPEN.assert_called_with('mapping.csv', 'r')
-        MOCK_REDIS.get.assert_called_with('index_metadata__test_index')
-        MOCK_REDIS.set.assert_called_with('index_metadata__test_index', '{"test_index": {"sampleType": "WES", "genomeVersion": "37", "sourceFilePath": "test_data.vcf", "fields": {"samples_num_alt_1": "keyword"}}}')
+        MOCK_REDIS.mget.assert_called_with(['index_metadata__test_index'])
+        MOCK_REDIS.pipeline.return_value.set.assert_called_with('index_metadata__test_index', '{"test_index": {"sampleType": "WES", "genomeVersion": "37", "sourceFilePath": "test_data.vcf", "fields": {"samples_num_alt_1": "keyword"}}}')
 
         response_json = response.json()
         self.assertSetEqual(set(response_json.keys()), {'samplesByGuid', 'individualsByGuid', 'familiesByGuid'})
@@ -8,9 +8,9 @@ from datetime import datetime
 from django.contrib.auth.models import User
 from django.db.models import prefetch_related_objects
 
-from reference_data.models import HumanPhenotypeOntology
 from seqr.models import Individual, Family, Sample, RnaSeqOutlier
 from seqr.utils.gene_utils import get_genes
+from seqr.utils.hpo_utils import get_hpo_ontology
 from seqr.views.utils.file_utils import save_uploaded_file, load_uploaded_file
 from seqr.views.utils.json_to_orm_utils import update_individual_from_json, update_model_from_json
 from seqr.views.utils.json_utils import create_json_response
@@ -574,7 +574,8 @@ def _parse_individual_hpo_terms(json_records, project, user):
     for record in json_records:
         all_hpo_terms.update(record.get(FEATURES_COL, []))
         all_hpo_terms.update(record.get(ABSENT_FEATURES_COL, []))
-    hpo_terms = set(HumanPhenotypeOntology.objects.filter(hpo_id__in=all_hpo_terms).values_list('hpo_id', flat=True))
+    hpo_ontology = get_hpo_ontology()
+    hpo_terms = {hpo_id for hpo_id in all_hpo_terms if hpo_id in hpo_ontology}
 
     individual_ids = [record[INDIVIDUAL_ID_COL] for record in json_records]
     individual_ids += ['{}_{}'.format(record[FAMILY_ID_COL], record[INDIVIDUAL_ID_COL])
@@ -772,7 +773,7 @@ def get_hpo_terms(request, hpo_parent_id):
 
     return create_json_response({
         hpo_parent_id: {
-            hpo.hpo_id: {'id': hpo.hpo_id, 'category': hpo.category_id, 'label': hpo.name}
-            for hpo in HumanPhenotypeOntology.objects.filter(parent_id=hpo_parent_id)
+            hpo['hpo_id']: {'id': hpo['hpo_id'], 'category': hpo['category_id'], 'label': hpo['name']}
+            for hpo in get_hpo_ontology().get_child_terms(hpo_parent_id)
         }
     })
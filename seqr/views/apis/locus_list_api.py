@@ -92,7 +92,7 @@ def create_locus_list_handler(request):
 
     return create_json_response({
         'locusListsByGuid': {locus_list.guid: get_json_for_locus_list(locus_list, request.user)},
-        'genesById': genes_by_id,
+        'genesById': get_genes(list(genes_by_id.keys())) if genes_by_id else {},
     })
 
 
@@ -113,7 +113,7 @@ def update_locus_list_handler(request, locus_list_guid):
 
     return create_json_response({
         'locusListsByGuid': {locus_list.guid: get_json_for_locus_list(locus_list, request.user)},
-        'genesById': genes_by_id or {},
+        'genesById': get_genes(list(genes_by_id.keys())) if genes_by_id else {},
     })
 
 
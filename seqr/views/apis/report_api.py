@@ -3,11 +3,13 @@ from copy import deepcopy
 
 from datetime import datetime, timedelta
 from dateutil import relativedelta as rdelta
-from django.db.models import Prefetch, Count
+from django.db.models import Prefetch
 from django.utils import timezone
 
 from seqr.utils.gene_utils import get_genes
+from seqr.utils.hpo_utils import get_hpo_ontology
 from seqr.utils.logging_utils import SeqrLogger
+from seqr.utils.project_stats_utils import get_project_stats
 from seqr.utils.xpos_utils import get_chrom_pos
 
 from seqr.views.utils.airtable_utils import AirtableSession
@@ -18,8 +20,9 @@ from seqr.views.utils.permissions_utils import analyst_required, get_project_and
     check_project_permissions
 
 from matchmaker.models import MatchmakerSubmission
-from seqr.models import Project, Family, VariantTag, VariantTagType, Sample, SavedVariant, Individual, FamilyNote
-from reference_data.models import Omim, HumanPhenotypeOntology
+from seqr.models import Project, Family, VariantTag, VariantTagType, Sample, SavedVariant, Individual, FamilyNote, \
+    ProjectCategory
+from reference_data.models import Omim
 
 from settings import ANALYST_PROJECT_CATEGORY
 
@@ -32,37 +35,23 @@ HEMI = 'Hemizygous'
 
 @analyst_required
 def seqr_stats(request):
-    internal_samples_counts = _get_sample_counts(
-        Sample.objects.filter(individual__family__project__projectcategory__name=ANALYST_PROJECT_CATEGORY))
-    external_samples_counts = _get_sample_counts(
-        Sample.objects.exclude(individual__family__project__projectcategory__name=ANALYST_PROJECT_CATEGORY))
-    grouped_sample_counts = defaultdict(dict)
-    for k, v in internal_samples_counts.items():
-        grouped_sample_counts[k]['internal'] = v
-    for k, v in external_samples_counts.items():
-        grouped_sample_counts[k]['external'] = v
+    project_ids = list(Project.objects.values_list('id', flat=True))
+    internal_project_ids = set(ProjectCategory.objects.filter(name=ANALYST_PROJECT_CATEGORY).values_list(
+        'projects__id', flat=True))
 
-    return create_json_response({
-        'projectsCount': {
-            'internal': Project.objects.filter(projectcategory__name=ANALYST_PROJECT_CATEGORY).count(),
-            'external': Project.objects.exclude(projectcategory__name=ANALYST_PROJECT_CATEGORY).count(),
-        },
-        'familiesCount': {
-            'internal': Family.objects.filter(project__projectcategory__name=ANALYST_PROJECT_CATEGORY).count(),
-            'external': Family.objects.exclude(project__projectcategory__name=ANALYST_PROJECT_CATEGORY).count(),
-        },
-        'individualsCount': {
-            'internal': Individual.objects.filter(family__project__projectcategory__name=ANALYST_PROJECT_CATEGORY).count(),
-            'external': Individual.objects.exclude(family__project__projectcategory__name=ANALYST_PROJECT_CATEGORY).count(),
-        },
-        'sampleCountsByType': grouped_sample_counts,
-    })
+    counts = {key: {'internal': 0, 'external': 0} for key in ['projectsCount', 'familiesCount', 'individualsCount']}
+    grouped_sample_counts = defaultdict(lambda: defaultdict(int))
+    for project_id, stats in get_project_stats(project_ids).items():
+        group = 'internal' if project_id in internal_project_ids else 'external'
+        counts['projectsCount'][group] += 1
+        counts['familiesCount'][group] += stats['numFamilies']
+        counts['individualsCount'][group] += stats['numIndividuals']
+        for sample_key, count in stats['activeSampleCounts'].items():
+            grouped_sample_counts[sample_key][group] += count
 
-def _get_sample_counts(sample_q):
-    samples_agg = sample_q.filter(is_active=True).values('sample_type', 'dataset_type').annotate(count=Count('*'))
-    return {
-        f'{sample_agg["sample_type"]}__{sample_agg["dataset_type"]}': sample_agg['count'] for sample_agg in samples_agg
-    }
+    counts['sampleCountsByType'] = grouped_sample_counts
+
+    return create_json_response(counts)
 
 
 # AnVIL metadata
@@ -204,7 +193,7 @@ def sample_metadata_export(request, project_guid):
         all_features.update(row['hpo_present'].split('|'))
         all_features.update(row['hpo_absent'].split('|'))
 
-    hpo_name_map = {hpo.hpo_id: hpo.name for hpo in HumanPhenotypeOntology.objects.filter(hpo_id__in=all_features)}
+    hpo_name_map = get_hpo_ontology().get_names(all_features)
     for row in rows:
         for hpo_key in ['hpo_present', 'hpo_absent']:
             if row[hpo_key]:
@@ -1327,9 +1316,7 @@ def _update_hpo_categories(rows, errors):
     for row in rows:
         all_features.update(row['features'])
 
-    hpo_term_to_category = {
-        hpo.hpo_id: hpo.category_id for hpo in HumanPhenotypeOntology.objects.filter(hpo_id__in=all_features)
-    }
+    hpo_term_to_category = get_hpo_ontology().get_category_ids(all_features)
 
     for row in rows:
         category_not_set_on_some_features = False
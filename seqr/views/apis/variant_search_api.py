@@ -6,16 +6,18 @@ from django.utils import timezone
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.exceptions import MultipleObjectsReturned, PermissionDenied
 from django.db.utils import IntegrityError
-from django.db.models import Q, prefetch_related_objects
+from django.db.models import Q, Count, prefetch_related_objects
 from math import ceil
 
 from reference_data.models import GENOME_VERSION_GRCh37
 from seqr.models import Project, Family, Individual, SavedVariant, VariantSearch, VariantSearchResults, ProjectCategory, \
     Sample
-from seqr.utils.elasticsearch.utils import get_es_variants, get_single_es_variant, get_es_variant_gene_counts
-from seqr.utils.elasticsearch.constants import XPOS_SORT_KEY, PATHOGENICTY_SORT_KEY, PATHOGENICTY_HGMD_SORT_KEY
+from seqr.utils.elasticsearch.utils import get_es_variants, get_single_es_variant, get_es_variant_gene_counts, \
+    has_search_cursors, InvalidSearchException
+from seqr.utils.elasticsearch.constants import XPOS_SORT_KEY, PATHOGENICTY_SORT_KEY, PATHOGENICTY_HGMD_SORT_KEY, \
+    MAX_VARIANTS
 from seqr.utils.xpos_utils import get_xpos
-from seqr.views.utils.export_utils import export_table
+from seqr.views.utils.export_utils import export_table, export_table_stream
 from seqr.utils.gene_utils import get_genes_for_variant_display
 from seqr.views.utils.json_utils import create_json_response
 from seqr.views.utils.json_to_orm_utils import update_model_from_json, get_or_create_model_from_json, \
@@ -234,6 +236,8 @@ VARIANT_SAMPLE_DATA = [
 ]
 
 MAX_FAMILIES_PER_ROW = 1000
+EXPORT_PAGE_SIZE = 1000
+STREAMING_EXPORT_FORMATS = {'tsv', 'json'}
 
 
 @login_and_policies_required
@@ -257,10 +261,69 @@ def export_variants_handler(request, search_hash):
 
     families = results_model.families.all()
     family_ids_by_guid = {family.guid: family.family_id for family in families}
+    file_format = request.GET.get('file_format', 'tsv')
+
+    if request.GET.get('stream') == 'true' and file_format in STREAMING_EXPORT_FORMATS:
+        return _stream_export_variants(results_model, families, family_ids_by_guid, search_hash, file_format, request.user)
 
     variants, _ = get_es_variants(results_model, page=1, load_all=True, user=request.user)
-    variants = _flatten_variants(variants)
+    variants = _split_export_variants(_flatten_variants(variants))
+    saved_variant_context = _get_export_saved_variant_context(variants, families)
+
+    max_families_per_variant = max([len(variant['familyGuids']) for variant in variants])
+    max_samples_per_variant = max([len(variant['genotypes']) for variant in variants])
+
+    rows = [
+        _get_variant_export_row(
+            variant, saved_variant_context, family_ids_by_guid, max_families_per_variant, max_samples_per_variant)
+        for variant in variants
+    ]
+    header = _get_variant_export_header(max_families_per_variant, max_samples_per_variant)
 
+    return export_table('search_results_{}'.format(search_hash), header, rows, file_format, titlecase_header=False)
+
+
+def _stream_export_variants(results_model, families, family_ids_by_guid, search_hash, file_format, user):
+    """
+    Pages through the search results and formats rows as each page is loaded, so only a single page of variants is held
+    in memory and the first rows are sent as soon as the first page is loaded. The header is sized from the searched
+    families with loaded samples and their individuals, which bound the families and genotypes in any row.
+    Searches that can be paged with search_after cursors are not limited to MAX_VARIANTS
+    """
+    variants, total_results = get_es_variants(results_model, page=1, num_results=EXPORT_PAGE_SIZE, user=user)
+    if total_results and int(total_results) >= int(MAX_VARIANTS) and not has_search_cursors(results_model):
+        raise InvalidSearchException('Too many variants to load. Please refine your search and try again')
+
+    family_sample_counts = sorted(
+        Sample.objects.filter(individual__family__in=families, is_active=True, elasticsearch_index__isnull=False).values(
+            'individual__family').annotate(num_individuals=Count('individual', distinct=True)).values_list(
+            'num_individuals', flat=True),
+        reverse=True)
+    max_families_per_variant = min(len(family_sample_counts), MAX_FAMILIES_PER_ROW)
+    max_samples_per_variant = sum(family_sample_counts[:MAX_FAMILIES_PER_ROW])
+
+    def _rows():
+        for page_variants in _get_export_pages(results_model, user, variants, total_results):
+            saved_variant_context = _get_export_saved_variant_context(page_variants, families)
+            for variant in page_variants:
+                yield _get_variant_export_row(
+                    variant, saved_variant_context, family_ids_by_guid, max_families_per_variant, max_samples_per_variant)
+
+    header = _get_variant_export_header(max_families_per_variant, max_samples_per_variant)
+    return export_table_stream('search_results_{}'.format(search_hash), header, _rows(), file_format)
+
+
+def _get_export_pages(results_model, user, variants, total_results):
+    page = 1
+    while variants:
+        yield _split_export_variants(_flatten_variants(variants))
+        if page * EXPORT_PAGE_SIZE >= (total_results or 0):
+            break
+        page += 1
+        variants, total_results = get_es_variants(results_model, page=page, num_results=EXPORT_PAGE_SIZE, user=user)
+
+
+def _get_export_saved_variant_context(variants, families):
     saved_variants, variants_by_id = _get_saved_variant_models(variants, families)
     json_saved_variants = get_json_for_saved_variants_with_tags(saved_variants, add_details=True)
 
@@ -274,59 +337,61 @@ def export_variants_handler(request, search_hash):
         saved_variants_by_variant_family[variant_key] = {
             family_guid: saved_variant['variantGuid'] for family_guid in saved_variant['familyGuids']
         }
+    return json_saved_variants, saved_variants_by_variant_family
 
-    if any(len(variant['familyGuids']) > MAX_FAMILIES_PER_ROW for variant in variants):
-        split_variants = []
-        for variant in variants:
-            if len(variant['familyGuids']) <= MAX_FAMILIES_PER_ROW:
-                split_variants.append(variant)
-                continue
-
-            num_split = ceil(len(variant['familyGuids']) / MAX_FAMILIES_PER_ROW)
-            gens_per_row = ceil(len(variant['genotypes']) / num_split)
-            gen_keys = list(variant['genotypes'].keys())
-            for i in range(num_split):
-                split_var = deepcopy(variant)
-                split_var['familyGuids'] = variant['familyGuids'][i*MAX_FAMILIES_PER_ROW:(i+1)*MAX_FAMILIES_PER_ROW]
-                split_gen = set(gen_keys[i*gens_per_row:(i+1)*gens_per_row])
-                split_var['genotypes'] = {k: v for k, v in variant['genotypes'].items() if k in split_gen}
-                split_variants.append(split_var)
-
-        variants = split_variants
 
-    max_families_per_variant = max([len(variant['familyGuids']) for variant in variants])
-    max_samples_per_variant = max([len(variant['genotypes']) for variant in variants])
+def _split_export_variants(variants):
+    if not any(len(variant['familyGuids']) > MAX_FAMILIES_PER_ROW for variant in variants):
+        return variants
 
-    rows = []
+    split_variants = []
     for variant in variants:
-        row = [_get_field_value(variant, config) for config in VARIANT_EXPORT_DATA]
-
-        family_saved_variants = saved_variants_by_variant_family.get(get_variant_key(**variant), {})
-        for family_guid in variant['familyGuids']:
-            variant_guid = family_saved_variants.get(family_guid, '')
-            family_tags = {
-                'family_id': family_ids_by_guid.get(family_guid),
-                'tags': [tag for tag in json_saved_variants['variantTagsByGuid'].values() if variant_guid in tag['variantGuids']],
-                'notes': [note for note in json_saved_variants['variantNotesByGuid'].values() if variant_guid in note['variantGuids']],
-            }
-            row += [_get_field_value(family_tags, config) for config in VARIANT_FAMILY_EXPORT_DATA]
-        row += ['' for i in range(len(VARIANT_FAMILY_EXPORT_DATA) * (max_families_per_variant - len(variant['familyGuids'])))]
-
-        genotypes = list(variant['genotypes'].values())
-        for genotype in genotypes:
-            row += [_get_field_value(genotype, config) for config in VARIANT_SAMPLE_DATA]
-        row += ['' for i in range(len(VARIANT_SAMPLE_DATA) * (max_samples_per_variant - len(genotypes)))]
-        rows.append(row)
+        if len(variant['familyGuids']) <= MAX_FAMILIES_PER_ROW:
+            split_variants.append(variant)
+            continue
+
+        num_split = ceil(len(variant['familyGuids']) / MAX_FAMILIES_PER_ROW)
+        gens_per_row = ceil(len(variant['genotypes']) / num_split)
+        gen_keys = list(variant['genotypes'].keys())
+        for i in range(num_split):
+            split_var = deepcopy(variant)
+            split_var['familyGuids'] = variant['familyGuids'][i*MAX_FAMILIES_PER_ROW:(i+1)*MAX_FAMILIES_PER_ROW]
+            split_gen = set(gen_keys[i*gens_per_row:(i+1)*gens_per_row])
+            split_var['genotypes'] = {k: v for k, v in variant['genotypes'].items() if k in split_gen}
+            split_variants.append(split_var)
+
+    return split_variants
+
+
+def _get_variant_export_row(variant, saved_variant_context, family_ids_by_guid, max_families_per_variant, max_samples_per_variant):
+    json_saved_variants, saved_variants_by_variant_family = saved_variant_context
+    row = [_get_field_value(variant, config) for config in VARIANT_EXPORT_DATA]
+
+    family_saved_variants = saved_variants_by_variant_family.get(get_variant_key(**variant), {})
+    for family_guid in variant['familyGuids']:
+        variant_guid = family_saved_variants.get(family_guid, '')
+        family_tags = {
+            'family_id': family_ids_by_guid.get(family_guid),
+            'tags': [tag for tag in json_saved_variants['variantTagsByGuid'].values() if variant_guid in tag['variantGuids']],
+            'notes': [note for note in json_saved_variants['variantNotesByGuid'].values() if variant_guid in note['variantGuids']],
+        }
+        row += [_get_field_value(family_tags, config) for config in VARIANT_FAMILY_EXPORT_DATA]
+    row += ['' for i in range(len(VARIANT_FAMILY_EXPORT_DATA) * (max_families_per_variant - len(variant['familyGuids'])))]
+
+    genotypes = list(variant['genotypes'].values())
+    for genotype in genotypes:
+        row += [_get_field_value(genotype, config) for config in VARIANT_SAMPLE_DATA]
+    row += ['' for i in range(len(VARIANT_SAMPLE_DATA) * (max_samples_per_variant - len(genotypes)))]
+    return row
 
+
+def _get_variant_export_header(max_families_per_variant, max_samples_per_variant):
     header = [config['header'] for config in VARIANT_EXPORT_DATA]
     for i in range(max_families_per_variant):
         header += ['{}_{}'.format(config['header'], i+1) for config in VARIANT_FAMILY_EXPORT_DATA]
     for i in range(max_samples_per_variant):
         header += ['{}_{}'.format(config['header'], i+1) for config in VARIANT_SAMPLE_DATA]
-
-    file_format = request.GET.get('file_format', 'tsv')
-
-    return export_table('search_results_{}'.format(search_hash), header, rows, file_format, titlecase_header=False)
+    return header
 
 
 def _get_field_value(value, config):
@@ -318,6 +318,7 @@ class VariantSearchAPITest(object):
              '', '2', 'Known gene for phenotype (None)|Excluded (None)', 'test n\xf8te (None)', '', '', '', '', '', '',
              '', '', '', '', '']]
         self.assertEqual(response.content, ('\n'.join(['\t'.join(line) for line in expected_content])+'\n').encode('utf-8'))
+        expected_content_no_split = expected_content
 
         # test export with max families
         with mock.patch('seqr.views.apis.variant_search_api.MAX_FAMILIES_PER_ROW', 1):
@@ -344,6 +345,61 @@ class VariantSearchAPITest(object):
         mock_get_variants.assert_called_with(results_model, page=1, load_all=True, user=self.collaborator_user)
         mock_error_logger.assert_not_called()
 
+        # Test streaming export
+        def _get_paged_es_variants(results_model, page=1, num_results=100, **kwargs):
+            results_model.save()
+            return deepcopy(VARIANTS[(page - 1) * num_results:page * num_results]), len(VARIANTS)
+        mock_get_variants.side_effect = _get_paged_es_variants
+        with mock.patch('seqr.views.apis.variant_search_api.EXPORT_PAGE_SIZE', 2):
+            response = self.client.get('{}?stream=true'.format(export_url))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode('utf-8')
+        # The header includes columns for every individual in the searched families, so rows are streamed in one pass
+        def _add_sample_columns(content, start, end):
+            return [content[0] + [
+                '{}_{}'.format(header, i) for i in range(start, end) for header in ['sample', 'num_alt_alleles', 'gq', 'ab']
+            ]] + [line + [''] * 4 * (end - start) for line in content[1:]]
+        expected_stream_content = _add_sample_columns(expected_content_no_split, 3, 6)
+        self.assertEqual(content, '\n'.join(['\t'.join(line) for line in expected_stream_content]) + '\n')
+        self.assertListEqual(mock_get_variants.call_args_list[-3:], [
+            mock.call(results_model, page=1, load_all=True, user=self.collaborator_user),
+            mock.call(results_model, page=1, num_results=2, user=self.collaborator_user),
+            mock.call(results_model, page=2, num_results=2, user=self.collaborator_user),
+        ])
+
+        with mock.patch('seqr.views.apis.variant_search_api.EXPORT_PAGE_SIZE', 2), \
+                mock.patch('seqr.views.apis.variant_search_api.MAX_FAMILIES_PER_ROW', 1):
+            response = self.client.get('{}?stream=true'.format(export_url))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                b''.join(response.streaming_content).decode('utf-8'),
+                '\n'.join(['\t'.join(line) for line in _add_sample_columns(expected_content, 2, 4)]) + '\n')
+
+        response = self.client.get('{}?stream=true&file_format=json'.format(export_url))
+        self.assertEqual(response.status_code, 200)
+        json_rows = [json.loads(row) for row in b''.join(response.streaming_content).decode('utf-8').split('\n') if row]
+        self.assertEqual(len(json_rows), 3)
+        self.assertEqual(json_rows[0]['sample_1'], 'NA19675')
+        self.assertEqual(json_rows[1]['sample_2'], '')
+        self.assertEqual(json_rows[0]['sample_5'], '')
+        self.assertListEqual(list(json_rows[0].keys()), expected_stream_content[0])
+
+        with mock.patch('seqr.views.apis.variant_search_api.MAX_VARIANTS', 3):
+            response = self.client.get('{}?stream=true'.format(export_url))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                response.json()['error'], 'Too many variants to load. Please refine your search and try again')
+
+            # Searches paged with search_after cursors are not limited
+            with mock.patch('seqr.views.apis.variant_search_api.has_search_cursors') as mock_has_search_cursors:
+                mock_has_search_cursors.return_value = True
+                response = self.client.get('{}?stream=true'.format(export_url))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8').split('\n')), 5)
+                mock_has_search_cursors.assert_called_with(results_model)
+        mock_get_variants.side_effect = _get_es_variants
+
         # Test gene breakdown
         gene_counts = {
             'ENSG00000227232': {'total': 2, 'families': {'F000001_1': 2, 'F000002_2': 1}},
@@ -742,7 +798,7 @@ class AnvilVariantSearchAPITest(AnvilAuthenticationTestCase, VariantSearchAPITes
 
     def test_query_variants(self, *args):
         super(AnvilVariantSearchAPITest, self).test_query_variants(*args)
-        assert_no_list_ws_has_al(self, 17)
+        assert_no_list_ws_has_al(self, 22)
 
     def test_query_all_projects_variants(self, *args):
         super(AnvilVariantSearchAPITest, self).test_query_all_projects_variants(*args)
@@ -1,10 +1,10 @@
 from django.db import connections
 import logging
-import redis
 from urllib3.connectionpool import connection_from_url
 
-from settings import SEQR_VERSION, KIBANA_SERVER, REDIS_SERVICE_HOSTNAME, REDIS_SERVICE_PORT, DATABASES
+from settings import SEQR_VERSION, KIBANA_SERVER, DATABASES
 from seqr.utils.elasticsearch.utils import get_es_client
+from seqr.utils.redis_utils import get_redis_client
 from seqr.views.utils.json_utils import create_json_response
 
 logger = logging.getLogger(__name__)
@@ -25,7 +25,7 @@ def status_view(request):
 
     # Test redis connection
     try:
-        redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, port=REDIS_SERVICE_PORT, socket_connect_timeout=3).ping()
+        get_redis_client().ping()
     except Exception as e:
         secondary_services_ok = False
         logger.error('Redis connection error: {}'.format(str(e)))
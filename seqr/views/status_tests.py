@@ -9,7 +9,7 @@ from seqr.views.utils.test_utils import urllib3_responses
 
 class StatusTest(TestCase):
 
-    @mock.patch('seqr.views.status.redis.StrictRedis')
+    @mock.patch('seqr.views.status.get_redis_client')
     @mock.patch('seqr.views.status.connections')
     @mock.patch('seqr.views.status.logger')
     @urllib3_responses.activate
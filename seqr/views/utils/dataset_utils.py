@@ -1,11 +1,16 @@
 import elasticsearch_dsl
-from collections import defaultdict
+from collections import defaultdict, Counter
+from django.db import connections
 from django.db.models import prefetch_related_objects
 from django.utils import timezone
 from tqdm import tqdm
+import os
 import random
+import shutil
 
 from seqr.models import Sample, Individual, Family, Project, RnaSeqOutlier, RnaSeqTpm
+from seqr.utils.elasticsearch.search_samples import invalidate_search_samples
+from seqr.utils.project_stats_utils import invalidate_project_stats
 from seqr.utils.elasticsearch.utils import get_es_client, get_index_metadata
 from seqr.utils.file_utils import file_iter
 from seqr.utils.logging_utils import log_model_bulk_update, SeqrLogger
@@ -257,6 +262,11 @@ def update_variant_samples(samples, user, elasticsearch_index, data_source=None,
 
         inactivate_sample_guids = Sample.bulk_update(user, {'is_active': False}, queryset=inactivate_samples)
 
+    if activated_sample_guids or inactivate_sample_guids:
+        invalidate_search_samples()
+        invalidate_project_stats(Individual.objects.filter(
+            id__in={sample.individual_id for sample in samples}).values_list('family__project_id', flat=True))
+
     return activated_sample_guids, inactivate_sample_guids
 
 
@@ -288,6 +298,8 @@ def match_and_update_samples(
     ]
     Family.bulk_update(
         user, {'analysis_status': Family.ANALYSIS_STATUS_ANALYSIS_IN_PROGRESS}, guid__in=family_guids_to_update)
+    if family_guids_to_update:
+        invalidate_project_stats([family.project_id for family in included_families])
 
     # refresh sample models to get updated values
     samples = Sample.objects.filter(id__in=[s.id for s in samples])
@@ -315,6 +327,13 @@ TISSUE_TYPE_MAP = {
 
 REVERSE_TISSUE_TYPE = {v: k for k, v in TISSUE_TYPE_MAP.items()}
 
+# Staged rows start with the gene id, which is used to find duplicate rows
+RNA_SEQ_DATA_COLUMNS = {
+    RnaSeqOutlier: [GENE_ID_COL] + [col for col in RNA_OUTLIER_COLUMNS.values() if col != GENE_ID_COL],
+    RnaSeqTpm: [GENE_ID_COL, 'tpm'],
+}
+RNA_SEQ_STAGING_CHUNK_SIZE = 100000
+
 def _parse_outlier_row(row, **kwargs):
     yield row['sampleID'], {mapped_key: row[key] for key, mapped_key in RNA_OUTLIER_COLUMNS.items()}
 
@@ -354,26 +373,67 @@ def _check_invalid_tissues(samples, sample_id_to_tissue_type, warnings):
 
     return [sample for sample in samples if sample not in invalid_tissues]
 
-def load_rna_seq_outlier(file_path, user=None, mapping_file=None, ignore_extra_samples=False):
+def load_rna_seq_outlier(file_path, staging_dir, user=None, mapping_file=None, ignore_extra_samples=False):
     expected_columns = ['sampleID'] + list(RNA_OUTLIER_COLUMNS.keys())
     return _load_rna_seq(
-        RnaSeqOutlier, file_path, user, mapping_file, ignore_extra_samples, _parse_outlier_row, expected_columns,
+        RnaSeqOutlier, file_path, staging_dir, user, mapping_file, ignore_extra_samples, _parse_outlier_row,
+        expected_columns,
     )
 
-def load_rna_seq_tpm(file_path, user=None, mapping_file=None, ignore_extra_samples=False):
+def load_rna_seq_tpm(file_path, staging_dir, user=None, mapping_file=None, ignore_extra_samples=False):
     sample_id_to_tissue_type = {}
     return _load_rna_seq(
-        RnaSeqTpm, file_path, user, mapping_file, ignore_extra_samples, _parse_tpm_row, TPM_HEADER_COLS,
+        RnaSeqTpm, file_path, staging_dir, user, mapping_file, ignore_extra_samples, _parse_tpm_row, TPM_HEADER_COLS,
         sample_id_to_tissue_type=sample_id_to_tissue_type, validate_samples=_check_invalid_tissues,
     )
 
-def _load_rna_seq(model_cls, file_path, user, mapping_file, ignore_extra_samples, parse_row, expected_columns,
-                  sample_id_to_tissue_type=None, validate_samples=None):
+def _escape_copy_value(value):
+    return value.replace('\\', '\\\\')
+
+def _write_staged_rows(rows_by_sample_id, staged_files, staging_dir):
+    for sample_id, rows in rows_by_sample_id.items():
+        if sample_id not in staged_files:
+            staged_files[sample_id] = os.path.join(staging_dir, f'{len(staged_files)}.tsv')
+        with open(staged_files[sample_id], 'a') as f:
+            f.writelines(rows)
+
+def _deduplicate_staged_rows(sample_id, file_path, data_columns):
+    # Only a single sample's rows are held in memory at a time
+    rows_by_gene = {}
+    has_duplicates = False
+    with open(file_path) as f:
+        for row in f:
+            gene_id = row.split('\t', 1)[0]
+            existing_row = rows_by_gene.get(gene_id)
+            if existing_row is None:
+                rows_by_gene[gene_id] = row
+            elif existing_row != row:
+                existing_data, row_data = [
+                    dict(zip(data_columns, r.rstrip('\n').split('\t'))) for r in [existing_row, row]]
+                raise ValueError(
+                    f'Error in {sample_id} data for {gene_id}: mismatched entries {existing_data} and {row_data}')
+            else:
+                has_duplicates = True
+
+    if has_duplicates:
+        with open(file_path, 'w') as f:
+            f.writelines(rows_by_gene.values())
+
+def _load_rna_seq(model_cls, file_path, staging_dir, user, mapping_file, ignore_extra_samples, parse_row,
+                  expected_columns, sample_id_to_tissue_type=None, validate_samples=None):
+    """
+    Parses an RNA-seq file and stages the data for each sample to load as a tsv file in the staging directory, in the
+    column order used by copy_rna_seq_sample_data. Parsed rows are written out in chunks, so memory use does not grow
+    with the size of the file. Returns the staged file path for each sample to load, and info and warning messages
+    """
     sample_id_to_individual_id_mapping = {}
     if mapping_file:
         sample_id_to_individual_id_mapping = load_mapping_file_content(mapping_file)
 
-    samples_by_id = defaultdict(dict)
+    data_columns = RNA_SEQ_DATA_COLUMNS[model_cls]
+    staged_files = {}
+    chunk_rows_by_sample_id = defaultdict(list)
+    num_chunk_rows = 0
     f = file_iter(file_path)
     header = _parse_tsv_row(next(f))
     missing_cols = set(expected_columns) - set(header)
@@ -383,19 +443,24 @@ def _load_rna_seq(model_cls, file_path, user, mapping_file, ignore_extra_samples
     for line in tqdm(f, unit=' rows'):
         row = dict(zip(header, _parse_tsv_row(line)))
         for sample_id, row_dict in parse_row(row, sample_id_to_tissue_type=sample_id_to_tissue_type):
-            gene_id = row_dict['gene_id']
-            existing_data = samples_by_id[sample_id].get(gene_id)
-            if existing_data and existing_data != row_dict:
-                raise ValueError(
-                    f'Error in {sample_id} data for {gene_id}: mismatched entries {existing_data} and {row_dict}')
-
             indiv_id = row_dict.pop(INDIV_ID_COL, None)
             if indiv_id and sample_id not in sample_id_to_individual_id_mapping:
                 sample_id_to_individual_id_mapping[sample_id] = indiv_id
 
-            samples_by_id[sample_id][gene_id] = row_dict
+            chunk_rows_by_sample_id[sample_id].append(
+                '\t'.join([_escape_copy_value(row_dict[col]) for col in data_columns]) + '\n')
+            num_chunk_rows += 1
+
+        if num_chunk_rows >= RNA_SEQ_STAGING_CHUNK_SIZE:
+            _write_staged_rows(chunk_rows_by_sample_id, staged_files, staging_dir)
+            chunk_rows_by_sample_id.clear()
+            num_chunk_rows = 0
+    _write_staged_rows(chunk_rows_by_sample_id, staged_files, staging_dir)
 
-    message = f'Parsed {len(samples_by_id)} RNA-seq samples'
+    for sample_id, staged_file in staged_files.items():
+        _deduplicate_staged_rows(sample_id, staged_file, data_columns)
+
+    message = f'Parsed {len(staged_files)} RNA-seq samples'
     info = [message]
     logger.info(message, user)
 
@@ -403,7 +468,7 @@ def _load_rna_seq(model_cls, file_path, user, mapping_file, ignore_extra_samples
     samples, _, _, _, _, remaining_sample_ids = match_and_update_samples(
         projects=Project.objects.filter(projectcategory__name=ANALYST_PROJECT_CATEGORY),
         user=user,
-        sample_ids=samples_by_id.keys(),
+        sample_ids=staged_files.keys(),
         data_source=data_source,
         sample_type=Sample.SAMPLE_TYPE_RNA,
         sample_id_to_individual_id_mapping=sample_id_to_individual_id_mapping,
@@ -427,9 +492,22 @@ def _load_rna_seq(model_cls, file_path, user, mapping_file, ignore_extra_samples
 
     loaded_sample_ids = set(model_cls.objects.filter(sample__in=samples).values_list('sample_id', flat=True).distinct())
     samples_to_load = {
-        sample: samples_by_id[sample.sample_id] for sample in samples if sample.id not in loaded_sample_ids
+        sample: get_staged_rna_seq_sample_file(staging_dir, sample.guid) for sample in samples
+        if sample.id not in loaded_sample_ids
     }
 
+    # Stage data by sample guid, and remove staged data which will not be loaded
+    num_staged_file_uses = Counter(sample.sample_id for sample in samples_to_load)
+    for sample, sample_file in samples_to_load.items():
+        num_staged_file_uses[sample.sample_id] -= 1
+        if num_staged_file_uses[sample.sample_id]:
+            shutil.copyfile(staged_files[sample.sample_id], sample_file)
+        else:
+            os.replace(staged_files[sample.sample_id], sample_file)
+    for sample_id, staged_file in staged_files.items():
+        if sample_id not in num_staged_file_uses:
+            os.remove(staged_file)
+
     prefetch_related_objects(list(samples_to_load.keys()), 'individual__family__project')
     projects = {sample.individual.family.project.name for sample in samples_to_load}
     project_names = ', '.join(sorted(projects))
@@ -449,3 +527,33 @@ def _load_rna_seq(model_cls, file_path, user, mapping_file, ignore_extra_samples
         logger.warning(warning, user)
 
     return samples_to_load, info, warnings
+
+def get_staged_rna_seq_sample_file(staging_dir, sample_guid):
+    return os.path.join(staging_dir, f'{sample_guid}.tsv')
+
+class _StagedRowsFile(object):
+    """File-like wrapper for COPY which prefixes each staged row with the sample's database id"""
+
+    def __init__(self, f, sample_id):
+        self._file = f
+        self._prefix = f'{sample_id}\t'
+
+    def read(self, size=-1):
+        rows = []
+        num_chars = 0
+        while size < 0 or num_chars < size:
+            row = self._file.readline()
+            if not row:
+                break
+            rows.append(self._prefix + row)
+            num_chars += len(self._prefix) + len(row)
+        return ''.join(rows)
+
+def copy_rna_seq_sample_data(model_cls, sample, file_path):
+    """Loads a sample's staged data with postgres COPY, without building model instances. Returns the number of rows"""
+    columns = [model_cls._meta.get_field('sample').column] + RNA_SEQ_DATA_COLUMNS[model_cls]
+    with open(file_path) as f, connections['default'].cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {model_cls._meta.db_table} ({", ".join(columns)}) FROM STDIN', _StagedRowsFile(f, sample.id),
+        )
+        return cursor.rowcount
@@ -4,7 +4,7 @@ import openpyxl as xl
 from tempfile import NamedTemporaryFile
 import zipfile
 
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 
 from seqr.views.utils.json_utils import _to_title_case
 
@@ -13,6 +13,11 @@ DELIMITERS = {
     'tsv': '\t',
 }
 
+TEXT_CONTENT_TYPES = {
+    'tsv': 'text/tsv',
+    'json': 'application/json',
+}
+
 
 def export_table(filename_prefix, header, rows, file_format='tsv', titlecase_header=True):
     """Generates an HTTP response for a table with the given header and rows, exported into the given file_format.
@@ -27,24 +32,12 @@ def export_table(filename_prefix, header, rows, file_format='tsv', titlecase_hea
     """
 
     for i, row in enumerate(rows):
-        if len(header) != len(row):
-            raise ValueError('len(header) != len(row): %s != %s\n%s\n%s' % (
-                len(header), len(row), ','.join(header), ','.join(row)))
-        rows[i] = ['' if value is None else value for value in row]
-
-    if file_format == "tsv":
-        response = HttpResponse(content_type='text/tsv')
-        response['Content-Disposition'] = 'attachment; filename="{}.tsv"'.format(filename_prefix).encode('ascii', 'ignore')
-        response.writelines(['\t'.join(header)+'\n'])
-        response.writelines(('\t'.join(map(str, row))+'\n' for row in rows))
-        return response
-    elif file_format == "json":
-        response = HttpResponse(content_type='application/json')
-        response['Content-Disposition'] = 'attachment; filename="{}.json"'.format(filename_prefix).encode('ascii', 'ignore')
-        for row in rows:
-            json_keys = [s.replace(" ", "_").lower() for s in header]
-            json_values = list(map(str, row))
-            response.write(json.dumps(OrderedDict(zip(json_keys, json_values)))+'\n')
+        rows[i] = _validate_row(header, row)
+
+    if file_format in TEXT_CONTENT_TYPES:
+        response = HttpResponse(content_type=TEXT_CONTENT_TYPES[file_format])
+        _set_attachment_filename(response, filename_prefix, file_format)
+        response.writelines(_format_rows(header, rows, file_format))
         return response
     elif file_format == "xls":
         wb = xl.Workbook(write_only=True)
@@ -64,6 +57,50 @@ def export_table(filename_prefix, header, rows, file_format='tsv', titlecase_hea
         raise ValueError("Invalid file_format: %s" % file_format)
 
 
+def export_table_stream(filename_prefix, header, rows, file_format='tsv'):
+    """Generates a streaming HTTP response for a table, formatting each row as it is generated.
+
+    Args:
+        filename_prefix (string): Filename without the extension.
+        header (list): List of column names
+        rows (iterable): Iterable of rows, where each row is a list of column values. May be a generator
+        file_format (string): "tsv" or "json"
+    Returns:
+        Django StreamingHttpResponse object with the table data as an attachment.
+    """
+    if file_format not in TEXT_CONTENT_TYPES:
+        raise ValueError("Invalid file_format: %s" % file_format)
+
+    response = StreamingHttpResponse(
+        _format_rows(header, (_validate_row(header, row) for row in rows), file_format),
+        content_type=TEXT_CONTENT_TYPES[file_format])
+    _set_attachment_filename(response, filename_prefix, file_format)
+    return response
+
+
+def _validate_row(header, row):
+    if len(header) != len(row):
+        raise ValueError('len(header) != len(row): %s != %s\n%s\n%s' % (
+            len(header), len(row), ','.join(header), ','.join(map(str, row))))
+    return ['' if value is None else value for value in row]
+
+
+def _format_rows(header, rows, file_format):
+    if file_format == 'tsv':
+        yield '\t'.join(header)+'\n'
+        for row in rows:
+            yield '\t'.join(map(str, row))+'\n'
+    else:
+        json_keys = [s.replace(" ", "_").lower() for s in header]
+        for row in rows:
+            yield json.dumps(OrderedDict(zip(json_keys, map(str, row))))+'\n'
+
+
+def _set_attachment_filename(response, filename_prefix, file_format):
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename_prefix, file_format).encode(
+        'ascii', 'ignore')
+
+
 def export_multiple_files(files, zip_filename, file_format='csv', add_header_prefix=False, blank_value=''):
     if file_format not in DELIMITERS:
         raise ValueError('Invalid file_format: {}'.format(file_format))
@@ -5,7 +5,7 @@ from openpyxl import load_workbook
 from io import BytesIO
 import mock
 
-from seqr.views.utils.export_utils import export_table, export_multiple_files
+from seqr.views.utils.export_utils import export_table, export_table_stream, export_multiple_files
 
 
 class ExportTableUtilsTest(TestCase):
@@ -42,6 +42,32 @@ class ExportTableUtilsTest(TestCase):
             export_table('test_file', ['column1'], rows)
         self.assertEqual(str(cm.exception), 'len(header) != len(row): 1 != 2\ncolumn1\nrow1_v1\xe2,row1_v2')
 
+    def test_export_table_stream(self):
+        header = ['column 1', 'column2']
+        rows = [['row1_v1\xe2', None], ['row2_v1', 2]]
+
+        response = export_table_stream('test_file', header, iter(rows), file_format='tsv')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response.get('content-disposition'), 'attachment; filename="test_file.tsv"')
+        self.assertEqual(
+            b''.join(response.streaming_content), 'column 1\tcolumn2\nrow1_v1\xe2\t\nrow2_v1\t2\n'.encode('utf-8'))
+
+        response = export_table_stream('test_file', header, iter(rows), file_format='json')
+        self.assertEqual(response.get('content-disposition'), 'attachment; filename="test_file.json"')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode('utf-8'),
+            '{"column_1": "row1_v1\\u00e2", "column2": ""}\n{"column_1": "row2_v1", "column2": "2"}\n')
+
+        with self.assertRaises(ValueError) as cm:
+            export_table_stream('test_file', header, iter(rows), file_format='xls')
+        self.assertEqual(str(cm.exception), 'Invalid file_format: xls')
+
+        response = export_table_stream('test_file', ['column1'], iter(rows))
+        with self.assertRaises(ValueError) as cm:
+            b''.join(response.streaming_content)
+        self.assertEqual(str(cm.exception), 'len(header) != len(row): 1 != 2\ncolumn1\nrow1_v1\xe2,None')
+
     @mock.patch('seqr.views.utils.export_utils.zipfile.ZipFile')
     def test_export_multiple_files(self, mock_zip):
         mock_zip_content = {}
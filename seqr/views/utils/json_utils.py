@@ -1,8 +1,18 @@
+import json
+import logging
+import orjson
 import re
 
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.core.serializers.json import DjangoJSONEncoder
 
+from settings import PRETTY_PRINT_JSON_RESPONSES
+
+logger = logging.getLogger(__name__)
+
+# Datetimes are passed through to the encoder default so they are formatted the same as by the standard django encoder
+ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
 
 class DjangoJSONEncoderWithSets(DjangoJSONEncoder):
 
@@ -13,6 +23,26 @@ class DjangoJSONEncoderWithSets(DjangoJSONEncoder):
         return super(DjangoJSONEncoderWithSets, self).default(o)
 
 
+class CompactJsonResponse(HttpResponse):
+    """An HttpResponse with the given object encoded as compact json, using orjson when possible"""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super(CompactJsonResponse, self).__init__(content=_compact_json_dumps(data), **kwargs)
+
+
+def _compact_json_dumps(obj):
+    default = DjangoJSONEncoderWithSets().default
+    try:
+        return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+    except TypeError as e:
+        # orjson does not support some values the standard library does, such as integers larger than 64 bits
+        logger.warning('Unable to encode json response with orjson: {}'.format(e))
+        return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=default)
+
+
 def create_json_response(obj, **kwargs):
     """Encodes the give object into json and create a django JsonResponse object with it.
 
@@ -23,6 +53,9 @@ def create_json_response(obj, **kwargs):
         JsonResponse
     """
 
+    if not PRETTY_PRINT_JSON_RESPONSES:
+        return CompactJsonResponse(obj, **kwargs)
+
     dumps_params = {
         'sort_keys': True,
         'indent': 4,
@@ -0,0 +1,43 @@
+import json
+import mock
+from datetime import datetime, timezone
+from decimal import Decimal
+from django.test import TestCase
+
+from seqr.views.utils.json_utils import create_json_response
+
+
+class JsonUtilsTest(TestCase):
+
+    def test_create_json_response(self):
+        obj = {
+            'b': {2: 'two', 1: 'one'},
+            'a': [{'samples': {'NA19675'}}, None, True, 1.5],
+            'created': datetime(2020, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc),
+            'decimal': Decimal('1.10'),
+            'name': 'nåme',
+        }
+        response = create_json_response(obj, status=201)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(
+            response.content.decode('utf-8'),
+            '{"a":[{"samples":["NA19675"]},null,true,1.5],"b":{"1":"one","2":"two"},'
+            '"created":"2020-01-02T03:04:05.123Z","decimal":"1.10","name":"nåme"}')
+
+        with mock.patch('seqr.views.utils.json_utils.PRETTY_PRINT_JSON_RESPONSES', True):
+            pretty_response = create_json_response(obj, status=201)
+        self.assertEqual(pretty_response.status_code, 201)
+        self.assertTrue(pretty_response.content.decode('utf-8').startswith('{\n    "a": [\n'))
+        self.assertDictEqual(json.loads(pretty_response.content), json.loads(response.content))
+
+        # Values not supported by orjson fall back to the standard encoder
+        with mock.patch('seqr.views.utils.json_utils.logger') as mock_logger:
+            response = create_json_response({'count': 2 ** 70})
+        self.assertEqual(response.content.decode('utf-8'), '{"count":1180591620717411303424}')
+        mock_logger.warning.assert_called_with('Unable to encode json response with orjson: Integer exceeds 64-bit range')
+
+        response = create_json_response(['a', 'b'], safe=False)
+        self.assertListEqual(json.loads(response.content), ['a', 'b'])
+        with self.assertRaises(TypeError):
+            create_json_response(['a', 'b'])
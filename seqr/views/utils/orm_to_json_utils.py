@@ -9,7 +9,6 @@ from django.db.models.fields.files import ImageFieldFile
 from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 
-from reference_data.models import HumanPhenotypeOntology
 from seqr.models import GeneNote, VariantNote, VariantTag, VariantFunctionalData, SavedVariant, CAN_EDIT, \
     get_audit_field_names
 from seqr.views.utils.json_utils import _to_camel_case
@@ -337,20 +336,18 @@ def _get_json_for_individuals(individuals, user=None, project_guid=None, family_
 
 
 def _add_individual_hpo_details(parsed_individuals):
-    all_hpo_ids = set()
-    for i in parsed_individuals:
-        all_hpo_ids.update([feature['id'] for feature in i.get('features') or []])
-        all_hpo_ids.update([feature['id'] for feature in i.get('absentFeatures') or []])
-    hpo_terms_by_id = {hpo.hpo_id: hpo for hpo in HumanPhenotypeOntology.objects.filter(hpo_id__in=all_hpo_ids)}
+    # Imported here as hpo_utils imports gene_utils, which imports this module
+    from seqr.utils.hpo_utils import get_hpo_ontology
+    hpo_ontology = get_hpo_ontology()
     for i in parsed_individuals:
         for feature in i.get('features') or []:
-            hpo = hpo_terms_by_id.get(feature['id'])
+            hpo = hpo_ontology.get_term(feature['id'])
             if hpo:
-                feature.update({'category': hpo.category_id, 'label': hpo.name})
+                feature.update({'category': hpo['category_id'], 'label': hpo['name']})
         for feature in i.get('absentFeatures') or []:
-            hpo = hpo_terms_by_id.get(feature['id'])
+            hpo = hpo_ontology.get_term(feature['id'])
             if hpo:
-                feature.update({'category': hpo.category_id, 'label': hpo.name})
+                feature.update({'category': hpo['category_id'], 'label': hpo['name']})
 
 
 def _get_json_for_individual(individual, user=None, **kwargs):
@@ -9,6 +9,7 @@ from urllib.parse import quote_plus, urlparse
 from urllib3_mock import Responses
 
 from seqr.models import Project, CAN_VIEW, CAN_EDIT
+from seqr.utils.gene_utils import GENE_JSON_CACHE, REFERENCE_DATA_INDEX_CACHE
 
 WINDOW_REGEX_TEMPLATE = 'window\.{key}=(?P<value>[^)<]+)'
 
@@ -41,6 +42,10 @@ class AuthenticationTestCase(TestCase):
         patcher = mock.patch('seqr.views.utils.permissions_utils.SEQR_TOS_VERSION', 1.3)
         patcher.start()
         self.addCleanup(patcher.stop)
+        # Fixtures load reference data without bumping the reference data version, so genes cached by earlier tests
+        # may be stale
+        GENE_JSON_CACHE.clear()
+        REFERENCE_DATA_INDEX_CACHE.clear()
 
     @classmethod
     def setUpTestData(cls):
@@ -1,17 +1,17 @@
 from collections import defaultdict
 import logging
-import redis
 
 from seqr.models import SavedVariant, VariantSearchResults, Family, LocusList, LocusListInterval, LocusListGene, \
     RnaSeqOutlier, RnaSeqTpm
-from seqr.utils.elasticsearch.utils import get_es_variants_for_variant_ids
+from seqr.utils.elasticsearch.search_samples import invalidate_search_samples
+from seqr.utils.elasticsearch.utils import get_es_variants_for_variant_ids, invalidate_index_metadata
 from seqr.utils.gene_utils import get_genes_for_variants
+from seqr.utils.redis_utils import get_redis_client
 from seqr.views.utils.json_to_orm_utils import update_model_from_json
 from seqr.views.utils.orm_to_json_utils import get_json_for_discovery_tags, get_json_for_locus_lists, \
     _get_json_for_models, get_json_for_rna_seq_outliers, get_json_for_saved_variants_with_tags
 from seqr.views.utils.permissions_utils import has_case_review_permissions, user_is_analyst
 from seqr.views.utils.project_context_utils import add_project_tag_types, add_families_context
-from settings import REDIS_SERVICE_HOSTNAME, REDIS_SERVICE_PORT
 
 logger = logging.getLogger(__name__)
 
@@ -52,8 +52,9 @@ def update_project_saved_variant_json(project, family_id=None, user=None):
 
 
 def reset_cached_search_results(project, reset_index_metadata=False):
+    invalidate_search_samples()
     try:
-        redis_client = redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, port=REDIS_SERVICE_PORT, socket_connect_timeout=3)
+        redis_client = get_redis_client()
         keys_to_delete = []
         if project:
             result_guids = [res.guid for res in VariantSearchResults.objects.filter(families__project=project)]
@@ -63,6 +64,8 @@ def reset_cached_search_results(project, reset_index_metadata=False):
             keys_to_delete = redis_client.keys(pattern='search_results__*')
         if reset_index_metadata:
             keys_to_delete += redis_client.keys(pattern='index_metadata__*')
+            keys_to_delete += redis_client.keys(pattern='index_metadata_aliases__*')
+            invalidate_index_metadata()
         if keys_to_delete:
             redis_client.delete(*keys_to_delete)
             logger.info('Reset {} cached results'.format(len(keys_to_delete)))
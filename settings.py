@@ -250,6 +250,9 @@ TEMPLATE_DIRS = [
     os.path.join(BASE_DIR, 'ui/dist'),
 ]
 
+# API responses are compact json by default. Pretty printing is slower and larger, but can be enabled for debugging
+PRETTY_PRINT_JSON_RESPONSES = os.environ.get('PRETTY_PRINT_JSON_RESPONSES') == 'true'
+
 DEPLOYMENT_TYPE = os.environ.get('DEPLOYMENT_TYPE')
 if DEPLOYMENT_TYPE in {'prod', 'dev'}:
     SESSION_COOKIE_SECURE = True
@@ -331,6 +334,16 @@ if ELASTICSEARCH_CA_PATH:
     ES_SSL_CONTEXT = create_default_context(cafile=ELASTICSEARCH_CA_PATH)
 else:
     ES_SSL_CONTEXT = None
+# Elasticsearch clients are shared within a process. The pool size is the max number of open connections per node, and
+# clients are recreated after the max age (in seconds, 0 to never recreate) so idle keep-alive connections are refreshed
+ELASTICSEARCH_CONNECTION_POOL_SIZE = int(os.environ.get('ELASTICSEARCH_CONNECTION_POOL_SIZE', '10'))
+ELASTICSEARCH_CLIENT_MAX_AGE = int(os.environ.get('ELASTICSEARCH_CLIENT_MAX_AGE', '3600'))
+# Interval in seconds to refresh the list of cluster nodes. Sniffing is disabled if not set
+ELASTICSEARCH_SNIFF_INTERVAL = int(os.environ.get('ELASTICSEARCH_SNIFF_INTERVAL', '0'))
+# Number of threads used to search multiple indices as separate requests, and the timeout in seconds for each of those
+# requests. If not set, multiple indices are searched with a single multi-search request
+ELASTICSEARCH_PARALLEL_SEARCH_WORKERS = int(os.environ.get('ELASTICSEARCH_PARALLEL_SEARCH_WORKERS', '0'))
+ELASTICSEARCH_INDEX_SEARCH_TIMEOUT = int(os.environ.get('ELASTICSEARCH_INDEX_SEARCH_TIMEOUT', '120'))
 
 KIBANA_SERVER = '{host}:{port}'.format(
     host=os.environ.get('KIBANA_SERVICE_HOSTNAME', 'localhost'),
@@ -340,6 +353,7 @@ KIBANA_ELASTICSEARCH_PASSWORD = os.environ.get('KIBANA_ES_PASSWORD')
 
 REDIS_SERVICE_HOSTNAME = os.environ.get('REDIS_SERVICE_HOSTNAME', 'localhost')
 REDIS_SERVICE_PORT = int(os.environ.get('REDIS_SERVICE_PORT', '6379'))
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', '50'))
 
 # Matchmaker
 MME_DEFAULT_CONTACT_NAME = 'Samantha Baxter'